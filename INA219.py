@@ -1,6 +1,12 @@
-import smbus
 import time
 
+from collections import namedtuple
+
+try:
+    import smbus
+except ImportError:  # Only required to open the I2C bus, see `INA219(bus=...)`
+    smbus = None
+
 # Config Register (R/W)
 _REG_CONFIG                 = 0x00
 # SHUNT VOLTAGE REGISTER (R)
@@ -56,9 +62,18 @@ class Mode:
     SANDBVOLT_CONTINUOUS    = 0x07      # shunt and bus voltage continuous
 
 
+# All the measurements, read in a single pass
+Reading = namedtuple("Reading", ["bus_voltage_V", "shunt_voltage_mV", "current_mA", "power_W"])
+
+
+def _signed(value):
+    return value - 65535 if value > 32767 else value
+
+
 class INA219:
-    def __init__(self, i2c_bus=1, addr=0x40):
-        self.bus = smbus.SMBus(i2c_bus);
+    def __init__(self, i2c_bus=1, addr=0x40, bus=None):
+        # `bus`: any object with the `smbus.SMBus` block read / write methods
+        self.bus = bus if bus is not None else smbus.SMBus(i2c_bus)
         self.addr = addr
 
         # Set chip to known config values to start
@@ -163,27 +178,32 @@ class INA219:
                       self.mode
         self.write(_REG_CONFIG,self.config)
 
-    def getShuntVoltage_mV(self):
+    def check_calibration(self):
+        """Rewrites the calibration register if the chip lost it (e.g. after a brownout).
+           Returns True if it had to be rewritten.
+        """
+        if self.read(_REG_CALIBRATION) == self._cal_value:
+            return False
         self.write(_REG_CALIBRATION,self._cal_value)
-        value = self.read(_REG_SHUNTVOLTAGE)
-        if value > 32767:
-            value -= 65535
-        return value * 0.01
+        return True
+
+    def getShuntVoltage_mV(self):
+        return _signed(self.read(_REG_SHUNTVOLTAGE)) * 0.01
 
     def getBusVoltage_V(self):
-        self.write(_REG_CALIBRATION,self._cal_value)
-        self.read(_REG_BUSVOLTAGE)
         return (self.read(_REG_BUSVOLTAGE) >> 3) * 0.004
 
     def getCurrent_mA(self):
-        value = self.read(_REG_CURRENT)
-        if value > 32767:
-            value -= 65535
-        return value * self._current_lsb
+        return _signed(self.read(_REG_CURRENT)) * self._current_lsb
 
     def getPower_W(self):
-        self.write(_REG_CALIBRATION,self._cal_value)
-        value = self.read(_REG_POWER)
-        if value > 32767:
-            value -= 65535
-        return value * self._power_lsb
+        return _signed(self.read(_REG_POWER)) * self._power_lsb
+
+    def read_all(self):
+        """Reads every measurement register back to back, without any write"""
+        return Reading(
+            bus_voltage_V=self.getBusVoltage_V(),
+            shunt_voltage_mV=self.getShuntVoltage_mV(),
+            current_mA=self.getCurrent_mA(),
+            power_W=self.getPower_W()
+        )
@@ -28,7 +28,8 @@
 import LCD_Config
 import RPi.GPIO as GPIO
 import time
-import numpy as np
+
+from lcd_framebuffer import FrameBuffer
 
 LCD_1IN44 = 1
 LCD_1IN8 = 0
@@ -67,6 +68,7 @@ class LCD:
 		self.LCD_Scan_Dir = SCAN_DIR_DFT
 		self.LCD_X_Adjust = LCD_X
 		self.LCD_Y_Adjust = LCD_Y
+		self._framebuffer = None
 
 	"""    Hardware reset     """
 	def  LCD_Reset(self):
@@ -298,19 +300,28 @@ class LCD:
 		for i in range(0,len(_buffer),4096):
 			LCD_Config.SPI_Write_Byte(_buffer[i:i+4096])
 
-	def LCD_ShowImage(self,Image,Xstart,Ystart):
+	#/********************************************************************************
+	#function:	Display an image, only the regions listed in `rects` if provided
+	#parameter: 
+	#	rects 	:   list of (Xstart, Ystart, Xend, Yend) damaged regions, Xend / Yend excluded
+	#********************************************************************************/
+	def LCD_ShowImage(self,Image,Xstart,Ystart,rects=None):
 		if (Image == None):
 			return
 		imwidth, imheight = Image.size
 		if imwidth != self.width or imheight != self.height:
 			raise ValueError('Image must be same dimensions as display \
 				({0}x{1}).' .format(self.width, self.height))
-		img = np.asarray(Image)
-		pix = np.zeros((self.width,self.height,2), dtype = np.uint8)
-		pix[...,[0]] = np.add(np.bitwise_and(img[...,[0]],0xF8),np.right_shift(img[...,[1]],5))
-		pix[...,[1]] = np.add(np.bitwise_and(np.left_shift(img[...,[1]],3),0xE0),np.right_shift(img[...,[2]],3))
-		pix = pix.flatten().tolist()
-		self.LCD_SetWindows(0, 0, self.width , self.height)
-		GPIO.output(LCD_Config.LCD_DC_PIN, GPIO.HIGH)
-		for i in range(0,len(pix),4096):
-			LCD_Config.SPI_Write_Byte(pix[i:i+4096])
\ No newline at end of file
+		if self._framebuffer is None or (self._framebuffer.width, self._framebuffer.height) != (self.width, self.height):
+			self._framebuffer = FrameBuffer(self.width, self.height)
+		if rects is None:
+			self._framebuffer.update(Image)
+			self.LCD_SetWindows(0, 0, self.width , self.height)
+			GPIO.output(LCD_Config.LCD_DC_PIN, GPIO.HIGH)
+			LCD_Config.SPI_Write_Buffer(self._framebuffer.as_bytes())
+			return
+		self._framebuffer.update(Image, rects)
+		for rect in rects:
+			self.LCD_SetWindows(*rect)
+			GPIO.output(LCD_Config.LCD_DC_PIN, GPIO.HIGH)
+			LCD_Config.SPI_Write_Buffer(self._framebuffer.as_bytes(rect))
\ No newline at end of file
@@ -46,6 +46,15 @@ def Driver_Delay_ms(xms):
 def SPI_Write_Byte(data):
     SPI.writebytes(data)
 
+def SPI_Write_Buffer(data):
+    # writebytes2 (spidev >= 3.4) takes any buffer and splits it into SPI transfers itself
+    if hasattr(SPI, "writebytes2"):
+        SPI.writebytes2(data)
+    else:
+        data = bytes(data)
+        for i in range(0, len(data), 4096):
+            SPI.writebytes(list(data[i:i+4096]))
+
 def GPIO_Init():
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
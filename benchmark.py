@@ -0,0 +1,631 @@
+#!/usr/bin/env python
+""" Copy / scan / hash throughput benchmarks on synthetic GoPro-like trees.
+
+Copy, scan and hash benchmarks run against one or more filesystems:
+    - tmpfs: two folders in /dev/shm
+    - vfat / exfat: two loop-mounted images (requires root and mkfs.<fs>)
+    - throttled: tmpfs behind a file wrapper simulating a USB 2.0 SD reader
+
+The durability benchmark copies the same files with each `copy_utils.WritePolicy`
+durability mode, plus the former policy (no preallocation, no fadvise, no
+sync), and samples `/proc/meminfo` meanwhile: page cache growth and dirty
+memory are the memory pressure put on the Pi.
+
+The LCD benchmark compares the RGB565 conversion of `LCD_ShowImage` before
+and after `lcd_framebuffer.FrameBuffer`, without the SPI transfer itself.
+The render benchmark compares selector / copy progress frames drawn from
+scratch and composed from `render_cache.RenderCache`.
+
+Usage:
+    python benchmark.py --output logs/bench.json
+    sudo python benchmark.py --filesystems tmpfs vfat exfat throttled \\
+        --sizes 64 512 --count 4 --buffer-sizes 0.25 1 4
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from PIL import Image
+from PIL import ImageDraw
+
+import copy_utils
+
+from lcd_framebuffer import FrameBuffer
+from listing_snapshot import ListingSnapshot
+from render_cache import RenderCache
+from runtime import USBDevice
+from runtime import VideoFile
+from verify import hash_file
+
+
+MB = 1024 * 1024
+
+FS_TMPFS = "tmpfs"
+FS_VFAT = "vfat"
+FS_EXFAT = "exfat"
+FS_THROTTLED = "throttled"
+
+# USB 2.0 SD card reader
+THROTTLED_READ_MBPS = 20
+THROTTLED_WRITE_MBPS = 15
+THROTTLED_LATENCY_MS = 1
+
+
+class ThrottledFile(io.RawIOBase):
+    """ Wraps an unbuffered file, each request costs `latency` plus its size
+    divided by `bandwidth`. Has no file descriptor, so only the userspace copy
+    engines can use it.
+    """
+
+    def __init__(self, raw, read_mbps, write_mbps, latency_ms):
+        self._raw = raw
+        self._read_bps = read_mbps * MB
+        self._write_bps = write_mbps * MB
+        self._latency = latency_ms / 1000
+
+    def readable(self):
+        return self._raw.readable()
+
+    def writable(self):
+        return self._raw.writable()
+
+    def readinto(self, buffer):
+        size = self._raw.readinto(buffer)
+        time.sleep(self._latency + size / self._read_bps)
+        return size
+
+    def write(self, buffer):
+        size = self._raw.write(buffer)
+        time.sleep(self._latency + size / self._write_bps)
+        return size
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def make_gopro_tree(root, sizes_mb, count):
+    """ Creates `DCIM/100GOPRO/GX01xxxx.MP4` files with MP4 atoms, returns their paths """
+    video_dir = Path(root) / "DCIM" / "100GOPRO"
+    video_dir.mkdir(parents=True, exist_ok=True)
+    (Path(root) / "Get_started_with_GoPro.url").touch()
+
+    # Random block repeated with a counter: incompressible enough, fast to write
+    block = bytearray(os.urandom(MB))
+
+    files = list()
+    for idx in range(count):
+        size = int(sizes_mb[idx % len(sizes_mb)] * MB)
+        path = video_dir / f"GX01{idx:04d}.MP4"
+
+        moov = b"\0" * 4096
+        mdat_size = max(0, size - 24 - (8 + len(moov)))
+        with open(path, "wb") as f:
+            f.write(struct.pack(">I4s8s", 16, b"ftyp", b"mp41\0\0\0\0"))
+            f.write(struct.pack(">I4s", mdat_size + 8, b"mdat"))
+            written = 0
+            while written < mdat_size:
+                block[:8] = struct.pack(">Q", idx * 1_000_000 + written)
+                chunk = min(len(block), mdat_size - written)
+                f.write(block[:chunk])
+                written += chunk
+            f.write(struct.pack(">I4s", len(moov) + 8, b"moov") + moov)
+
+        files.append(path)
+
+    return files
+
+
+def drop_caches():
+    """ Flushes the page cache so that reads hit the device, requires root """
+    os.sync()
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3")
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def _loop_mount(fstype, size_mb):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{fstype}_")
+    image = os.path.join(workdir, "disk.img")
+    mountpoint = os.path.join(workdir, "mnt")
+    os.makedirs(mountpoint)
+
+    with open(image, "wb") as f:
+        f.truncate(size_mb * MB)
+
+    subprocess.run([f"mkfs.{fstype}", image], check=True, capture_output=True)
+    subprocess.run(
+        ["mount", "-o", f"loop,uid={os.getuid()},gid={os.getgid()}", image, mountpoint],
+        check=True, capture_output=True
+    )
+    try:
+        yield mountpoint
+    finally:
+        subprocess.run(["umount", mountpoint], capture_output=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextmanager
+def filesystem_pair(fstype, size_mb):
+    """ Yields (source root, target root) on two distinct filesystems if possible """
+    if fstype in (FS_TMPFS, FS_THROTTLED):
+        workdir = tempfile.mkdtemp(prefix="bench_", dir="/dev/shm")
+        try:
+            source, target = os.path.join(workdir, "src"), os.path.join(workdir, "dst")
+            os.makedirs(source)
+            os.makedirs(target)
+            yield source, target
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    else:
+        with _loop_mount(fstype, size_mb) as source:
+            with _loop_mount(fstype, size_mb) as target:
+                yield source, target
+
+
+def _timed(fn):
+    start_t, start_cpu = time.perf_counter(), time.process_time()
+    result = fn()
+    return result, time.perf_counter() - start_t, time.process_time() - start_cpu
+
+
+def bench_copy(fstype, files, target_root, engine, buffer_size, digests, cold):
+    total_size = sum(os.stat(f).st_size for f in files)
+    target_dir = Path(target_root) / "copy"
+    shutil.rmtree(target_dir, ignore_errors=True)
+    target_dir.mkdir()
+
+    if cold:
+        drop_caches()
+
+    def copy_all():
+        for source_f in files:
+            if fstype == FS_THROTTLED:
+                with ThrottledFile(
+                    open(source_f, "rb", buffering=0),
+                    THROTTLED_READ_MBPS, THROTTLED_WRITE_MBPS, THROTTLED_LATENCY_MS
+                ) as fsrc, ThrottledFile(
+                    open(target_dir / source_f.name, "wb", buffering=0),
+                    THROTTLED_READ_MBPS, THROTTLED_WRITE_MBPS, THROTTLED_LATENCY_MS
+                ) as fdest:
+                    copy_utils.copyfileobj(
+                        fsrc, fdest, buffer_size=buffer_size, engine=engine, digests=digests
+                    )
+            else:
+                copy_utils.copy_with_callback(
+                    source_f, target_dir / source_f.name,
+                    buffer_size=buffer_size, engine=engine, digests=digests
+                )
+        os.sync()
+
+    _, elapsed, cpu = _timed(copy_all)
+
+    return {
+        "benchmark": "copy",
+        "filesystem": fstype,
+        "engine": engine,
+        "buffer_size": buffer_size,
+        "digests": digests or [],
+        "files": len(files),
+        "bytes": total_size,
+        "secs": elapsed,
+        "cpu_secs": cpu,
+        "MBps": total_size / MB / elapsed,
+    }
+
+
+class MemInfoSampler(object):
+    """ Samples `/proc/meminfo` in the background, peaks are reported in MB """
+
+    INTERVAL = 0.05  # secs
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self.start_info = None
+        self.peak_cached = 0
+        self.peak_dirty = 0
+        self.min_available = None
+
+    @staticmethod
+    def read():
+        info = dict()
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    name, value = line.split(":", 1)
+                    info[name] = int(value.split()[0]) * 1024  # kB
+        except (OSError, ValueError):
+            pass
+        return info
+
+    def _sample(self):
+        info = self.read()
+        self.peak_cached = max(self.peak_cached, info.get("Cached", 0))
+        self.peak_dirty = max(self.peak_dirty, info.get("Dirty", 0) + info.get("Writeback", 0))
+        available = info.get("MemAvailable", 0)
+        self.min_available = available if self.min_available is None else min(self.min_available, available)
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            self._sample()
+
+    def __enter__(self):
+        self.start_info = self.read()
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name="meminfo-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def results(self):
+        return {
+            "cached_growth_MB": (self.peak_cached - self.start_info.get("Cached", 0)) / MB,
+            "dirty_peak_MB": self.peak_dirty / MB,
+            "available_min_MB": (self.min_available or 0) / MB,
+            "cached_after_MB": (self.read().get("Cached", 0) - self.start_info.get("Cached", 0)) / MB,
+        }
+
+
+def bench_durability(fstype, files, target_root, buffer_size, modes, cold):
+    total_size = sum(os.stat(f).st_size for f in files)
+
+    policies = [
+        (mode, copy_utils.WritePolicy(durability=mode)) for mode in modes
+    ] + [
+        ("legacy", copy_utils.WritePolicy(
+            preallocate=False, fadvise=False, durability=copy_utils.DURABILITY_NONE
+        ))
+    ]
+
+    results = list()
+    for name, policy in policies:
+        target_dir = Path(target_root) / "durability"
+        shutil.rmtree(target_dir, ignore_errors=True)
+        target_dir.mkdir()
+        os.sync()
+
+        if cold:
+            drop_caches()
+
+        def copy_all():
+            for source_f in files:
+                copy_utils.copy_with_callback(
+                    source_f, target_dir / source_f.name,
+                    buffer_size=buffer_size, write_policy=policy
+                )
+            policy.flush()
+
+        with MemInfoSampler() as meminfo:
+            _, elapsed, cpu = _timed(copy_all)
+            # Data left in the page cache by the cheaper modes is paid here
+            _, sync_secs, _ = _timed(os.sync)
+
+        result = {
+            "benchmark": "durability",
+            "filesystem": fstype,
+            "policy": name,
+            "buffer_size": buffer_size,
+            "files": len(files),
+            "bytes": total_size,
+            "secs": elapsed,
+            "synced_secs": elapsed + sync_secs,
+            "cpu_secs": cpu,
+            "MBps": total_size / MB / elapsed,
+            "synced_MBps": total_size / MB / (elapsed + sync_secs),
+            **meminfo.results(),
+        }
+        print(
+            f"[INFO] {fstype} / durability {name}: {result['MBps']:.1f} MB/s "
+            f"({result['synced_MBps']:.1f} MB/s synced) - "
+            f"page cache +{result['cached_growth_MB']:.0f} MB, dirty peak {result['dirty_peak_MB']:.0f} MB"
+        )
+        results.append(result)
+
+    return results
+
+
+def bench_scan(fstype, source_root):
+    device = USBDevice(source_root)
+
+    def scan(snapshot):
+        return [
+            video_f
+            for video_dir in device.list_video_dirs()
+            for video_f in USBDevice.scan_dir_for_videos(video_dir, snapshot)
+        ]
+
+    snapshot = ListingSnapshot(source_root)
+    videos, cold_secs, _ = _timed(lambda: scan(snapshot))
+    snapshot.save()
+
+    # Fresh object: the snapshot is reloaded from disk, as after a reboot
+    _, warm_secs, _ = _timed(lambda: scan(ListingSnapshot(source_root)))
+    _, no_snapshot_secs, _ = _timed(lambda: scan(None))
+
+    return {
+        "benchmark": "scan",
+        "filesystem": fstype,
+        "files": len(videos),
+        "cold_secs": cold_secs,
+        "snapshot_secs": warm_secs,
+        "no_snapshot_secs": no_snapshot_secs,
+    }
+
+
+def bench_hash(fstype, files, buffer_size, cold):
+    total_size = sum(os.stat(f).st_size for f in files)
+
+    if cold:
+        drop_caches()
+    _, elapsed, cpu = _timed(
+        lambda: [hash_file(f, buffer_size=buffer_size) for f in files]
+    )
+
+    return {
+        "benchmark": "hash",
+        "filesystem": fstype,
+        "buffer_size": buffer_size,
+        "files": len(files),
+        "bytes": total_size,
+        "secs": elapsed,
+        "cpu_secs": cpu,
+        "MBps": total_size / MB / elapsed,
+    }
+
+
+def bench_fingerprint(fstype, files, cold):
+    if cold:
+        drop_caches()
+    _, computed_secs, _ = _timed(lambda: [VideoFile(f).fingerprint for f in files])
+
+    # Second pass is served by the hash index
+    _, indexed_secs, _ = _timed(lambda: [VideoFile(f).fingerprint for f in files])
+
+    return {
+        "benchmark": "fingerprint",
+        "filesystem": fstype,
+        "files": len(files),
+        "computed_secs": computed_secs,
+        "indexed_secs": indexed_secs,
+    }
+
+
+def _legacy_rgb565_list(image):
+    """ Conversion done by `LCD_ShowImage` before `FrameBuffer`, for reference """
+    img = np.asarray(image)
+    pix = np.zeros((image.width, image.height, 2), dtype=np.uint8)
+    pix[...,[0]] = np.add(np.bitwise_and(img[...,[0]],0xF8),np.right_shift(img[...,[1]],5))
+    pix[...,[1]] = np.add(np.bitwise_and(np.left_shift(img[...,[1]],3),0xE0),np.right_shift(img[...,[2]],3))
+    return pix.flatten().tolist()
+
+
+def bench_lcd(frames, width=128, height=128):
+    # Copy screen with a growing progress bar
+    images = list()
+    for idx in range(frames):
+        image = Image.new("RGB", (width, height))
+        draw = ImageDraw.Draw(image)
+        draw.text((21, 15), "~ 2023_06_12 ~", fill="WHITE")
+        draw.text((5, 53), f"COPY: {idx:04d}/{frames:04d} ...", fill="WHITE")
+        draw.rectangle((10, 105, 10 + (width - 20) * idx // frames, 115), fill=(211, 211, 211))
+        images.append(image)
+
+    sent = [0]
+    def spi_sink(data):
+        sent[0] += len(data)
+
+    def legacy():
+        for image in images:
+            pix = _legacy_rgb565_list(image)
+            for i in range(0, len(pix), 4096):
+                spi_sink(pix[i:i+4096])
+
+    framebuffer = FrameBuffer(width, height)
+    def preallocated():
+        for image in images:
+            framebuffer.update(image)
+            spi_sink(framebuffer.as_bytes())
+
+    results = list()
+    for name, fn in (("legacy", legacy), ("framebuffer", preallocated)):
+        sent[0] = 0
+        _, elapsed, cpu = _timed(fn)
+        results.append({
+            "benchmark": "lcd",
+            "path": name,
+            "frames": frames,
+            "bytes_per_frame": sent[0] // frames,
+            "fps": frames / elapsed,
+            "cpu_ms_per_frame": cpu * 1000 / frames,
+        })
+        print(f"[INFO] lcd / {name}: {frames / elapsed:.0f} FPS - {cpu * 1000 / frames:.2f} ms CPU / frame")
+    
+    return results
+
+
+def bench_render(frames, width=128, height=128):
+    days = [f"2023_06_{day:02d}" for day in range(1, 31)]
+
+    def selector_layer(draw):
+        draw.text((5, 5), "Days Available:", fill="WHITE")
+        draw.text((width - 30, height - 18), "EXIT", fill="WHITE")
+
+    def selector_frame(idx, draw, text_fn):
+        # Scrolling one day per frame
+        first_day = idx % (len(days) - 6)
+        for line, day in enumerate(days[first_day:first_day + 6]):
+            text_fn(draw, (30, 19 + line * 14), day)
+        text_fn(draw, (20, 19), ">")
+
+    def copy_frame(idx, draw, text_fn):
+        # Worst case: the status changes on every frame
+        draw.rectangle((0, 50, width, 80), fill="BLACK")
+        text_fn(draw, (5, 53), f"COPY: {idx % 100:04d}/0100 ...")
+        text_fn(draw, (5, 68), "Size: 4096.0 MB")
+        draw.rectangle((10, 105, 10 + (width - 20) * idx // frames, 115), fill=(211, 211, 211))
+
+    def draw_text(draw, xy, text):
+        draw.text(xy, text, fill="WHITE")
+
+    def scratch(frame_fn, layer_fn):
+        def run():
+            for idx in range(frames):
+                image = Image.new("RGB", (width, height))
+                draw = ImageDraw.Draw(image)
+                draw.rectangle((0, 0, width, height), outline=0, fill=0)
+                layer_fn(draw)
+                frame_fn(idx, draw, draw_text)
+        return run
+
+    def cached(frame_fn, layer_fn):
+        cache = RenderCache(width, height)
+        def run():
+            for idx in range(frames):
+                draw, _ = cache.new_frame(layer_fn.__name__, layer_fn)
+                frame_fn(idx, draw, cache.text)
+        return run
+
+    copy_image = Image.new("RGB", (width, height))
+    copy_draw = ImageDraw.Draw(copy_image)
+    def copy_scratch():
+        for idx in range(frames):
+            copy_frame(idx, copy_draw, draw_text)
+
+    copy_cache = RenderCache(width, height)
+    def copy_cached():
+        for idx in range(frames):
+            copy_frame(idx, copy_draw, copy_cache.text)
+
+    results = list()
+    for screen, name, fn in (
+        ("selector", "scratch", scratch(selector_frame, selector_layer)),
+        ("selector", "cached", cached(selector_frame, selector_layer)),
+        ("copy", "scratch", copy_scratch),
+        ("copy", "cached", copy_cached),
+    ):
+        _, elapsed, cpu = _timed(fn)
+        results.append({
+            "benchmark": "render",
+            "screen": screen,
+            "path": name,
+            "frames": frames,
+            "fps": frames / elapsed,
+            "cpu_ms_per_frame": cpu * 1000 / frames,
+        })
+        print(f"[INFO] render / {screen} / {name}: {frames / elapsed:.0f} FPS - {cpu * 1000 / frames:.3f} ms CPU / frame")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--filesystems", nargs="*", default=[FS_TMPFS, FS_THROTTLED],
+        choices=[FS_TMPFS, FS_VFAT, FS_EXFAT, FS_THROTTLED]
+    )
+    parser.add_argument("--sizes", nargs="+", type=float, default=[16, 64], help="File sizes in MB")
+    parser.add_argument("--count", type=int, default=4, help="Number of files")
+    parser.add_argument(
+        "--buffer-sizes", nargs="+", type=float, default=[0.25, 1, 4], help="Buffer sizes in MB"
+    )
+    parser.add_argument(
+        "--engines", nargs="+",
+        default=[
+            copy_utils.ENGINE_AUTO, copy_utils.ENGINE_COPY_FILE_RANGE,
+            copy_utils.ENGINE_SENDFILE, copy_utils.ENGINE_READINTO,
+            copy_utils.ENGINE_PIPELINE
+        ]
+    )
+    parser.add_argument(
+        "--durability", nargs="*", default=list(copy_utils.DURABILITY_MODES),
+        choices=copy_utils.DURABILITY_MODES, help="Durability modes to compare, none to skip"
+    )
+    parser.add_argument("--digest", action="store_true", help="Hash while copying")
+    parser.add_argument("--cold", action="store_true", help="Drop the page cache before each run (root)")
+    parser.add_argument("--lcd-frames", type=int, default=200, help="0 to skip the LCD and render benchmarks")
+    parser.add_argument("--output", default="logs/benchmark.json")
+    args = parser.parse_args()
+
+    digests = [copy_utils.DIGEST_MD5] if args.digest else None
+    results = list()
+
+    for fstype in args.filesystems:
+        # Source + target copies + metadata, rounded up for loop images
+        image_size_mb = int(2 * sum(args.sizes) * args.count / len(args.sizes)) + 64
+
+        try:
+            with filesystem_pair(fstype, image_size_mb) as (source_root, target_root):
+                print(f"[INFO] {fstype}: creating {args.count} files ...", flush=True)
+                files = make_gopro_tree(source_root, args.sizes, args.count)
+
+                for engine in args.engines:
+                    for buffer_size in args.buffer_sizes:
+                        try:
+                            result = bench_copy(
+                                fstype, files, target_root, engine,
+                                int(buffer_size * MB), digests, args.cold
+                            )
+                        except (ValueError, OSError) as e:
+                            print(f"[INFO] {fstype} / {engine}: SKIP ({e})")
+                            break
+                        print(f"[INFO] {fstype} / {engine} / {buffer_size} MB: {result['MBps']:.1f} MB/s")
+                        results.append(result)
+
+                if fstype != FS_THROTTLED:
+                    if args.durability:
+                        results.extend(bench_durability(
+                            fstype, files, target_root, copy_utils.DEFAULT_BUFFER_SIZE, 
+                            args.durability, args.cold
+                        ))
+                    results.append(bench_scan(fstype, source_root))
+                    results.append(bench_fingerprint(fstype, files, args.cold))
+                    for buffer_size in args.buffer_sizes:
+                        results.append(bench_hash(fstype, files, int(buffer_size * MB), args.cold))
+
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"[WARNING] Impossible to benchmark `{fstype}`: {e}")
+
+    if args.lcd_frames > 0:
+        results.extend(bench_lcd(args.lcd_frames))
+        results.extend(bench_render(args.lcd_frames))
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "host": platform.node(),
+                "machine": platform.machine(),
+                "python": platform.python_version(),
+                "timestamp": time.time(),
+                "results": results,
+            },
+            f, indent=2
+        )
+    print(f"[INFO] Results saved to `{args.output}`")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+""" Copy several files at once with bounded I/O concurrency """
+
+import threading
+
+from collections import defaultdict
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from copy_utils import DEFAULT_BUFFER_COUNT
+from copy_utils import DEFAULT_BUFFER_SIZE
+from copy_utils import DEFAULT_WRITE_POLICY
+from copy_utils import DIGEST_MD5
+from copy_utils import copy_with_callback
+from copy_utils import tee_copy
+
+from hash_index import HashIndex
+
+from io_topology import IOTopology
+
+
+DEFAULT_READ_WORKERS = 2   # Concurrent copies reading from the same unknown device
+DEFAULT_WRITE_WORKERS = 2  # Concurrent copies writing to the same unknown device
+
+SMALL_FILE_SIZE = 64 * 1024 * 1024  # Files below 64 MB are never queued behind chapters
+
+EVENT_STARTED = "started"
+EVENT_PROGRESS = "progress"
+EVENT_DONE = "done"
+EVENT_FAILED = "failed"
+EVENT_PAUSED = "paused"    # `job` is None: the governor holds back the next files
+EVENT_RESUMED = "resumed"  # `job` is None
+
+POLICY_CHECK_INTERVAL = 2.0  # secs, while paused or throttled by the governor
+
+
+CopyJob = namedtuple("CopyJob", ["source_f", "target_f"])
+
+# `dedup`: the `dedup.DEDUP_*` mode used if the file was already on the target
+CopyResult = namedtuple("CopyResult", ["job", "digests", "error", "dedup"], defaults=(None,))
+
+# `copied`, `total_copied`, `total` follow the `copy_with_callback` contract
+# for `job`, `agg_*` cover every job of the run.
+CopyEvent = namedtuple(
+    "CopyEvent",
+    [
+        "kind", "job", "copied", "total_copied", "total",
+        "agg_copied", "agg_total", "files_done", "files_total", "error"
+    ]
+)
+
+
+class CopyScheduler(object):
+    """ Runs a list of `CopyJob` on a pool of threads.
+
+    Each copy holds a slot on the physical disk (and USB port) of its source
+    and of its target, as grouped by `topology` (`io_topology.IOTopology`).
+    The number of slots depends on the media, e.g. one per SD card. Disks
+    unknown to udev get `read_workers` slots as a source and `write_workers`
+    as a target. Jobs of several cards / targets run in parallel: a worker
+    picks the next job whose devices have a free slot, the number of workers
+    grows with the number of devices (up to `max_workers`).
+
+    Fair-share: when more than one copy runs at once, one worker is kept for
+    files smaller than `small_file_size` (e.g. `.THM` / `.LRV`) and small and
+    large files are picked alternately, so a 4 GB chapter never starves them.
+
+    `governor`: optional `power_governor.PowerGovernor`, checked before each
+    file is started. Its policy caps the number of concurrent copies, sets
+    the buffer size and can pause the run at a file boundary.
+
+    `dedup`: optional `dedup.TargetDedup`, files already stored on the target
+    device are linked (or skipped) instead of copied.
+
+    `write_policy`: `copy_utils.WritePolicy` shared by every copy. A target
+    folder is flushed once its last job is done, and every folder at the end
+    of the run.
+
+    `mirror`: the jobs sharing a source file are run together with
+    `copy_utils.tee_copy`, the file is read once for all its targets.
+
+    `on_event` is called with a `CopyEvent`, never concurrently.
+    """
+
+    def __init__(
+        self,
+        read_workers=DEFAULT_READ_WORKERS,
+        write_workers=DEFAULT_WRITE_WORKERS,
+        small_file_size=SMALL_FILE_SIZE,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        buffer_count=DEFAULT_BUFFER_COUNT,
+        digests=(DIGEST_MD5,),
+        max_workers=None,
+        governor=None,
+        dedup=None,
+        write_policy=DEFAULT_WRITE_POLICY,
+        mirror=False,
+        topology=None,
+        on_event=None
+    ):
+        if read_workers < 1 or write_workers < 1:
+            raise ValueError("`read_workers` and `write_workers` must be >= 1")
+
+        self.read_workers = read_workers
+        self.write_workers = write_workers
+        self.small_file_size = small_file_size
+        self.buffer_size = buffer_size
+        self.buffer_count = buffer_count
+        self.digests = list(digests or [])
+        self.max_workers = max_workers
+        self.governor = governor
+        self.dedup = dedup
+        self.write_policy = write_policy
+        self.mirror = mirror
+        self.topology = topology if topology is not None else IOTopology()
+        self._on_event = on_event
+
+        self._lock = threading.Lock()
+        self._job_finished = threading.Condition(self._lock)
+        self._event_lock = threading.Lock()
+        self._busy_slots = defaultdict(int)  # {slot key: copies running}
+
+    def _units(self, jobs):
+        """ Splits the jobs in units, the jobs of a unit are run together """
+        if not self.mirror:
+            return [(job,) for job in jobs]
+
+        units = dict()
+        for job in jobs:
+            units.setdefault(str(job.source_f), list()).append(job)
+        return [tuple(unit) for unit in units.values()]
+
+    def _slots(self, unit):
+        """ Returns the [(slot key, limit)] a copy of `unit` holds """
+        # A source and a target on the same disk share its slots
+        slots = dict(self.topology.slots(unit[0].source_f, self.read_workers))
+        for job in unit:
+            slots.update(self.topology.slots(job.target_f.parent, self.write_workers))
+        return list(slots.items())
+
+    def _capacity(self, paths, default):
+        """ Returns the copies the disks storing `paths` allow at once """
+        devices = {self.topology.device_of(path) for path in paths}
+        return sum(self.topology.limit(device, default) for device in devices)
+
+    def _num_workers(self, jobs):
+        num_workers = min(
+            self._capacity({job.source_f for job in jobs}, self.read_workers),
+            self._capacity({job.target_f.parent for job in jobs}, self.write_workers)
+        )
+        if self.max_workers is not None:
+            num_workers = min(num_workers, self.max_workers)
+        return max(1, num_workers)
+
+    def run(self, jobs):
+        """ Copies every job, returns a list of `CopyResult` in the jobs order """
+        jobs = [CopyJob(*job) for job in jobs]
+
+        self._sizes = {job: job.source_f.stat().st_size for job in jobs}
+
+        units = self._units(jobs)
+        self._unit_slots = {unit: self._slots(unit) for unit in units}
+        num_workers = self._num_workers(jobs)
+        self._small = deque(unit for unit in units if self._sizes[unit[0]] < self.small_file_size)
+        self._large = deque(unit for unit in units if self._sizes[unit[0]] >= self.small_file_size)
+        self._large_limit = max(1, num_workers - 1)
+        self._large_running = 0
+        self._running = 0
+        self._paused = False
+        self._pick_small_next = True
+
+        self._agg_total = sum(self._sizes.values())
+        self._agg_copied = 0
+        self._files_done = 0
+        self._files_total = len(jobs)
+        self._results = dict()
+        self._jobs_left = defaultdict(int)  # {target folder: jobs not done yet}
+        for job in jobs:
+            self._jobs_left[job.target_f.parent] += 1
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            workers = [
+                executor.submit(self._worker_loop)
+                for _ in range(min(num_workers, len(units)))
+            ]
+            try:
+                for worker in workers:
+                    worker.result()
+            finally:
+                # Batched durability: the last folders are synced here
+                self.write_policy.flush()
+                HashIndex.flush_all()
+
+        return [self._results[job] for job in jobs]
+
+    def _power_policy(self):
+        if self.governor is None:
+            return None
+
+        policy = self.governor.policy()
+        if policy.paused != self._paused:
+            self._paused = policy.paused
+            self._emit(EVENT_PAUSED if policy.paused else EVENT_RESUMED, None)
+
+        return policy
+
+    def _next_unit(self):
+        """ Fair-share policy, returns (unit, is_large) or (None, False) once 
+        there is nothing left to copy.
+        """
+        with self._job_finished:
+            while True:
+                policy = self._power_policy()
+                if (self._small or self._large) and policy is not None and (
+                    policy.paused or 
+                    (policy.max_workers is not None and self._running >= policy.max_workers)
+                ):
+                    # Re-checked when a copy ends, or as the battery level changes
+                    self._job_finished.wait(POLICY_CHECK_INTERVAL)
+                    continue
+
+                large_allowed = self._large and self._large_running < self._large_limit
+
+                queues = [(self._small, False), (self._large, True)]
+                if large_allowed and not self._pick_small_next:
+                    queues.reverse()
+
+                for units, is_large in queues:
+                    if is_large and not large_allowed:
+                        continue
+
+                    unit = self._pop_startable(units)
+                    if unit is None:
+                        continue
+
+                    self._pick_small_next = is_large
+                    for key, _ in self._unit_slots[unit]:
+                        self._busy_slots[key] += 1
+                    self._running += 1
+                    if is_large:
+                        self._large_running += 1
+                    return unit, is_large
+
+                if not self._small and not self._large:
+                    return None, False
+
+                # Every large slot is taken, or the devices of the remaining
+                # jobs are busy: this worker waits for a copy to end.
+                self._job_finished.wait()
+
+    def _pop_startable(self, units):
+        """ Removes and returns the first unit whose devices have a free slot """
+        for idx, unit in enumerate(units):
+            if all(self._busy_slots[key] < limit for key, limit in self._unit_slots[unit]):
+                del units[idx]
+                return unit
+        return None
+
+    def _worker_loop(self):
+        while True:
+            unit, is_large = self._next_unit()
+
+            if unit is None:
+                return
+
+            try:
+                if len(unit) == 1:
+                    self._results[unit[0]] = self._copy(unit[0])
+                else:
+                    self._results.update(self._mirror(unit))
+            finally:
+                with self._job_finished:
+                    for key, _ in self._unit_slots[unit]:
+                        self._busy_slots[key] -= 1
+                    self._running -= 1
+                    if is_large:
+                        self._large_running -= 1
+                    self._job_finished.notify_all()
+
+    def _emit(self, kind, job, copied=0, total_copied=0, error=None):
+        if self._on_event is None:
+            return
+
+        with self._event_lock:
+            self._on_event(CopyEvent(
+                kind=kind,
+                job=job,
+                copied=copied,
+                total_copied=total_copied,
+                total=self._sizes.get(job, 0),
+                agg_copied=self._agg_copied,
+                agg_total=self._agg_total,
+                files_done=self._files_done,
+                files_total=self._files_total,
+                error=error
+            ))
+
+    def _copy(self, job):
+        buffer_size = self.buffer_size
+        if self.governor is not None:
+            buffer_size = self.governor.policy().buffer_size or buffer_size
+
+        def progress_fn(copied, total_copied, total):
+            with self._lock:
+                self._agg_copied += copied
+            self._emit(EVENT_PROGRESS, job, copied=copied, total_copied=total_copied)
+
+        # The read / write slots of the job are held by `_next_unit`
+        self._emit(EVENT_STARTED, job)
+        try:
+            if (result := self._dedup_result(job)) is not None:
+                return result
+
+            _, digests = copy_with_callback(
+                job.source_f,
+                job.target_f,
+                follow_symlinks=True,
+                callback=progress_fn,
+                buffer_size=buffer_size,
+                buffer_count=self.buffer_count,
+                digests=self.digests,
+                resumable=True,
+                write_policy=self.write_policy,
+            )
+        except Exception as e:
+            return self._failed(job, e)
+
+        if digests and hasattr(job.source_f, "record_digests"):
+            job.source_f.record_digests(digests)
+
+        return self._copied(job, digests)
+
+    def _mirror(self, jobs):
+        """ Copies the source of `jobs` to each of their targets, reading it
+        once. Returns {job: CopyResult}.
+        """
+        results = dict()
+        to_copy = list()
+        for job in jobs:
+            self._emit(EVENT_STARTED, job)
+            try:
+                results[job] = self._dedup_result(job)
+            except Exception as e:
+                results[job] = self._failed(job, e)
+
+            if results[job] is None:
+                to_copy.append(job)
+
+        if not to_copy:
+            return results
+
+        buffer_size = self.buffer_size
+        if self.governor is not None:
+            buffer_size = self.governor.policy().buffer_size or buffer_size
+
+        def progress_fn(copied, total_copied, total):
+            with self._lock:
+                self._agg_copied += copied * len(to_copy)
+            for job in to_copy:
+                self._emit(EVENT_PROGRESS, job, copied=copied, total_copied=total_copied)
+
+        source_f = to_copy[0].source_f
+        try:
+            digests, errors = tee_copy(
+                source_f,
+                [job.target_f for job in to_copy],
+                callback=progress_fn,
+                buffer_size=buffer_size,
+                digests=self.digests,
+                resumable=True,
+                write_policy=self.write_policy,
+            )
+        except Exception as e:  # Reading the source failed: every target did
+            for job in to_copy:
+                results[job] = self._failed(job, e)
+            return results
+
+        if digests and hasattr(source_f, "record_digests"):
+            source_f.record_digests(digests)
+
+        for job, error in zip(to_copy, errors):
+            results[job] = self._failed(job, error) if error is not None else self._copied(job, digests)
+
+        return results
+
+    def _dedup_result(self, job):
+        """ Returns the `CopyResult` of `job` if linked (or skipped) by the
+        dedup, None if the file must be copied.
+        """
+        dedup_mode = self._link_duplicate(job)
+        if dedup_mode is None:
+            return None
+
+        size = self._sizes[job]
+        with self._lock:
+            self._agg_copied += size
+        self._emit(EVENT_PROGRESS, job, copied=size, total_copied=size)
+        return self._done(job, digests=None, dedup_mode=dedup_mode)
+
+    def _copied(self, job, digests):
+        if digests and hasattr(job.target_f, "record_digests"):
+            job.target_f.record_digests(digests)
+
+        if self.dedup is not None:
+            self.dedup.record_copy(job.source_f, job.target_f)
+
+        return self._done(job, digests=digests)
+
+    def _failed(self, job, error):
+        with self._lock:
+            self._files_done += 1
+        self._emit(EVENT_FAILED, job, error=error)
+        self._folder_job_done(job)
+        return CopyResult(job=job, digests=None, error=error)
+
+    def _folder_job_done(self, job):
+        """ Flushes the target folder of `job` once it was the last one """
+        folder = job.target_f.parent
+        with self._lock:
+            self._jobs_left[folder] -= 1
+            folder_done = self._jobs_left[folder] == 0
+
+        if folder_done:
+            self.write_policy.flush(folder)
+
+    def _link_duplicate(self, job):
+        """ Returns the dedup mode used, None if the file must be copied """
+        if self.dedup is None:
+            return None
+
+        existing_f = self.dedup.find_duplicate(job.source_f, job.target_f)
+        if existing_f is None:
+            return None
+
+        return self.dedup.link(existing_f, job.target_f)
+
+    def _done(self, job, digests, dedup_mode=None):
+        with self._lock:
+            self._files_done += 1
+        self._emit(EVENT_DONE, job, total_copied=self._sizes[job])
+        self._folder_job_done(job)
+
+        return CopyResult(job=job, digests=digests, error=None, dedup=dedup_mode)
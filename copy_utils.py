@@ -4,13 +4,87 @@
 # https://stackoverflow.com/questions/29967487/get-progress-back-from-shutil-file-copy-thread/48450305#48450305
 # License: MIT License
 
+import ctypes
+import errno
+import hashlib
+import io
 import os
 import pathlib
+import queue
 import shutil
+import threading
 import time
 
+from collections import defaultdict
+
+from transfer_journal import CHECKPOINT_INTERVAL
+from transfer_journal import TransferJournal
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 
 DEFAULT_BUFFER_SIZE = 1024 * 1024  # 1 MB
+DEFAULT_BUFFER_COUNT = 4  # buffers in flight in pipeline mode => 4 MB of RAM
+TEE_BUFFER_COUNT = 16  # buffers shared by the targets of a tee copy => 16 MB of RAM
+
+CALLBACK_INTERVAL = 0.5  # secs between two calls to the progress callback
+
+# Copy engines, from the cheapest to the most expensive in CPU.
+# `copy_file_range` and `sendfile` keep the data inside the kernel, `readinto`
+# moves it through a single reused userspace buffer and `pipeline` overlaps
+# reads and writes with a reader thread and a ring of preallocated buffers.
+ENGINE_AUTO = "auto"
+ENGINE_COPY_FILE_RANGE = "copy_file_range"
+ENGINE_SENDFILE = "sendfile"
+ENGINE_READINTO = "readinto"
+ENGINE_PIPELINE = "pipeline"
+
+DIGEST_MD5 = "md5"
+DIGEST_SHA1 = "sha1"
+DIGEST_BLAKE2B = "blake2b"
+DIGEST_XXHASH = "xxh64"
+
+# errnos meaning "this engine can't handle this pair of files", any other
+# error is a genuine I/O error and is raised to the caller.
+_FALLBACK_ERRNOS = {
+    errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP
+}
+
+# (src st_dev, dest st_dev) => engines known not to work for that device pair
+_UNSUPPORTED_ENGINES = defaultdict(set)
+
+# When the copied data reaches the disk. A power loss before the sync can leave
+# an incomplete file under its final name, detected by `verify` on the next run.
+DURABILITY_FILE = "file"            # fdatasync before `copy_with_callback` returns
+DURABILITY_DIRECTORY = "directory"  # Files and their folder synced once the folder is done
+DURABILITY_NONE = "none"            # Left to the kernel writeback
+
+DURABILITY_MODES = (DURABILITY_FILE, DURABILITY_DIRECTORY, DURABILITY_NONE)
+
+_FALLOC_FL_KEEP_SIZE = 0x01  # from <linux/falloc.h>
+
+# errnos meaning "preallocation is not supported by this filesystem"
+_NO_FALLOCATE_ERRNOS = {errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL}
+
+# st_dev of the filesystems without preallocation
+_NO_FALLOCATE_DEVICES = set()
+
+
+def _load_fallocate():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fallocate = getattr(libc, "fallocate64", None) or libc.fallocate
+    except (OSError, AttributeError):
+        return None
+
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+_fallocate = _load_fallocate()
 
 
 class SameFileError(OSError):
@@ -22,8 +96,171 @@ class SpecialFileError(OSError):
     not supported on a special file (e.g. a named pipe)"""
 
 
+def available_digests():
+    """ Returns the digest names supported on this system """
+    digests = [DIGEST_MD5, DIGEST_SHA1, DIGEST_BLAKE2B]
+    if xxhash is not None:
+        digests.append(DIGEST_XXHASH)
+    return digests
+
+
+def new_digest(name):
+    """ Returns a new hash object for the digest `name` (one of `DIGEST_*`) """
+    if name == DIGEST_XXHASH:
+        if xxhash is None:
+            raise ValueError(f"Digest `{name}` requires the `xxhash` package")
+        return xxhash.xxh64()
+
+    if name not in (DIGEST_MD5, DIGEST_SHA1, DIGEST_BLAKE2B):
+        raise ValueError(f"Unknown digest: `{name}`")
+    
+    return hashlib.new(name)
+
+
+class WritePolicy(object):
+    """ How the destination of a copy is written.
+
+    preallocate: the blocks of the destination are reserved before the copy,
+        so the file is contiguous on FAT / exFAT and a full target fails right
+        away instead of after writing gigabytes.
+    fadvise: the source is read with `POSIX_FADV_SEQUENTIAL` and both files
+        are evicted from the page cache as they are copied, the 512 MB of the
+        Pi aren't filled with clips that will never be read again.
+    durability: one of `DURABILITY_*`. With `DURABILITY_DIRECTORY`, the
+        files are synced by `flush(folder)` once no copy to `folder` is left
+        (see `CopyScheduler`), and `flush()` once every copy is done.
+
+    A policy can be shared by concurrent copies.
+    """
+
+    def __init__(self, preallocate=True, fadvise=True, durability=DURABILITY_FILE):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: `{durability}`")
+
+        self.preallocate = preallocate
+        self.fadvise = fadvise
+        self.durability = durability
+
+        self._lock = threading.Lock()
+        self._pending = defaultdict(list)  # folder => files written, not synced yet
+
+    def before_copy(self, fsrc, fdest, offset, total_size):
+        if self.fadvise:
+            _fadvise(fsrc, 0, 0, "POSIX_FADV_SEQUENTIAL")
+
+        if self.preallocate and total_size > offset:
+            _preallocate(fdest, offset, total_size - offset)
+
+    def drop_behind(self, fsrc, fdest, copied):
+        """ Evicts the first `copied` bytes of both files from the page cache.
+        Dirty pages of `fdest` are only queued for writeback.
+        """
+        if self.fadvise:
+            _fadvise(fsrc, 0, copied, "POSIX_FADV_DONTNEED")
+            _fadvise(fdest, 0, copied, "POSIX_FADV_DONTNEED")
+
+    def after_copy(self, fsrc, fdest, copied):
+        """ Called before `fdest` is closed, or renamed if resumable """
+        if self.preallocate:
+            # Releases the blocks reserved past the data, e.g. the source shrank
+            fdest.truncate(copied)
+
+        if self.durability == DURABILITY_FILE:
+            os.fdatasync(fdest.fileno())
+
+        self.drop_behind(fsrc, fdest, 0)  # 0: up to the end of the files
+
+    def committed(self, destfile):
+        """ Called once `destfile` has its final name """
+        destfile = pathlib.Path(destfile)
+
+        if self.durability == DURABILITY_FILE:
+            _fsync_dir(destfile.parent)
+
+        elif self.durability == DURABILITY_DIRECTORY:
+            with self._lock:
+                self._pending[destfile.parent].append(destfile)
+
+    def flush(self, folder=None):
+        """ Syncs the files written to `folder` with `DURABILITY_DIRECTORY`,
+        every file written if None.
+        """
+        with self._lock:
+            if folder is None:
+                done, self._pending = self._pending, defaultdict(list)
+            else:
+                folder = pathlib.Path(folder)
+                done = {folder: self._pending.pop(folder)} if folder in self._pending else {}
+        self._sync(done)
+
+    def _sync(self, files_per_folder):
+        for folder, files in files_per_folder.items():
+            for path in files:
+                try:
+                    with open(path, "rb", buffering=0) as f:
+                        os.fdatasync(f.fileno())
+                        if self.fadvise:
+                            _fadvise(f, 0, 0, "POSIX_FADV_DONTNEED")
+                except FileNotFoundError:
+                    pass  # Deleted since, e.g. overwritten by a new copy
+            _fsync_dir(folder)
+
+
+def _fadvise(f, offset, length, advice):
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(f.fileno(), offset, length, getattr(os, advice))
+    except (AttributeError, io.UnsupportedOperation, OSError):
+        pass  # Only a hint
+
+
+def _preallocate(f, offset, length):
+    """ Reserves `length` bytes at `offset` without changing the file size.
+
+    `os.posix_fallocate` isn't used: glibc emulates it on filesystems without
+    `fallocate` (exFAT) by writing every block, and FAT only supports
+    preallocation past the end of the file.
+    """
+    if _fallocate is None:
+        return
+
+    fd = f.fileno()
+    st_dev = os.fstat(fd).st_dev
+    if st_dev in _NO_FALLOCATE_DEVICES:
+        return
+
+    if _fallocate(fd, _FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        err = ctypes.get_errno()
+        if err not in _NO_FALLOCATE_ERRNOS:
+            raise OSError(err, f"Impossible to preallocate `{f.name}`: {os.strerror(err)}")
+        _NO_FALLOCATE_DEVICES.add(st_dev)
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # Not supported by every filesystem
+    finally:
+        os.close(fd)
+
+
+DEFAULT_WRITE_POLICY = WritePolicy()
+
+
+class _EngineUnsupported(Exception):
+    """Raised by a copy engine which can't be used for a pair of files."""
+
+
 def copy_with_callback(
-    src, dest, callback=None, follow_symlinks=True, buffer_size=DEFAULT_BUFFER_SIZE
+    src, dest, callback=None, follow_symlinks=True, buffer_size=DEFAULT_BUFFER_SIZE,
+    engine=ENGINE_AUTO, digests=None, buffer_count=DEFAULT_BUFFER_COUNT, resumable=False,
+    write_policy=DEFAULT_WRITE_POLICY
 ):
     """ Copy file with a callback. 
         callback, if provided, must be a callable and will be 
@@ -37,10 +274,22 @@ def copy_with_callback(
         callback: callable to call after every buffer_size bytes are copied
             callback will called as callback(bytes_copied since last callback, total bytes copied, total bytes in source file)
         follow_symlinks: bool; if True, follows symlinks
-        buffer_size: how many bytes to copy before each call to the callback, default = 4Mb
+        buffer_size: how many bytes to copy at once, default = 1Mb
+        engine: one of `ENGINE_*`. `ENGINE_AUTO` picks the fastest engine 
+            supported by the source / destination filesystems.
+        digests: optional list of digest names (see `available_digests()`) 
+            computed over the copied data, without reading the source twice.
+        buffer_count: number of `buffer_size` buffers in flight in pipeline
+            mode, i.e. the memory used is `buffer_count * buffer_size`.
+        resumable: if True, the data is written to `<dest>.partial` with a 
+            `transfer_journal.TransferJournal` and renamed once complete. A 
+            copy interrupted (e.g. power loss) resumes from its last checkpoint.
+        write_policy: `WritePolicy`, preallocation, page cache and durability
+            of the destination.
     
     Returns:
-        Full path to destination file
+        Full path to destination file, or `(full path, {digest: hexdigest})`
+        if `digests` is provided.
 
     Raises:
         FileNotFoundError if src doesn't exist
@@ -77,6 +326,11 @@ def copy_with_callback(
     if callback is not None and not callable(callback):
         raise ValueError("callback is not callable")
 
+    if buffer_count < 2:
+        raise ValueError("buffer_count must be >= 2")
+
+    hashers = {name: new_digest(name) for name in (digests or [])}
+
     if not follow_symlinks and srcfile.is_symlink():
         if destfile.exists():
             os.unlink(destfile)
@@ -86,36 +340,661 @@ def copy_with_callback(
             srcfile=srcfile, 
             destfile=destfile, 
             callback=callback, 
-            buf_size=buffer_size
+            buf_size=buffer_size,
+            buf_count=buffer_count,
+            engine=engine,
+            hashers=hashers,
+            resumable=resumable,
+            write_policy=write_policy
         )
     shutil.copymode(str(srcfile), str(destfile))
-    return str(destfile)
 
+    if digests is None:
+        return str(destfile)
+    
+    return str(destfile), {name: h.hexdigest() for name, h in hashers.items()}
+
+
+def copyfileobj(
+    fsrc, fdest, callback=None, buffer_size=DEFAULT_BUFFER_SIZE, 
+    buffer_count=DEFAULT_BUFFER_COUNT, engine=ENGINE_AUTO, digests=None, total_size=None
+):
+    """ Copy between two opened, unbuffered, binary file objects.
+    
+    File objects without a real file descriptor (e.g. wrappers simulating a 
+    slow device) are copied by the userspace engines.
+
+    Returns:
+        {digest: hexdigest} for each name in `digests`
+    """
+    hashers = {name: new_digest(name) for name in (digests or [])}
+    progress = _Progress(callback=callback, total_size=total_size or 0)
+    _copy_opened(
+        fsrc, fdest, progress, list(hashers.values()), buffer_size, buffer_count, engine
+    )
+    progress.flush()
+    return {name: h.hexdigest() for name, h in hashers.items()}
+
+
+def tee_copy(
+    src, dests, callback=None, buffer_size=DEFAULT_BUFFER_SIZE, buffer_count=TEE_BUFFER_COUNT,
+    digests=None, resumable=False, write_policy=DEFAULT_WRITE_POLICY, verify=True
+):
+    """ Copies `src` to every destination of `dests`, reading it only once.
 
-def _copyfileobj(srcfile, destfile, callback, buf_size):
-    """ copy from fsrc to fdest
+    Each destination is written by its own thread. The `buffer_count` buffers
+    are shared by all of them and recycled once written everywhere: a slow
+    destination only holds back the others when it lags a full pool behind.
+    A failing destination (e.g. full or removed) doesn't stop the others.
 
     Args:
-        fsrc: filehandle to source file
-        fdest: filehandle to destination file
-        callback: callable callback that will be called after every length bytes copied
-        buf_size: how many bytes to copy at once (between calls to callback)
+        callback, buffer_size, digests, resumable, write_policy: as
+            `copy_with_callback`. The callback follows the slowest destination.
+        dests: destination paths, or existing directories.
+        verify: each destination is synced and read back from the drive once
+            written, whatever the durability of `write_policy`. Its digest
+            (`digests[0]`, md5 by default) must match the source one.
+
+    Returns:
+        ({digest: hexdigest} of the source, [error or None for each destination])
+
+    Raises:
+        FileNotFoundError if src doesn't exist, any error reading it.
     """
+    srcfile = pathlib.Path(src)
+    if not srcfile.is_file():
+        raise FileNotFoundError(f"src file `{src}` doesn't exist")
+
+    if buffer_count < 2:
+        raise ValueError("buffer_count must be >= 2")
+
+    if callback is not None and not callable(callback):
+        raise ValueError("callback is not callable")
+
+    digests = list(digests or [])
+    verify_digest = digests[0] if digests else DIGEST_MD5
+    hashers = {name: new_digest(name) for name in dict.fromkeys(digests + [verify_digest])}
     total_size = os.stat(srcfile).st_size
-    last_callback_update = time.perf_counter()
-    
-    with open(srcfile, "rb") as fsrc:
-        with open(destfile, "wb") as fdest:
+
+    writers = list()
+    for dest in dests:
+        destfile = pathlib.Path(dest)
+        destfile = destfile / srcfile.name if destfile.is_dir() else destfile
+        writers.append(_TeeWriter(srcfile, destfile, resumable, write_policy))
+
+    try:
+        with open(srcfile, "rb", buffering=0) as fsrc:
+            # Every destination restarts from the smallest resume offset
+            offset = min(
+                (writer.resume_offset(srcfile) for writer in writers if writer.error is None),
+                default=0
+            )
+            for writer in writers:
+                writer.open(fsrc, offset, total_size)
+
+            if offset:
+                print(f"[INFO] Resuming `{srcfile}` at {offset / (1<<20):.1f} MB")
+            _hash_prefix(fsrc, list(hashers.values()), offset, buffer_size)
+
+            # Every `CHECKPOINT_INTERVAL` bytes written by every destination
+            def checkpoint_fn(copied):
+                for writer in writers:
+                    writer.checkpoint(fsrc, srcfile, copied)
+
+            progress = _Progress(
+                callback=callback, 
+                total_size=total_size, 
+                checkpoint_fn=checkpoint_fn, 
+                already_copied=offset
+            )
+            pool = _TeeBufferPool(buffer_count, buffer_size)
+
+            for writer in writers:
+                writer.start(pool)
+
+            try:
+                while True:
+                    buffer = pool.get()
+                    progress.update(pool.pop_released())
+
+                    alive = [writer for writer in writers if writer.error is None]
+                    size = fsrc.readinto(buffer) if alive else 0
+                    if not size:
+                        pool.put(buffer)
+                        break
+
+                    view = memoryview(buffer)
+                    for hasher in hashers.values():
+                        hasher.update(view[:size])
+
+                    pool.dispatch(buffer, size, len(alive))
+                    for writer in alive:
+                        writer.put(buffer, size)
+
+            finally:
+                for writer in writers:
+                    writer.stop()
+
+            progress.update(pool.pop_released())
+
+            for writer in writers:
+                writer.finish(fsrc, srcfile, progress.total_copied)
+
+    except BaseException:
+        # e.g. the card was pulled: no writer is left running, nor
+        # a half-written file under its final name
+        for writer in writers:
+            writer.abort()
+        raise
+
+    progress.flush()
+
+    source_digests = {name: h.hexdigest() for name, h in hashers.items()}
+
+    if verify:
+        verifiers = [
+            threading.Thread(
+                target=writer.verify, args=(verify_digest, source_digests[verify_digest], buffer_size),
+                name="tee-verify", daemon=True
+            )
+            for writer in writers if writer.error is None
+        ]
+        for verifier in verifiers:
+            verifier.start()
+        for verifier in verifiers:
+            verifier.join()
+
+    return (
+        {name: source_digests[name] for name in digests}, 
+        [writer.error for writer in writers]
+    )
+
+
+class _TeeBufferPool(object):
+    """ Free buffers of a tee copy, and the number of writers still using each
+    dispatched buffer.
+    """
+
+    def __init__(self, buffer_count, buffer_size):
+        self._free = queue.Queue()
+        for _ in range(buffer_count):
+            self._free.put(bytearray(buffer_size))
+
+        self._lock = threading.Lock()
+        self._users = dict()  # {id(buffer): [writers left, size]}
+        self._released = 0
+
+    def get(self):
+        return self._free.get()
+
+    def put(self, buffer):
+        self._free.put(buffer)
+
+    def dispatch(self, buffer, size, num_writers):
+        with self._lock:
+            self._users[id(buffer)] = [num_writers, size]
+
+    def release(self, buffer):
+        """ Called by each writer, in order: the buffers are freed in order """
+        with self._lock:
+            users = self._users[id(buffer)]
+            users[0] -= 1
+            if users[0]:
+                return
+            del self._users[id(buffer)]
+            self._released += users[1]
+        self._free.put(buffer)
+
+    def pop_released(self):
+        """ Returns the bytes written by every destination since the last call """
+        with self._lock:
+            released, self._released = self._released, 0
+        return released
+
+
+class _TeeWriter(object):
+    """ One destination of a tee copy. Any error is kept in `error`, the
+    writer then only releases the buffers it receives.
+    """
+
+    def __init__(self, srcfile, destfile, resumable, write_policy):
+        self.destfile = destfile
+        self.error = None
+
+        self._journal = TransferJournal(destfile) if resumable else None
+        self._write_policy = write_policy
+        self._fdest = None
+        self._finished = False
+        self._pool = None
+        self._queue = queue.Queue()  # Bounded by the buffer pool
+        self._thread = None
+
+        if destfile.exists() and srcfile.samefile(destfile):
+            self._fail(SameFileError(
+                f"source file `{srcfile}` and destinaton file `{destfile}` are the same file."
+            ))
+
+    def resume_offset(self, srcfile):
+        if self._journal is None:
+            return 0
+        try:
+            return self._journal.resume_offset(srcfile)
+        except OSError:
+            return 0
+
+    def open(self, fsrc, offset, total_size):
+        if self.error is not None:
+            return
+
+        dest_path = self._journal.partial_path if self._journal is not None else self.destfile
+        try:
+            self._fdest = open(dest_path, "r+b" if offset else "wb", buffering=0)
+            if offset:
+                self._fdest.truncate(offset)
+                self._fdest.seek(offset)
+            self._write_policy.before_copy(fsrc, self._fdest, offset, total_size)
+        except OSError as e:
+            self._fail(e)
+
+    def start(self, pool):
+        self._pool = pool
+        self._thread = threading.Thread(target=self._run, name="tee-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, buffer, size):
+        self._queue.put((buffer, size))
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while (item := self._queue.get()) is not None:
+            buffer, size = item
+            if self.error is None:
+                try:
+                    view = memoryview(buffer)
+                    written = 0
+                    while written < size:
+                        written += self._fdest.write(view[written:size])
+                except BaseException as e:
+                    self._fail(e)
+            self._pool.release(buffer)
+
+    def checkpoint(self, fsrc, srcfile, copied):
+        if self.error is not None:
+            return
+        try:
+            if self._journal is not None:
+                self._journal.checkpoint(self._fdest, srcfile, copied)
+            self._write_policy.drop_behind(fsrc, self._fdest, copied)
+        except OSError as e:
+            self._fail(e)
+
+    def finish(self, fsrc, srcfile, copied):
+        """ Closes the destination, renamed to its final name if resumable """
+        if self.error is None:
+            try:
+                self._write_policy.after_copy(fsrc, self._fdest, copied)
+                self._fdest.close()
+                if self._journal is not None:
+                    self._journal.commit()
+                self._write_policy.committed(self.destfile)
+                shutil.copymode(str(srcfile), str(self.destfile))
+                self._finished = True
+            except OSError as e:
+                self._fail(e)
+
+        self._close()
+
+    def abort(self):
+        """ Called when the copy stops before `finish`, e.g. the source failed """
+        self.stop()
+        self._close()
+
+    def _close(self):
+        """ Closes the destination. Unless resumable, an unfinished one is
+        deleted: it would be taken for a complete copy.
+        """
+        if self._fdest is None:
+            return  # Never opened, e.g. the source itself
+
+        if not self._fdest.closed:
+            try:
+                self._fdest.close()
+            except OSError:
+                pass  # e.g. the target was removed
+
+        if self._journal is None and not self._finished:
+            try:
+                os.unlink(self.destfile)
+            except OSError:
+                pass
+
+    def verify(self, algo, expected, buffer_size):
+        try:
+            hasher = new_digest(algo)
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            with open(self.destfile, "rb", buffering=0) as f:
+                # Dirty pages can't be evicted: the page cache would be read
+                os.fdatasync(f.fileno())
+                _fadvise(f, 0, 0, "POSIX_FADV_DONTNEED")
+                while size := f.readinto(buffer):
+                    hasher.update(view[:size])
+        except OSError as e:
+            self._fail(e)
+            return
+
+        if hasher.hexdigest() != expected:
+            # Left in place, the next run would only compare its fingerprint
+            # and take the corrupt copy for an identical one
+            try:
+                os.unlink(self.destfile)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARNING] Impossible to delete the corrupt `{self.destfile}`: {e}")
+            self._fail(OSError(errno.EIO, f"`{self.destfile}` differs from the source once written"))
+
+    def _fail(self, error):
+        if self.error is None:
+            print(f"[ERROR] `{self.destfile}`: {error}")
+            self.error = error
+
+
+def _dev_pair(fsrc, fdest):
+    """ Returns (src st_dev, dest st_dev) or None for files without descriptor """
+    try:
+        return os.fstat(fsrc.fileno()).st_dev, os.fstat(fdest.fileno()).st_dev
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+
+def _engines_for(engine, fsrc, fdest, hashers):
+    """ Returns the ordered list of engines to try for this pair of files """
+    dev_pair = _dev_pair(fsrc, fdest)
+
+    if engine != ENGINE_AUTO:
+        if engine not in _ENGINES:
+            raise ValueError(f"Unknown copy engine: `{engine}`")
+        if hashers and engine not in _HASHING_ENGINES:
+            raise ValueError(f"Copy engine `{engine}` can't compute digests")
+        if dev_pair is None and engine not in _HASHING_ENGINES:
+            raise ValueError(f"Copy engine `{engine}` requires file descriptors")
+        return [engine]
+
+    if dev_pair is None:
+        return [ENGINE_PIPELINE]
+
+    # Overlapping reads and writes only pays off across two devices.
+    userspace_engine = ENGINE_READINTO if dev_pair[0] == dev_pair[1] else ENGINE_PIPELINE
+
+    if hashers:
+        # The data must go through userspace to be hashed.
+        return [userspace_engine]
+
+    return [
+        name for name in (ENGINE_COPY_FILE_RANGE, ENGINE_SENDFILE, userspace_engine)
+        if name not in _UNSUPPORTED_ENGINES[dev_pair]
+    ]
+
+
+def _copyfileobj(
+    srcfile, destfile, callback, buf_size, buf_count=DEFAULT_BUFFER_COUNT, 
+    engine=ENGINE_AUTO, hashers=None, resumable=False, write_policy=DEFAULT_WRITE_POLICY
+):
+    """ copy from srcfile to destfile
+
+    Args:
+        srcfile: path to source file
+        destfile: path to destination file
+        callback: callable callback that will be called every `CALLBACK_INTERVAL` secs
+        buf_size: how many bytes to copy at once
+        buf_count: how many buffers in flight in pipeline mode
+        engine: one of `ENGINE_*`
+        hashers: optional {digest name: hash object} updated with the copied data
+        resumable: write through a `TransferJournal`, resuming a previous copy
+        write_policy: `WritePolicy` applied to the copy
+    """
+    hashers = list((hashers or {}).values())
+    total_size = os.stat(srcfile).st_size
+
+    journal = TransferJournal(destfile) if resumable else None
+    offset = journal.resume_offset(srcfile) if journal is not None else 0
+
+    # Unbuffered: every engine shares the same file offsets, which allows an
+    # engine to pick up where the previous one gave up.
+    with open(srcfile, "rb", buffering=0) as fsrc:
+        dest_path = journal.partial_path if journal is not None else destfile
+        with open(dest_path, "r+b" if offset else "wb", buffering=0) as fdest:
+            if offset:
+                print(f"[INFO] Resuming `{srcfile}` at {offset / (1<<20):.1f} MB")
+                fdest.truncate(offset)
+                fdest.seek(offset)
+                _hash_prefix(fsrc, hashers, offset, buf_size)
+
+            write_policy.before_copy(fsrc, fdest, offset, total_size)
+
+            # Every `CHECKPOINT_INTERVAL` bytes
+            def checkpoint_fn(copied):
+                if journal is not None:
+                    journal.checkpoint(fdest, srcfile, copied)
+                write_policy.drop_behind(fsrc, fdest, copied)
+
+            progress = _Progress(
+                callback=callback, 
+                total_size=total_size, 
+                checkpoint_fn=checkpoint_fn, 
+                already_copied=offset
+            )
+            _copy_opened(fsrc, fdest, progress, hashers, buf_size, buf_count, engine)
+
+            write_policy.after_copy(fsrc, fdest, progress.total_copied)
+
+    if journal is not None:
+        journal.commit()
+
+    write_policy.committed(destfile)
+    progress.flush()
+
+
+def _hash_prefix(fsrc, hashers, size, buf_size):
+    """ Feeds the first `size` bytes of `fsrc` to `hashers`, leaves `fsrc` at `size` """
+    if not hashers:
+        fsrc.seek(size)
+        return
+
+    fsrc.seek(0)
+    buffer = bytearray(buf_size)
+    view = memoryview(buffer)
+
+    remaining = size
+    while remaining:
+        read = fsrc.readinto(view[:min(buf_size, remaining)])
+        if not read:
+            raise OSError(errno.EIO, f"`{fsrc.name}` is shorter than its resume offset")
+        for hasher in hashers:
+            hasher.update(view[:read])
+        remaining -= read
+
+
+def _copy_opened(fsrc, fdest, progress, hashers, buf_size, buf_count, engine):
+    """ Runs the engines in order until one of them handles the pair of files """
+    engines = _engines_for(engine, fsrc, fdest, hashers)
+
+    for engine_name in engines:
+        try:
+            _ENGINES[engine_name](fsrc, fdest, progress, hashers, buf_size, buf_count)
+            return
+
+        except _EngineUnsupported:
+            if engine_name == engines[-1]:
+                raise
+            _UNSUPPORTED_ENGINES[_dev_pair(fsrc, fdest)].add(engine_name)
+
+
+class _Progress(object):
+    """ Throttles the calls to the user callback, and to `checkpoint_fn` (called
+    with the total copied every `checkpoint_interval` bytes).
+    """
+
+    def __init__(
+        self, callback, total_size, checkpoint_fn=None, 
+        checkpoint_interval=CHECKPOINT_INTERVAL, already_copied=0
+    ):
+        self._callback = callback
+        self.total_size = total_size
+        self.total_copied = already_copied
+        self._pending = already_copied  # Reported at the first callback
+        self._last_update = time.perf_counter()
+
+        self._checkpoint_fn = checkpoint_fn
+        self._checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = already_copied
+
+    def update(self, copied):
+        self.total_copied += copied
+        self._pending += copied
+
+        if (
+            self._checkpoint_fn is not None and 
+            self.total_copied - self._last_checkpoint >= self._checkpoint_interval
+        ):
+            self._checkpoint_fn(self.total_copied)
+            self._last_checkpoint = self.total_copied
+
+        if (
+            self._callback is not None and 
+            time.perf_counter() - self._last_update > CALLBACK_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._callback is None or self._pending == 0:
+            return
+        
+        self._callback(self._pending, self.total_copied, self.total_size)
+        self._pending = 0
+        self._last_update = time.perf_counter()
+
+
+def _copy_engine_copy_file_range(fsrc, fdest, progress, hashers, buf_size, buf_count):
+    """ In-kernel copy, may even be offloaded to the storage (e.g. reflinks) """
+    if not hasattr(os, "copy_file_range"):
+        raise _EngineUnsupported(ENGINE_COPY_FILE_RANGE)
+
+    in_fd, out_fd = fsrc.fileno(), fdest.fileno()
+    started = False
+    while True:
+        try:
+            copied = os.copy_file_range(in_fd, out_fd, buf_size)
+        except OSError as e:
+            if e.errno in _FALLBACK_ERRNOS:
+                raise _EngineUnsupported(ENGINE_COPY_FILE_RANGE) from e
+            raise
+
+        if copied == 0:
+            # Some filesystems (e.g. FUSE ones) return 0 instead of failing.
+            if not started and progress.total_copied < progress.total_size:
+                raise _EngineUnsupported(ENGINE_COPY_FILE_RANGE)
+            return
+        
+        started = True
+        progress.update(copied)
+
+
+def _copy_engine_sendfile(fsrc, fdest, progress, hashers, buf_size, buf_count):
+    """ In-kernel copy through the page cache, works across filesystems """
+    in_fd, out_fd = fsrc.fileno(), fdest.fileno()
+    started = False
+    while True:
+        try:
+            copied = os.sendfile(out_fd, in_fd, None, buf_size)
+        except OSError as e:
+            if e.errno in _FALLBACK_ERRNOS:
+                raise _EngineUnsupported(ENGINE_SENDFILE) from e
+            raise
+
+        if copied == 0:
+            if not started and progress.total_copied < progress.total_size:
+                raise _EngineUnsupported(ENGINE_SENDFILE)
+            return
+
+        started = True
+        progress.update(copied)
+
+
+def _copy_engine_readinto(fsrc, fdest, progress, hashers, buf_size, buf_count):
+    """ Userspace copy through a single preallocated buffer """
+    buffer = bytearray(buf_size)
+    view = memoryview(buffer)
+
+    while size := fsrc.readinto(buffer):
+        for hasher in hashers:
+            hasher.update(view[:size])
+        written = 0
+        while written < size:
+            written += fdest.write(view[written:size])
+        progress.update(size)
+
+
+def _copy_engine_pipeline(fsrc, fdest, progress, hashers, buf_size, buf_count):
+    """ Userspace copy where a reader thread fills a bounded ring of 
+    preallocated buffers while the calling thread writes them out.
+    """
+    free_buffers = queue.Queue()
+    filled_buffers = queue.Queue()
+    for _ in range(buf_count):
+        free_buffers.put(bytearray(buf_size))
+
+    def reader_fn():
+        try:
+            while (buffer := free_buffers.get()) is not None:
+                size = fsrc.readinto(buffer)
+                filled_buffers.put((buffer, size))
+                if not size:
+                    return
+        except BaseException as e:
+            filled_buffers.put((e, 0))
+
+    reader = threading.Thread(target=reader_fn, name="copy-reader", daemon=True)
+    reader.start()
+
+    try:
+        while True:
+            buffer, size = filled_buffers.get()
+            if isinstance(buffer, BaseException):
+                raise buffer
+            if not size:
+                break
+
+            view = memoryview(buffer)
+            written = 0
+            while written < size:
+                written += fdest.write(view[written:size])
+            for hasher in hashers:
+                hasher.update(view[:size])
             
-            step = 1            
-            while data_buffer := fsrc.read(buf_size):
-                fdest.write(data_buffer)
-                step += 1
-                
-                if callback is not None and (time.perf_counter() - last_callback_update > 0.5):
-                    copied = min(step * buf_size, total_size)   # the last chunk may be smaller than CHUNK_SIZE.
-                    callback(len(data_buffer), copied, total_size)
-                    last_callback_update = time.perf_counter()
+            free_buffers.put(buffer)
+            progress.update(size)
+
+    finally:
+        free_buffers.put(None)  # Stops the reader if the writer failed
+        reader.join()
+
+
+_ENGINES = {
+    ENGINE_COPY_FILE_RANGE: _copy_engine_copy_file_range,
+    ENGINE_SENDFILE: _copy_engine_sendfile,
+    ENGINE_READINTO: _copy_engine_readinto,
+    ENGINE_PIPELINE: _copy_engine_pipeline,
+}
+
+# Engines moving the data through userspace, i.e. able to compute digests
+_HASHING_ENGINES = (ENGINE_READINTO, ENGINE_PIPELINE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+""" Content-addressed dedup on the target device: a clip is stored once """
+
+import errno
+import fcntl
+import os
+
+from copy_utils import DIGEST_MD5
+
+from hash_index import HashIndex
+from hash_index import find_mountpoint
+
+from runtime import DIGEST_FINGERPRINT
+from runtime import VideoFile
+
+from verify import VERIFY_FINGERPRINT
+from verify import verify
+
+
+DEDUP_OFF = "off"
+DEDUP_SKIP = "skip"          # Nothing is written, the clip stays at its first location
+DEDUP_HARDLINK = "hardlink"
+DEDUP_REFLINK = "reflink"    # Copy-on-write clone (Btrfs, XFS), falls back to a hardlink
+
+DEDUP_MODES = (DEDUP_OFF, DEDUP_SKIP, DEDUP_HARDLINK, DEDUP_REFLINK)
+
+_FICLONE = 0x40049409  # _IOW(0x94, 9, int) from <linux/fs.h>
+
+# errnos meaning "links are not supported here", e.g. hardlinks on exFAT
+_UNSUPPORTED_ERRNOS = {
+    errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV,
+    errno.EINVAL, errno.ENOTTY, errno.EMLINK
+}
+
+
+def _reflink(src, dest):
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdest.close()
+            os.unlink(dest)
+            raise
+
+
+class TargetDedup(object):
+    """ Finds clips already stored anywhere on the device of a target file.
+
+    Candidates are looked up by fingerprint (and md5 when the source one is
+    already known) in the hash index of the target device, then confirmed
+    with `verify(mode=verify_mode)`. Target fingerprints are recorded after
+    each copy, the index grows with every trip. Several target devices can
+    share the same `TargetDedup`.
+    """
+
+    def __init__(self, mode=DEDUP_HARDLINK, verify_mode=VERIFY_FINGERPRINT):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: `{mode}`")
+
+        self.mode = mode
+        self.verify_mode = verify_mode
+
+        self._links_unsupported = set()  # Mountpoints of the target devices
+
+    @staticmethod
+    def hash_index(target_f):
+        # The folder of `target_f` may not exist yet
+        return HashIndex.for_root(find_mountpoint(target_f.parent))
+
+    def find_duplicate(self, source_f, target_f):
+        """ Returns a `VideoFile` identical to `source_f`, on the device of
+        `target_f`. The clips of the source card are never candidates, even
+        when both devices share a filesystem.
+        """
+        if self.mode == DEDUP_OFF:
+            return None
+
+        hash_index = self.hash_index(target_f)
+        candidates = hash_index.find(DIGEST_FINGERPRINT, source_f.fingerprint)
+
+        # Free if the source was hashed before, e.g. by a previous copy
+        source_md5 = source_f.hash_index.lookup(source_f, DIGEST_MD5)
+        if source_md5 is not None:
+            candidates.extend(hash_index.find(DIGEST_MD5, source_md5))
+
+        source_root = os.path.realpath(source_f.device_root)
+        for path in dict.fromkeys(candidates):  # Unique, in order
+            path = os.path.realpath(path)
+            if path == os.path.realpath(target_f):
+                continue
+
+            if os.path.commonpath([path, source_root]) == source_root:
+                continue
+
+            candidate = VideoFile(path)
+            if verify(source_f, candidate, mode=self.verify_mode):
+                return candidate
+
+        return None
+
+    def link(self, existing_f, target_f):
+        """ Makes `target_f` a copy of `existing_f` without copying its data.
+
+        Returns the dedup mode used, None if links are not supported by the
+        filesystem (the file must then be copied).
+        """
+        if self.mode == DEDUP_SKIP:
+            print(f"[INFO] SKIP: `{target_f.name}` is already stored as `{existing_f}`")
+            return DEDUP_SKIP
+
+        target_root = find_mountpoint(target_f.parent)
+        if target_root in self._links_unsupported:
+            return None
+
+        modes = [DEDUP_REFLINK, DEDUP_HARDLINK] if self.mode == DEDUP_REFLINK else [DEDUP_HARDLINK]
+        for mode in modes:
+            try:
+                if mode == DEDUP_REFLINK:
+                    _reflink(existing_f, target_f)
+                else:
+                    os.link(existing_f, target_f)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                continue
+
+            print(f"[INFO] {mode.upper()}: `{target_f}` => `{existing_f}`")
+            self._copy_digests(existing_f, target_f)
+            return mode
+
+        print(f"[INFO] `{target_root}` doesn't support {self.mode}s, duplicates are copied.")
+        self._links_unsupported.add(target_root)
+        return None
+
+    def _copy_digests(self, existing_f, target_f):
+        digests = dict()
+        for algo in (DIGEST_MD5, DIGEST_FINGERPRINT):
+            if (digest := self.hash_index(target_f).lookup(existing_f, algo)) is not None:
+                digests[algo] = digest
+        target_f.record_digests(digests)
+
+    def record_copy(self, source_f, target_f):
+        """ Indexes the fingerprint of a copied file, already known from the source """
+        if self.mode == DEDUP_OFF:
+            return
+
+        fingerprint = source_f.hash_index.lookup(source_f, DIGEST_FINGERPRINT)
+        if fingerprint is not None:
+            target_f.record_digests({DIGEST_FINGERPRINT: fingerprint})
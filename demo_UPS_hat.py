@@ -7,10 +7,11 @@ if __name__=='__main__':
     # Create an INA219 instance.
     ina219 = INA219(addr=0x43)
     while True:
-        bus_voltage = ina219.getBusVoltage_V()             # voltage on V- (load side)
-        shunt_voltage = ina219.getShuntVoltage_mV() / 1000 # voltage between V+ and V- across the shunt
-        current = ina219.getCurrent_mA()                   # current in mA
-        power = ina219.getPower_W()                        # power in W
+        reading = ina219.read_all()                        # all the registers in a single pass
+        bus_voltage = reading.bus_voltage_V                # voltage on V- (load side)
+        shunt_voltage = reading.shunt_voltage_mV / 1000    # voltage between V+ and V- across the shunt
+        current = reading.current_mA                       # current in mA
+        power = reading.power_W                            # power in W
         
         charge_perc = (bus_voltage - 3) / 1.2 * 100
         charge_perc = min(charge_perc, 100)
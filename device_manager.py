@@ -0,0 +1,325 @@
+""" Live registry of the mounted USB devices, driven by udev and mount events """
+
+import pyudev
+
+import os
+import queue
+import select
+import threading
+
+from collections import deque
+from collections import namedtuple
+
+from hash_index import HashIndex
+from hash_index import unescape_mount_field
+
+from runtime import USBDevice
+
+
+MOUNTS_PATH = "/proc/self/mounts"
+
+EVENT_SOURCE_ADDED = "source_added"
+EVENT_SOURCE_REMOVED = "source_removed"
+EVENT_TARGET_ADDED = "target_added"
+EVENT_TARGET_REMOVED = "target_removed"
+
+ACTION_ADD = "add"
+ACTION_REMOVE = "remove"
+
+DeviceEvent = namedtuple("DeviceEvent", ["kind", "device"])
+
+# Mounted partition: `USBDevice` and whether it was a source when mounted
+_Mounted = namedtuple("_Mounted", ["device", "is_source"])
+
+
+def _is_removable_partition(device):
+    if device.device_type != "partition" or device.device_node is None:
+        return False
+
+    disk = device.find_parent("block", "disk")
+    try:
+        return disk is not None and disk.attributes.asstring("removable") == "1"
+    except KeyError:
+        return False
+
+
+class UdevSource(object):
+    """ Removable block partitions, enumerated once then followed with a
+    `pyudev.Monitor`. Its file descriptor becomes readable on each event.
+    """
+
+    def __init__(self):
+        self._context = pyudev.Context()
+        self._monitor = pyudev.Monitor.from_netlink(self._context)
+        self._monitor.filter_by(subsystem="block", device_type="partition")
+        self._monitor.start()
+
+    def fileno(self):
+        return self._monitor.fileno()
+
+    def list_partitions(self):
+        return {
+            device.device_node
+            for device in self._context.list_devices(subsystem="block", DEVTYPE="partition")
+            if _is_removable_partition(device)
+        }
+
+    def receive(self):
+        """ Returns the pending (action, device node), without blocking """
+        events = list()
+        while (device := self._monitor.poll(timeout=0)) is not None:
+            if device.action == ACTION_REMOVE:
+                # Sysfs is already gone: the parent can't be checked anymore
+                events.append((ACTION_REMOVE, device.device_node))
+            elif device.action == ACTION_ADD and _is_removable_partition(device):
+                events.append((ACTION_ADD, device.device_node))
+        return events
+
+    def close(self):
+        pass
+
+
+class MountTable(object):
+    """ `/proc/self/mounts`, the kernel flags its file descriptor with
+    `POLLPRI` every time a filesystem is mounted or unmounted.
+    """
+
+    POLL_EVENTS = select.POLLPRI | select.POLLERR
+
+    def __init__(self, path=MOUNTS_PATH):
+        self._f = open(path)
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def read(self):
+        """ Returns {device node: mountpoint}, first mount of each device """
+        self._f.seek(0)  # Also acknowledges the change
+        mounts = dict()
+        for line in self._f.read().splitlines():
+            fields = line.split()
+            if len(fields) >= 2 and fields[0].startswith("/dev/"):
+                mounts.setdefault(fields[0], unescape_mount_field(fields[1]))
+        return mounts
+
+    def close(self):
+        self._f.close()
+
+
+class DeviceManager(object):
+    """ Registry of the mounted removable partitions, as `USBDevice`.
+
+    Udev add / remove events and mount table changes wake up the monitor
+    thread, nothing is polled. Every change of the registry is queued as a
+    `DeviceEvent`: a card swapped in the middle of a session shows up as
+    `EVENT_SOURCE_REMOVED` followed by `EVENT_SOURCE_ADDED`.
+
+    A device is a source or a target depending on its content when mounted
+    (see `USBDevice.is_source`).
+    """
+
+    def __init__(self, udev_source=None, mount_table=None):
+        self._udev = udev_source
+        self._mounts = mount_table
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._partitions = set()
+        self._mounted = dict()  # {device node: _Mounted}
+
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="device-manager", daemon=True)
+
+    def start(self):
+        self._udev = self._udev if self._udev is not None else UdevSource()
+        self._mounts = self._mounts if self._mounts is not None else MountTable()
+
+        self._partitions = set(self._udev.list_partitions())
+        self._refresh()  # Devices already plugged are reported as added
+
+        self._thread.start()
+        return self
+
+    def stop(self):
+        os.write(self._wake_w, b"\0")
+        self._thread.join()
+
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
+        self._udev.close()
+        self._mounts.close()
+
+    def get(self, timeout=None):
+        """ Returns the next `DeviceEvent`, None if none came within `timeout` secs """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _devices(self, is_source):
+        with self._lock:
+            return sorted(m.device for m in self._mounted.values() if m.is_source == is_source)
+
+    @property
+    def sources(self):
+        return self._devices(is_source=True)
+
+    @property
+    def targets(self):
+        return self._devices(is_source=False)
+
+    def _refresh(self):
+        mounts = self._mounts.read()
+
+        with self._lock:
+            current = {
+                node: mountpoint for node, mountpoint in mounts.items()
+                if node in self._partitions
+            }
+
+            for node, mounted in list(self._mounted.items()):
+                if current.get(node) != str(mounted.device):
+                    del self._mounted[node]
+                    # Its index must not be reused for the next card mounted there
+                    HashIndex.close_root(mounted.device)
+                    print(f"[INFO] USB device removed: `{mounted.device}`")
+                    self._queue.put(DeviceEvent(
+                        EVENT_SOURCE_REMOVED if mounted.is_source else EVENT_TARGET_REMOVED,
+                        mounted.device
+                    ))
+
+            for node, mountpoint in current.items():
+                if node in self._mounted:
+                    continue
+
+                # Another card may have been mounted at the same place before
+                USBDevice.clear_caches()
+                device = USBDevice(mountpoint)
+                self._mounted[node] = _Mounted(device, device.is_source())
+
+                print(f"[INFO] USB device added: `{device}` ({'source' if device.is_source() else 'target'})")
+                self._queue.put(DeviceEvent(
+                    EVENT_SOURCE_ADDED if device.is_source() else EVENT_TARGET_ADDED,
+                    device
+                ))
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._wake_r, select.POLLIN)
+        poller.register(self._udev.fileno(), select.POLLIN)
+        poller.register(self._mounts.fileno(), self._mounts.POLL_EVENTS)
+
+        while True:
+            fds = {fd for fd, _ in poller.poll()}
+            if self._wake_r in fds:
+                return
+
+            if self._udev.fileno() in fds:
+                for action, node in self._udev.receive():
+                    if action == ACTION_ADD:
+                        self._partitions.add(node)
+                    else:
+                        self._partitions.discard(node)
+
+            # A partition is only usable once mounted, e.g. by `usbmount`
+            try:
+                self._refresh()
+            except Exception as e:
+                print(f"[WARNING] Impossible to refresh the USB devices: {e}")
+
+
+class FakeMountTable(object):
+    """ `MountTable` driven by `mount` / `unmount` """
+
+    POLL_EVENTS = select.POLLIN
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mounts = dict()
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+
+    def fileno(self):
+        return self._rfd
+
+    def mount(self, device_node, mountpoint):
+        with self._lock:
+            self._mounts[device_node] = str(mountpoint)
+        os.write(self._wfd, b"\0")
+
+    def unmount(self, device_node):
+        with self._lock:
+            self._mounts.pop(device_node, None)
+        os.write(self._wfd, b"\0")
+
+    def read(self):
+        try:
+            os.read(self._rfd, 4096)
+        except BlockingIOError:
+            pass
+        with self._lock:
+            return dict(self._mounts)
+
+    def close(self):
+        for fd in (self._rfd, self._wfd):
+            os.close(fd)
+
+
+class FakeUdevSource(object):
+    """ `UdevSource` driven by `plug` / `unplug`, its `mount_table` is a
+    `FakeMountTable` to pass to `DeviceManager` along with it.
+    """
+
+    def __init__(self):
+        self.mount_table = FakeMountTable()
+        self._lock = threading.Lock()
+        self._partitions = set()
+        self._events = deque()
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+
+    def fileno(self):
+        return self._rfd
+
+    def list_partitions(self):
+        with self._lock:
+            return set(self._partitions)
+
+    def receive(self):
+        try:
+            os.read(self._rfd, 4096)
+        except BlockingIOError:
+            pass
+        with self._lock:
+            events, self._events = list(self._events), deque()
+        return events
+
+    def _push(self, action, device_node):
+        with self._lock:
+            if action == ACTION_ADD:
+                self._partitions.add(device_node)
+            else:
+                self._partitions.discard(device_node)
+            self._events.append((action, device_node))
+        os.write(self._wfd, b"\0")
+
+    def plug(self, device_node, mountpoint=None):
+        """ Adds a partition, mounted at `mountpoint` if given """
+        self._push(ACTION_ADD, device_node)
+        if mountpoint is not None:
+            self.mount_table.mount(device_node, mountpoint)
+
+    def unplug(self, device_node):
+        """ Removes a partition without unmounting it, as a card pulled out """
+        self._push(ACTION_REMOVE, device_node)
+
+    def close(self):
+        for fd in (self._rfd, self._wfd):
+            os.close(fd)
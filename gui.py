@@ -1,29 +1,74 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
-import LCD_1in44
-
 import RPi.GPIO as GPIO
 
 import copy
+import itertools
 import math
 import time
 import os
 import sys
+import threading
 
+from collections import defaultdict
+from collections import namedtuple
 from contextlib import contextmanager
 from functools import lru_cache
 
-from copy_utils import DEFAULT_BUFFER_SIZE
-from copy_utils import copy_with_callback
+from copy_scheduler import CopyScheduler
+from copy_scheduler import EVENT_DONE
+from copy_scheduler import EVENT_FAILED
+from copy_scheduler import EVENT_PAUSED
+from copy_scheduler import EVENT_RESUMED
+from copy_scheduler import EVENT_STARTED
+
+from copy_utils import DURABILITY_FILE
+from copy_utils import DURABILITY_MODES
+from copy_utils import WritePolicy
+
+from dedup import DEDUP_HARDLINK
+from dedup import DEDUP_MODES
+from dedup import DEDUP_OFF
+from dedup import TargetDedup
+
+from device_manager import DeviceManager
+from device_manager import EVENT_SOURCE_REMOVED
+from device_manager import EVENT_TARGET_REMOVED
+
+from INA219 import INA219
+
+from input_events import InputEvents
+from input_events import KEY1_PIN
+from input_events import KEY_DOWN_PIN
+from input_events import KEY_LEFT_PIN
+from input_events import KEY_PRESS_PIN
+from input_events import KEY_RIGHT_PIN
+from input_events import KEY_UP_PIN
+
+from io_topology import DEFAULT_SSD_WORKERS
+from io_topology import IOTopology
+
+from power_governor import PowerGovernor
+
+from power_monitor import PowerSampler
+from power_monitor import UPS_HAT_ADDR
+
+from render_cache import RenderCache
+
+from renderer import DEFAULT_MAX_FPS
+from renderer import LCDBackend
+from renderer import Renderer
 
-from runtime import get_or_create_target_dir
-from runtime import get_usb_devices
 from runtime import USBDevice
-from runtime import VideoFile
 
-from PIL import Image
-from PIL import ImageDraw
+from sync_planner import ORDER_BY_DIRECTORY
+from sync_planner import ORDER_LARGEST_FIRST
+from sync_planner import SyncPlanner
+from sync_planner import format_duration
+
+from verify import VERIFY_FINGERPRINT
+from verify import VERIFY_FULL
 
 __author__ = "Jonathan Dekhtiar"
 __version__ = "1.0.0"
@@ -32,25 +77,88 @@ __version__ = "1.0.0"
 __line_len__ = 43
 
 
+# Copy screen content, drawn on the display thread. `session` changes on every
+# copy so that a new screen is drawn even for the same day.
+CopyScreenState = namedtuple(
+    "CopyScreenState", ["session", "date", "status", "size", "progress", "message", "battery"]
+)
+
+
 class VideoListing(object):
-    def __init__(self, source_d: USBDevice) -> None:
-        if not source_d.is_source():
-            raise RuntimeError(f"Only source devices can be accepted. Received {source_d}")
-        
-        self._videos_dict = source_d.list_all_videos()
+    """ Index of the source videos per day, filled in the background.
+
+    `DCIM/1xxGOPRO` folders are scanned newest first, so the most recent days
+    are available right away. `version` changes every time days are added.
+    Each source card is scanned by its own thread, a day lists the videos of
+    every card.
+    """
+
+    def __init__(self, sources) -> None:
+        for source_d in sources:
+            if not source_d.is_source():
+                raise RuntimeError(f"Only source devices can be accepted. Received {source_d}")
         
+        self._sources = list(sources)
+        self._lock = threading.Lock()
+        self._videos_dict = defaultdict(list)
+        self._version = 0
+        self._scans_left = len(self._sources)
+        self._complete = threading.Event()
+
+        if not self._sources:
+            self._complete.set()
+
+        self._scan_threads = [
+            threading.Thread(
+                target=self._scan, args=(source_d,), name=f"video-listing-{source_d.device_id}", 
+                daemon=True
+            )
+            for source_d in self._sources
+        ]
+        for thread in self._scan_threads:
+            thread.start()
+
+    def _scan(self, source_d):
+        try:
+            snapshot = source_d.listing_snapshot
+            for video_dir in source_d.list_video_dirs():
+                videos = USBDevice.scan_dir_for_videos(video_dir, snapshot)
+
+                with self._lock:
+                    for video_f in videos:
+                        self._videos_dict[video_f.date_created].append(video_f)
+                    self._version += 1
+
+            snapshot.save()
+        finally:
+            with self._lock:
+                self._scans_left -= 1
+                if self._scans_left == 0:
+                    self._complete.set()
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def is_complete(self):
+        return self._complete.is_set()
+
     @property
-    @lru_cache
     def videos(self):
+        self._complete.wait()
         return self._videos_dict
 
     @property
-    @lru_cache
     def days(self):
-        return sorted(self._videos_dict.keys(), reverse=True)
+        with self._lock:
+            return sorted(self._videos_dict.keys(), reverse=True)
     
     def get_videos(self, day):
-        return self.videos[day]
+        # A day can span several folders, its list is only final once scanned.
+        self._complete.wait()
+        with self._lock:
+            return sorted(self._videos_dict[day], key=lambda v: (v.device_id, v.name))
 
 
 class Display(object):
@@ -64,61 +172,62 @@ class Display(object):
     max_height = height - (y_offset * 2)
     max_lines = 6
 
-    def _setup_draw_disp_base(self):
-        # Create blank image for drawing.
-        # Make sure to create image with mode '1' for 1-bit color.
-        image = Image.new('RGB', (Display.width, Display.height))
-        # Get drawing object to draw on image.
-        draw = ImageDraw.Draw(image)
+    exit_y_pos = height - int(y_offset * 1.3)
 
-        # Black background
-        draw.rectangle((0, 0, Display.width, Display.height), outline=0, fill=0)
+    def _setup_draw_disp_base(self, layer=None, draw_layer_fn=None):
+        # Copy of the pre-rendered static `layer` (black background by default),
+        # with a drawing object recording the damaged regions.
+        return self._render_cache.new_frame(layer, draw_layer_fn)
 
-        return draw, image
+    def _text(self, draw, xy, text, fill="WHITE"):
+        # Pastes the cached rasterization of `text`
+        self._render_cache.text(draw, xy, text, fill=fill)
 
     @contextmanager
-    def get_draw_ctx(self):
+    def get_draw_ctx(self, layer=None, draw_layer_fn=None):
 
-        draw, image = self._setup_draw_disp_base()
+        draw, image = self._setup_draw_disp_base(layer, draw_layer_fn)
 
         yield draw
 
-        # Display
-        self._disp.LCD_ShowImage(image,0,0)
+        # Display, on the display thread
+        self._renderer.post_image(image, rects=draw.pop_damage())
 
     @property
-    def source_d(self):
-        if self._source_d is None:
-            raise RuntimeError("`source_d` is not defined ...")
+    def sources(self):
+        if not self._sources:
+            raise RuntimeError("`sources` are not defined ...")
         
-        return self._source_d
+        return self._sources
 
-    @source_d.setter
-    def source_d(self, device):
-        if self._source_d is not None:
-            raise RuntimeError("`source_d` is already defined ...")
+    @sources.setter
+    def sources(self, devices):
+        if self._sources:
+            raise RuntimeError("`sources` are already defined ...")
         
-        if not isinstance(device, USBDevice):
-            raise ValueError(f"`source_d` should be an instance of `USBDevice`, received: {type(device)}")
+        for device in devices:
+            if not isinstance(device, USBDevice):
+                raise ValueError(f"`sources` should be instances of `USBDevice`, received: {type(device)}")
         
-        self._source_d = device
+        self._sources = list(devices)
 
     @property
-    def target_d(self):
-        if self._target_d is None:
-            raise RuntimeError("`target_d` is not defined ...")
+    def targets(self):
+        if not self._targets:
+            raise RuntimeError("`targets` are not defined ...")
         
-        return self._target_d
+        return self._targets
 
-    @target_d.setter
-    def target_d(self, device):
-        if self._target_d is not None:
-            raise RuntimeError("`target_d` is already defined ...")
+    @targets.setter
+    def targets(self, devices):
+        if self._targets:
+            raise RuntimeError("`targets` are already defined ...")
         
-        if not isinstance(device, USBDevice):
-            raise ValueError(f"`target_d` should be an instance of `USBDevice`, received: {type(device)}")
+        for device in devices:
+            if not isinstance(device, USBDevice):
+                raise ValueError(f"`targets` should be instances of `USBDevice`, received: {type(device)}")
         
-        self._target_d = device
+        self._targets = list(devices)
 
     @property
     def days(self):        
@@ -127,7 +236,7 @@ class Display(object):
     @property
     def videos(self):
         if self._videos is None:
-            self._videos = VideoListing(source_d=self.source_d)
+            self._videos = VideoListing(sources=self.sources)
         
         return self._videos
 
@@ -144,47 +253,106 @@ class Display(object):
         return struct
     
     @property
-    @lru_cache
     def num_pages(self):
         return math.ceil(len(self.days) / Display.max_lines)
 
-    def __init__(self) -> None:
-        self._videos = None
-        self._source_d = None
-        self._target_d = None
+    def __init__(
+        self, 
+        verify_mode=VERIFY_FINGERPRINT, 
+        backend=None, 
+        max_fps=DEFAULT_MAX_FPS, 
+        gpio=GPIO, 
+        power_sampler=None,
+        dedup_mode=DEDUP_HARDLINK,
+        write_policy=None,
+        device_manager=None,
+        io_topology=None
+    ) -> None:
+        self._verify_mode = verify_mode  # How existing target files are compared
+        self._dedup_mode = dedup_mode  # What to do with clips already stored on the target
+        self._write_policy = write_policy or WritePolicy()  # When copies reach the target
+        self._gpio = gpio  # `RPi.GPIO` or `input_events.SimulatedGPIO`
+        self._max_fps = max_fps  # LCD refresh rate on full power
+        self._inputs = None
+        self._devices = device_manager  # `device_manager.DeviceManager`, started in `exec_loop`
+        self._io_topology = io_topology or IOTopology()  # Copies allowed per disk / USB port
+        self._power_sampler = power_sampler  # `power_monitor.PowerSampler`, None without UPS HAT
+        self._power_governor = PowerGovernor(power_sampler) if power_sampler is not None else None
 
-        # 240x240 display with hardware SPI:
-        self._disp = LCD_1in44.LCD()
-        Lcd_ScanDir = LCD_1in44.SCAN_DIR_DFT  #SCAN_DIR_DFT = D2U_L2R
-        self._disp.LCD_Init(Lcd_ScanDir)
-        self._disp.LCD_Clear()
+        self._videos = None
+        self._sources = list()
+        self._targets = list()
+
+        # 128x128 display with hardware SPI, owned by the display thread
+        self._renderer = Renderer(
+            backend=backend if backend is not None else LCDBackend(),
+            max_fps=max_fps
+        ).start()
+        self._copy_sessions = itertools.count()
+        self._copy_screen = None  # (session, draw, image, drawn state)
+        self._render_cache = RenderCache(Display.width, Display.height)
 
         self._page_idx = 0
         self._cur_pos = 0
+        self._drawn_selector_state = None
 
         self.disp_welcome_screen()
     
+    @staticmethod
+    def _draw_welcome_layer(draw):
+        draw.text((15, 15), "GO PRO DATA COPIER", fill="WHITE")
+        draw.text((0, 35), "-" * __line_len__, fill="WHITE")
+        draw.text((17, 53), f"{__author__}", fill="WHITE")
+        draw.text((32, 68), f"Version: {__version__}", fill="WHITE")
+        draw.text((0, 85), "-" * __line_len__, fill="WHITE")
+        draw.text((32, 105), f"... LOADING ...", fill="WHITE")
+
+    @staticmethod
+    def _draw_selector_layer(draw):
+        draw.text(Display.init_pos, "Days Available:", fill="WHITE")
+        draw.text((Display.width - 30, Display.exit_y_pos), "EXIT", fill="WHITE")
+
+    @staticmethod
+    def _draw_copy_layer(draw):
+        draw.text((0, 35), "-" * __line_len__, fill="WHITE")
+        draw.text((0, 85), "-" * __line_len__, fill="WHITE")
+
     def disp_welcome_screen(self):
 
-        with self.get_draw_ctx() as draw:
-            
-            draw.text((15, 15), "GO PRO DATA COPIER", fill="WHITE")
-            draw.text((0, 35), "-" * __line_len__, fill="WHITE")
-            draw.text((17, 53), f"{__author__}", fill="WHITE")
-            draw.text((32, 68), f"Version: {__version__}", fill="WHITE")
-            draw.text((0, 85), "-" * __line_len__, fill="WHITE")
-            draw.text((32, 105), f"... LOADING ...", fill="WHITE")
+        with self.get_draw_ctx(layer="welcome", draw_layer_fn=Display._draw_welcome_layer):
+            pass
 
         time.sleep(5)  # Force display of the welcome screen for 5 secs.
 
+    def _battery_text(self):
+        # Smoothed by the sampler thread: no I2C transfer here
+        if self._power_sampler is None or (perc := self._power_sampler.battery_percent) is None:
+            return None
+        return f"{perc:.0f}%"
+
+    def _apply_power_policy(self):
+        # The LCD refresh rate follows the battery level
+        if self._power_governor is not None:
+            policy_fps = self._power_governor.policy().max_fps
+            self._renderer.max_fps = min(policy_fps or self._max_fps, self._max_fps)
+
+    def _selector_state(self):
+        return self.videos.version, self.videos.is_complete, self._battery_text()
+
     def disp_refresh_day_selector(self):
 
-        with self.get_draw_ctx() as draw:
+        self._drawn_selector_state = self._selector_state()
+        battery = self._drawn_selector_state[-1]
+
+        # Base Layout is pre-rendered
+        with self.get_draw_ctx(layer="selector", draw_layer_fn=Display._draw_selector_layer) as draw:
+
+            if battery is not None:
+                self._text(draw, (Display.width - 28, Display.init_pos[1]), battery)
 
-            # Base Layout
-            draw.text(Display.init_pos, "Days Available:", fill="WHITE")
-            exit_y_pos = Display.height - int(Display.y_offset * 1.3)
-            draw.text((Display.width - 30, exit_y_pos), "EXIT", fill="WHITE")
+            if not self.videos.is_complete:
+                # More days may still show up
+                self._text(draw, (5, Display.exit_y_pos), "SCANNING")
         
             days = self.days[self._page_idx * Display.max_lines:]
             for idx, day in enumerate(days):
@@ -192,20 +360,20 @@ class Display(object):
                     break
 
                 y_pos = self.line_struct[idx]
-                draw.text((Display.x_offset, y_pos), day, fill="WHITE")
+                self._text(draw, (Display.x_offset, y_pos), day)
 
             if len(days) > Display.max_lines:
-                draw.text((Display.x_offset + 23, y_pos + Display.y_offset), "...", fill="WHITE")
+                self._text(draw, (Display.x_offset + 23, y_pos + Display.y_offset), "...")
 
             # Print cursor
             if self._cur_pos >= Display.max_lines:
                 raise ValueError(f"Invalid `cur_pos` received: {self._cur_pos=}. Should be < {Display.max_lines}")
             
             if self._cur_pos >= 0:
-                draw.text((Display.x_offset - 10, self.line_struct[self._cur_pos]), ">", fill="WHITE")
+                self._text(draw, (Display.x_offset - 10, self.line_struct[self._cur_pos]), ">")
 
             else:
-                draw.text((Display.width - 40, exit_y_pos), ">", fill="WHITE")
+                self._text(draw, (Display.width - 40, Display.exit_y_pos), ">")
 
     def move_up(self):
         self._cur_pos -= 1
@@ -253,83 +421,122 @@ class Display(object):
         self._cur_pos = 0
         self.disp_refresh_day_selector()
 
+    def _cleanup(self):
+        if self._inputs is not None:
+            self._inputs.stop()
+        if self._devices is not None:
+            self._devices.stop()
+        self._renderer.stop()
+        self._gpio.cleanup()
+
     def press_select(self):
         if self._cur_pos == -1:
             print("[INFO] Unmounting USB Devices ...")
-            assert(self.source_d.umount())
-            assert(self.target_d.umount())
+            assert(all([device.umount() for device in self.sources + self.targets]))
             print("[INFO] Cleaning up GPIO")
-            GPIO.cleanup()
+            self._cleanup()
             print("[INFO] Now shutting down ...")
             time.sleep(2)
             os.system('sudo shutdown now')
             sys.exit(0)
 
         else:
-            selected_day = self.days[self._page_idx * Display.max_lines:][self._cur_pos]
+            days = self.days[self._page_idx * Display.max_lines:]
+            if self._cur_pos >= len(days):
+                return  # No day found yet
+            
+            selected_day = days[self._cur_pos]
             self.disp_copy_screen_loop(date=selected_day)
             self.disp_refresh_day_selector()  # return to date select screen
 
+    def press_sync_all(self):
+        self.disp_sync_all_loop()
+        self.disp_refresh_day_selector()  # return to date select screen
+
+    def _usb_devices_changed(self):
+        """ True if a device in use was removed (e.g. a card swap), or a new
+        one was plugged: the session restarts with every device.
+        """
+        # Identity: a new card can be mounted at the same place
+        in_use = {id(device) for device in self._sources + self._targets}
+
+        changed = False
+        while (event := self._devices.get(timeout=0)) is not None:
+            if event.kind in (EVENT_SOURCE_REMOVED, EVENT_TARGET_REMOVED):
+                changed |= id(event.device) in in_use
+            else:
+                changed |= id(event.device) not in in_use
+        return changed
+
+    def switch_usb_devices(self):
+        print("[INFO] USB devices changed, waiting for a source and a target ...")
+        self._sources = list()
+        self._targets = list()
+        self._videos = None
+        self._page_idx = 0
+        self._cur_pos = 0
+        self._io_topology.forget()  # Another card may be mounted at the same place
+
+        self.disp_wait_for_USB_devices_ready_loop()
+
+        # Starts scanning the new source device in the background
+        self.videos
+        self._inputs.clear()
+        self.disp_refresh_day_selector()
+
     def exec_loop(self):
 
+        if self._devices is None:
+            self._devices = DeviceManager().start()
+
         self.disp_wait_for_USB_devices_ready_loop()
+
+        # Starts scanning the source device in the background
+        self.videos
         
-        KEY_UP_PIN     = 6 
-        KEY_DOWN_PIN   = 19
-        KEY_LEFT_PIN   = 5
-        KEY_RIGHT_PIN  = 26
-        KEY_PRESS_PIN  = 13
-        KEY1_PIN       = 21
-        KEY2_PIN       = 20
-        KEY3_PIN       = 16
-
-        #init GPIO
-        GPIO.setmode(GPIO.BCM) 
-
-        GPIO.setup(KEY_UP_PIN,      GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY_DOWN_PIN,    GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY_LEFT_PIN,    GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY_RIGHT_PIN,   GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY_PRESS_PIN,   GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY1_PIN,        GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY2_PIN,        GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
-        GPIO.setup(KEY3_PIN,        GPIO.IN, pull_up_down=GPIO.PUD_UP)      # Input with pull-up
+        #init GPIO: button presses are queued by edge callbacks, nothing is polled
+        self._inputs = InputEvents(self._gpio).start()
+
+        key_handlers = {
+            KEY_UP_PIN: self.move_up,           # UP Arrow is pressed
+            KEY_DOWN_PIN: self.move_down,       # DOWN Arrow is pressed
+            KEY_LEFT_PIN: self.move_to_days,    # LEFT Arrow is pressed
+            KEY_RIGHT_PIN: self.move_to_exit,   # RIGHT Arrow is pressed
+            KEY_PRESS_PIN: self.press_select,   # CENTER BTN is pressed
+            KEY1_PIN: self.press_sync_all,      # KEY1 is pressed
+        }
 
         # print the initial selector screen
         self.disp_refresh_day_selector()
 
         try:
             while True:
-                # UP Arrow is pressed
-                Display.test_key_press(KEY_UP_PIN, callback_fn=display.move_up)
+                # Wakes up on a key press, or periodically to show newly scanned days
+                event = self._inputs.get(timeout=0.5)
 
-                # DOWN Arrow is pressed
-                Display.test_key_press(KEY_DOWN_PIN, callback_fn=display.move_down)
+                if event is not None and event.key in key_handlers:
+                    key_handlers[event.key]()
 
-                # LEFT Arrow is pressed
-                Display.test_key_press(KEY_LEFT_PIN, callback_fn=display.move_to_days)
+                    if event.key in (KEY_PRESS_PIN, KEY1_PIN):
+                        # Don't replay the keys pressed while copying
+                        self._inputs.clear()
 
-                # RIGHT Arrow is pressed
-                Display.test_key_press(KEY_RIGHT_PIN, callback_fn=display.move_to_exit)
-                
-                # CENTER BTN is pressed
-                Display.test_key_press(KEY_PRESS_PIN, callback_fn=display.press_select)
+                self._apply_power_policy()
+
+                if self._usb_devices_changed():
+                    self.switch_usb_devices()
+                    continue
+
+                # New days were found by the background scan, or the battery level changed
+                if self._selector_state() != self._drawn_selector_state:
+                    self.disp_refresh_day_selector()
 
-                time.sleep(0.1)
         except Exception as e:
-            GPIO.cleanup()
+            self._cleanup()
             raise
 
         except KeyboardInterrupt:
-            GPIO.cleanup()
-
-    @staticmethod
-    def test_key_press(key, callback_fn):
-        if GPIO.input(key) == 0:  # CENTER is pressed
-            callback_fn()
-            # wait for release
-            while GPIO.input(key) == 0:
-                time.sleep(0.1)
+            self._cleanup()
 
     @staticmethod
     def _draw_progress_bar(draw, pos_x, pos_y, bar_width, height, progress, fg=(211,211,211)):
@@ -337,102 +544,255 @@ class Display(object):
 
         draw.rectangle((pos_x, pos_y, pos_x + current_width, pos_y + height), fill=fg)
 
+    def _render_copy_screen(self, state):
+        """ Runs on the display thread: only the parts that changed are redrawn """
+        if self._copy_screen is None or self._copy_screen[0] != state.session:
+            draw, image = self._setup_draw_disp_base("copy", Display._draw_copy_layer)
+
+            # Base Layout: separators are pre-rendered
+            self._text(draw, (21, 15), f"~ {state.date} ~")
+
+            self._copy_screen = (state.session, draw, image, None)
+
+        _, draw, image, drawn = self._copy_screen
+
+        if (drawn.battery if drawn is not None else None) != state.battery:
+            draw.rectangle((Display.width - 28, 0, Display.width, 12), fill="BLACK")
+            if state.battery is not None:
+                self._text(draw, (Display.width - 28, 2), state.battery)
+
+        if drawn is None or (drawn.status, drawn.size) != (state.status, state.size):
+            draw.rectangle((0, 50, Display.width, 80), fill="BLACK")
+            self._text(draw, (5, 53), state.status)
+            self._text(draw, (5, 68), f"Size: {round(state.size / (1<<17)) / 8:.1f} MB")
+
+        if drawn is not None and drawn.message != state.message:
+            draw.rectangle((0, 90, Display.width, Display.height), fill="BLACK")
+
+        if state.message is not None:
+            if drawn is None or drawn.message != state.message:
+                self._text(draw, (15, 105), state.message)
+
+        elif drawn is None or (drawn.message, drawn.progress) != (state.message, state.progress):
+            bar_x_offset = 10
+            Display._draw_progress_bar(
+                draw=draw,
+                pos_x=bar_x_offset,
+                pos_y=105,
+                bar_width=Display.width - (bar_x_offset * 2), 
+                height=10,
+                progress=state.progress  #  Between 0..1
+            )
+
+        self._copy_screen = (state.session, draw, image, state)
+
+        # Only the damaged regions are sent, i.e. the progress bar most of the time
+        return image, draw.pop_damage()
+
+    def _copy_screen_poster(self, title):
+        session = next(self._copy_sessions)
+        def post_state(status, size, progress=0.0, message=None):
+            # Copies never wait for the display: the latest state is drawn at the next frame
+            self._renderer.post_state(
+                self._render_copy_screen, 
+                CopyScreenState(session, title, status, size, progress, message, self._battery_text())
+            )
+
+        return post_state
+
+    def _plan_sync(self, videos, post_state):
+        def on_progress(idx, total, source_f):
+            # Writing Hash Verification Msg
+            post_state(
+                f"CHECK: {idx + 1:04d}/{total:04d} ...", source_f.size, 
+                message="Checking Hash ..."
+            )
+
+        planner = SyncPlanner(self.sources, self.targets, verify_mode=self._verify_mode)
+        return planner.plan(videos, on_progress=on_progress)
+
     def disp_copy_screen_loop(self, date):
 
         videos = self.videos.get_videos(day=date)
+        post_state = self._copy_screen_poster(title=date)
 
-        target_dir = get_or_create_target_dir(
-            date=date, 
-            source_d=self.source_d, 
-            target_d=self.target_d
-        )
+        plan = self._plan_sync(videos, post_state)
+        if not plan.fits:
+            # Shows the space needed, only to go back
+            self.disp_sync_confirmation(plan, title=f"SYNC {date}")
+            return
 
-        for idx, source_f in enumerate(videos):
+        self._disp_run_plan(plan, post_state, order=ORDER_BY_DIRECTORY)
 
-            target_f = VideoFile(target_dir / source_f.name)
+    def disp_sync_all_loop(self):
 
-            filesize_in_MB = round(source_f.size / (1<<17)) / 8  # bytes to MB
+        # Waits for the background scan: every day of the card is synced
+        videos = [
+            video_f for day in sorted(self.videos.videos, reverse=True) 
+            for video_f in self.videos.get_videos(day)
+        ]
+        post_state = self._copy_screen_poster(title="ALL DAYS")
 
-            draw, image = self._setup_draw_disp_base()
-                
-            # Base Layout
-            draw.text((21, 15), f"~ {date} ~", fill="WHITE")
-            draw.text((0, 35), "-" * __line_len__, fill="WHITE")
+        plan = self._plan_sync(videos, post_state)
+        if self.disp_sync_confirmation(plan):
+            self._disp_run_plan(plan, post_state, order=ORDER_LARGEST_FIRST)
 
-            # General Progress Data
-            draw.text((5, 53), f"COPY: {idx + 1:04d}/{len(videos):04d} ...", fill="WHITE")
+    def disp_sync_confirmation(self, plan, title="SYNC ALL DAYS"):
+        """ Shows the plan, returns True if the user confirmed it, False if
+        they went back or the USB devices changed meanwhile.
+        """
+        def to_GB(size):
+            return f"{size / (1<<30):.1f} GB"
 
-            draw.text((5, 68), f"Size: {filesize_in_MB:.1f} MB", fill="WHITE")
-            draw.text((0, 85), "-" * __line_len__, fill="WHITE")
-            
-            self._disp.LCD_ShowImage(image,0,0)
-
-            # Verifying the file doesn't already exist in the target device
-            if target_f.is_file():
-                
-                print(f"[LOG] Checking Hash for `{source_f}` ... ", end="", flush=True)
-
-                # Writing Hash Verification Msg
-                draw.text((15, 105), "Checking Hash ...", fill="WHITE")
-                self._disp.LCD_ShowImage(image,0,0)
-                
-                # Pre-emptively mask message with a black bar displayed at next `LCD_ShowImage`
-                draw.rectangle((0, 90, Display.width, Display.height), fill="BLACK")
-                if target_f.size == source_f.size and target_f.md5sum and source_f.md5sum:
-                    print("[LOG] Identical files => Skipped.")
-                    continue
-                else:  # Files are different - Delete and Overwrite
-                    print("[LOG] Different files => Overwriting.")
-                    target_f.unlink()
-                    
-            print(f"[LOG] Copying: {source_f.name} => {target_f} - Size: {filesize_in_MB} MB ... ", end="", flush=True)
+        with self.get_draw_ctx() as draw:
+            self._text(draw, (5, 5), title)
+            self._text(draw, (5, 22), f"New: {len(plan.new)} - Changed: {len(plan.changed)}")
+            self._text(draw, (5, 36), f"Identical: {len(plan.identical)}")
+            self._text(draw, (5, 50), f"Copy: {to_GB(plan.bytes_to_copy)}")
+            self._text(draw, (5, 64), f"Free: {to_GB(plan.bytes_free)}")
+            self._text(draw, (5, 78), f"ETA: {format_duration(plan.eta_secs)}")
+
+            if not plan.fits:
+                self._text(draw, (5, 98), "NOT ENOUGH SPACE !")
+                self._text(draw, (5, 112), "ANY KEY: BACK")
+            elif not plan.to_copy:
+                self._text(draw, (5, 98), "NOTHING TO COPY")
+                self._text(draw, (5, 112), "ANY KEY: BACK")
+            else:
+                self._text(draw, (5, 98), "KEY1 / CENTER: START")
+                self._text(draw, (5, 112), "OTHER KEY: BACK")
 
-            # Progress bar Update Fn
-            bar_x_offset = 10
-            def bar_callback_fn(copied, total_copied, total):
-                Display._draw_progress_bar(
-                    draw=draw,
-                    pos_x=bar_x_offset,
-                    pos_y=105,
-                    bar_width=Display.width - (bar_x_offset * 2), 
-                    height=10,
-                    progress=total_copied /total  #  Between 0..1
-                )
-                self._disp.LCD_ShowImage(image,0,0)
-                
-            # Display an empty bar
-            bar_callback_fn(copied=0, total_copied=0, total=filesize_in_MB)
-            
-            start_t = time.perf_counter()
-            copy_with_callback(
-                source_f,
-                target_f,
-                follow_symlinks=True,
-                callback=bar_callback_fn,
-                buffer_size=DEFAULT_BUFFER_SIZE,
+        self._inputs.clear()
+        while (event := self._inputs.get(timeout=0.5)) is None:
+            # The plan is stale once a device was swapped: back to the device wait screen
+            if self._usb_devices_changed():
+                self.switch_usb_devices()
+                return False
+
+        return plan.fits and bool(plan.to_copy) and event.key in (KEY1_PIN, KEY_PRESS_PIN)
+
+    def _disp_run_plan(self, plan, post_state, order):
+
+        plan.prepare()
+        jobs = plan.jobs(order=order)
+
+        total_size = sum(job.source_f.size for job in jobs)
+        start_times = dict()
+
+        paused = [False]
+        def on_copy_event(event):
+            self._apply_power_policy()
+
+            if event.kind in (EVENT_PAUSED, EVENT_RESUMED):
+                paused[0] = event.kind == EVENT_PAUSED
+                print("[WARNING] Battery level critical, copy paused." if paused[0] else "[INFO] Copy resumed.")
+
+            elif event.kind == EVENT_STARTED:
+                source_f = event.job.source_f
+                start_times[event.job] = time.perf_counter()
+                print(f"[LOG] Copying: {source_f.name} => {event.job.target_f} - Size: {round(source_f.size / (1<<17)) / 8} MB ...", flush=True)
+
+            elif event.kind == EVENT_DONE:
+                source_f = event.job.source_f
+                elapsed_t = time.perf_counter() - start_times[event.job]
+                print(f"[LOG] {source_f.name}: DONE (avg {source_f.size / (1<<20) / elapsed_t:.1f} MB/sec)")
+
+            elif event.kind == EVENT_FAILED:
+                print(f"[LOG] {event.job.source_f.name}: ERROR: {event.error}")
+
+            post_state(
+                f"COPY: {event.files_done:04d}/{event.files_total:04d} ...", total_size,
+                progress=event.agg_copied / event.agg_total if event.agg_total else 1,
+                message="PAUSED: LOW BATTERY" if paused[0] else None
             )
-            print(f"DONE (avg {filesize_in_MB / (time.perf_counter() - start_t):.1f} MB/sec)")
+
+        # Display an empty bar
+        post_state(f"COPY: {0:04d}/{len(jobs):04d} ...", total_size, progress=0.0 if total_size else 1)
+
+        dedup = TargetDedup(
+            mode=self._dedup_mode, verify_mode=self._verify_mode
+        ) if self._dedup_mode != DEDUP_OFF else None
+
+        start_t = time.perf_counter()
+        results = CopyScheduler(
+            governor=self._power_governor, 
+            dedup=dedup, 
+            write_policy=self._write_policy,
+            mirror=len(plan.targets) > 1,  # Each clip read once for all the targets
+            topology=self._io_topology,
+            on_event=on_copy_event
+        ).run(jobs)
+
+        # Next ETAs are based on the bytes actually copied
+        plan.throughput.record(
+            sum(r.job.source_f.size for r in results if r.error is None and r.dedup is None),
+            time.perf_counter() - start_t
+        )
 
     def disp_wait_for_USB_devices_ready_loop(self):
 
+        def devices_text(devices):
+            if len(devices) > 1:
+                return f"{len(devices)} devices"
+            return devices[0].device_id if devices else None
+
         while True:
-            source_d, target_d = get_usb_devices()
+            sources, targets = self._devices.sources, self._devices.targets
 
-            if source_d is not None and target_d is not None:
+            if sources and targets:
                 break
 
             with self.get_draw_ctx() as draw:
-                draw.text((10, 25), "Waiting for USB:", fill="WHITE")
-                draw.text((10, 55), f"* Source: {source_d if source_d is None else source_d.device_id}", fill="WHITE")
-                draw.text((10, 85), f"* Target: {target_d if target_d is None else target_d.device_id}", fill="WHITE")
+                self._text(draw, (10, 25), "Waiting for USB:")
+                self._text(draw, (10, 55), f"* Source: {devices_text(sources)}")
+                self._text(draw, (10, 85), f"* Target: {devices_text(targets)}")
 
-            time.sleep(1)
+            # Wakes up as soon as a device is mounted or removed
+            self._devices.get()
 
-        self.source_d = source_d
-        self.target_d = target_d
+        print(f"[INFO] Sources: {', '.join(map(str, sources))} - Targets: {', '.join(map(str, targets))}")
+        self.sources = sources
+        self.targets = targets
 
 if __name__ == "__main__":
 
-    display = Display()
+    # --dedup=off|skip|hardlink|reflink
+    dedup_mode = next(
+        (arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--dedup=")), 
+        DEDUP_HARDLINK
+    )
+    if dedup_mode not in DEDUP_MODES:
+        sys.exit(f"[ERROR] Unknown dedup mode `{dedup_mode}`, expected one of: {', '.join(DEDUP_MODES)}")
+
+    # --durability=file|directory|none
+    durability = next(
+        (arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--durability=")), 
+        DURABILITY_FILE
+    )
+    if durability not in DURABILITY_MODES:
+        sys.exit(f"[ERROR] Unknown durability mode `{durability}`, expected one of: {', '.join(DURABILITY_MODES)}")
+
+    # --ssd-writers=N: concurrent copies to each SSD target
+    ssd_workers = next(
+        (arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--ssd-writers=")), 
+        str(DEFAULT_SSD_WORKERS)
+    )
+    if not ssd_workers.isdigit() or int(ssd_workers) < 1:
+        sys.exit(f"[ERROR] Invalid number of SSD writers `{ssd_workers}`, expected a positive integer")
+    ssd_workers = int(ssd_workers)
+
+    try:
+        power_sampler = PowerSampler(INA219(addr=UPS_HAT_ADDR)).start()
+    except Exception as e:  # No smbus module or no UPS HAT
+        print(f"[WARNING] Battery level not available: {e}")
+        power_sampler = None
+
+    display = Display(
+        verify_mode=VERIFY_FULL if "--strict" in sys.argv else VERIFY_FINGERPRINT,
+        power_sampler=power_sampler,
+        dedup_mode=dedup_mode,
+        write_policy=WritePolicy(durability=durability),
+        io_topology=IOTopology(ssd_workers=ssd_workers)
+    )
 
     display.exec_loop()
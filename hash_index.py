@@ -0,0 +1,259 @@
+""" Persistent index of file digests, stored at the root of each USB device """
+
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+METADATA_DIRNAME = ".gopro_copier"
+INDEX_FILENAME = "hash_index.sqlite"
+
+# Filesystems generating inode numbers at mount time, they can't be part of
+# the key or every remount would invalidate the whole index.
+_UNSTABLE_INODE_FS = {"vfat", "msdos", "exfat", "fuseblk", "ntfs", "ntfs3"}
+
+# Each commit is a journaled transaction with several fsyncs on the card:
+# digests are committed by batches.
+COMMIT_BATCH_SIZE = 256
+COMMIT_INTERVAL = 5.0  # secs
+
+
+def find_mountpoint(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def unescape_mount_field(field):
+    """ Decodes a field of `/proc/mounts`: spaces, tabs, newlines and
+    backslashes are octal escaped, e.g. `\\040`.
+    """
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), field)
+
+
+def _mount_fields(mountpoint):
+    """ Returns the fields of the `/proc/mounts` line of `mountpoint`, the
+    last one if mounted over, or None.
+    """
+    mount = None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and unescape_mount_field(fields[1]) == mountpoint:
+                    mount = fields
+    except OSError:
+        pass
+    return mount
+
+
+def mount_source(mountpoint):
+    """ Returns what is mounted at `mountpoint`, e.g. `/dev/sda1`, or None """
+    fields = _mount_fields(mountpoint)
+    return unescape_mount_field(fields[0]) if fields is not None else None
+
+
+def _filesystem_type(mountpoint):
+    fields = _mount_fields(mountpoint)
+    return fields[2] if fields is not None else None
+
+
+class HashIndex(object):
+    """ Digests of files keyed by (relative path, size, mtime, inode).
+
+    An entry is only returned if the file didn't change since it was hashed.
+    Entries are kept in memory and persisted to a SQLite database when the
+    device is writable, otherwise the index only lasts for the process. They
+    are committed every `COMMIT_BATCH_SIZE` entries or `COMMIT_INTERVAL`
+    secs, and by `flush`.
+    """
+
+    _instances = dict()
+    _instances_lock = threading.Lock()
+
+    def __init__(self, root):
+        self.root = str(root)
+        self._lock = threading.Lock()
+        self._memory = dict()  # (relpath, algo) => (size, mtime_ns, inode, digest)
+        self._db = None
+        self._pending = 0  # Stored but not committed yet
+        self._last_commit = time.monotonic()
+        self._use_inode = _filesystem_type(self.root) not in _UNSTABLE_INODE_FS
+
+        if self.root == "/":
+            return  # Not on a USB device => memory only.
+
+        try:
+            os.makedirs(os.path.join(self.root, METADATA_DIRNAME), exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(self.root, METADATA_DIRNAME, INDEX_FILENAME),
+                check_same_thread=False
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "relpath TEXT, algo TEXT, size INTEGER, mtime_ns INTEGER, "
+                "inode INTEGER, digest TEXT, PRIMARY KEY (relpath, algo))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS digests_by_value ON digests (algo, digest)"
+            )
+            self._db.commit()
+        except (OSError, sqlite3.Error) as e:
+            print(f"[WARNING] Hash index of `{self.root}` is not persisted: {e}")
+            self._db = None
+
+    @classmethod
+    def for_root(cls, root):
+        root = str(root)
+        with cls._instances_lock:
+            if root not in cls._instances:
+                cls._instances[root] = cls(root)
+            return cls._instances[root]
+
+    @classmethod
+    def for_path(cls, path):
+        return cls.for_root(find_mountpoint(path))
+
+    @classmethod
+    def flush_all(cls):
+        """ Commits the pending entries of every opened index """
+        with cls._instances_lock:
+            indexes = list(cls._instances.values())
+        for index in indexes:
+            index.flush()
+
+    @classmethod
+    def close_root(cls, root):
+        """ Closes the index of `root` if opened, e.g. before unmounting it """
+        with cls._instances_lock:
+            index = cls._instances.get(str(root))
+        if index is not None:
+            index.close()
+
+    def _key(self, path, st):
+        relpath = os.path.relpath(os.path.realpath(path), self.root)
+        inode = st.st_ino if self._use_inode else 0
+        return relpath, (st.st_size, st.st_mtime_ns, inode)
+
+    def lookup(self, path, algo, st=None):
+        """ Returns the digest of `path` or None if unknown or outdated """
+        st = st or os.stat(path)
+        relpath, stat_key = self._key(path, st)
+
+        with self._lock:
+            entry = self._memory.get((relpath, algo))
+            if entry is not None:
+                return entry[3] if entry[:3] == stat_key else None
+
+            if self._db is None:
+                return None
+
+            try:
+                row = self._db.execute(
+                    "SELECT size, mtime_ns, inode, digest FROM digests "
+                    "WHERE relpath = ? AND algo = ?", (relpath, algo)
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+
+            if row is None:
+                return None
+
+            self._memory[(relpath, algo)] = tuple(row)
+            return row[3] if tuple(row[:3]) == stat_key else None
+
+    def store(self, path, algo, digest, st=None):
+        st = st or os.stat(path)
+        relpath, stat_key = self._key(path, st)
+
+        with self._lock:
+            self._memory[(relpath, algo)] = (*stat_key, digest)
+
+            if self._db is None:
+                return
+
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                    (relpath, algo, *stat_key, digest)
+                )
+            except sqlite3.Error as e:
+                print(f"[WARNING] Impossible to persist the digest of `{path}`: {e}")
+                return
+
+            self._pending += 1
+            if (
+                self._pending >= COMMIT_BATCH_SIZE
+                or time.monotonic() - self._last_commit >= COMMIT_INTERVAL
+            ):
+                self._commit()
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        if self._db is None or not self._pending:
+            return
+
+        try:
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"[WARNING] Impossible to persist the hash index of `{self.root}`: {e}")
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def find(self, algo, digest):
+        """ Returns the paths whose `algo` digest is `digest`, skipping the
+        files deleted or modified since they were hashed.
+        """
+        with self._lock:
+            entries = {
+                relpath: entry for (relpath, entry_algo), entry in self._memory.items()
+                if entry_algo == algo and entry[3] == digest
+            }
+
+            if self._db is not None:
+                try:
+                    rows = self._db.execute(
+                        "SELECT relpath, size, mtime_ns, inode, digest FROM digests "
+                        "WHERE algo = ? AND digest = ?", (algo, digest)
+                    ).fetchall()
+                except sqlite3.Error:
+                    rows = list()
+
+                for relpath, *entry in rows:
+                    # The memory holds the most recent entry
+                    if (relpath, algo) not in self._memory:
+                        entries[relpath] = tuple(entry)
+
+        paths = list()
+        for relpath, entry in entries.items():
+            path = os.path.join(self.root, relpath)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            if self._key(path, st)[1] == entry[:3]:
+                paths.append(path)
+
+        return paths
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._commit()
+                self._db.close()
+                self._db = None
+
+        with HashIndex._instances_lock:
+            if HashIndex._instances.get(self.root) is self:
+                del HashIndex._instances[self.root]
+
+
+atexit.register(HashIndex.flush_all)
@@ -0,0 +1,192 @@
+""" Debounced button events from GPIO edge callbacks, with key repeat on hold """
+
+import queue
+import threading
+import time
+
+from collections import defaultdict
+from collections import namedtuple
+
+
+# Waveshare 1.44inch LCD HAT buttons (BCM numbering)
+KEY_UP_PIN     = 6
+KEY_DOWN_PIN   = 19
+KEY_LEFT_PIN   = 5
+KEY_RIGHT_PIN  = 26
+KEY_PRESS_PIN  = 13
+KEY1_PIN       = 21
+KEY2_PIN       = 20
+KEY3_PIN       = 16
+
+KEY_PINS = (
+    KEY_UP_PIN, KEY_DOWN_PIN, KEY_LEFT_PIN, KEY_RIGHT_PIN, KEY_PRESS_PIN,
+    KEY1_PIN, KEY2_PIN, KEY3_PIN
+)
+
+DEBOUNCE_TIME = 0.03    # Level must be stable for 30ms
+REPEAT_DELAY = 0.5      # Hold time before the first repeat
+REPEAT_INTERVAL = 0.1   # Then 10 repeats per second
+
+EVENT_PRESS = "press"
+EVENT_REPEAT = "repeat"
+
+KeyEvent = namedtuple("KeyEvent", ["key", "kind", "timestamp"])
+
+
+class InputEvents(object):
+    """ Queue of `KeyEvent`, fed by `GPIO.add_event_detect` callbacks.
+
+    An edge only schedules a read of the pin once its level had time to
+    settle: contact bounces never make it to the queue. No thread polls the
+    pins, the input thread sleeps until the next settle or repeat deadline.
+    Buttons are active low (pull-up).
+    """
+
+    def __init__(
+        self,
+        gpio,
+        pins=KEY_PINS,
+        repeat_pins=(KEY_UP_PIN, KEY_DOWN_PIN),
+        debounce_time=DEBOUNCE_TIME,
+        repeat_delay=REPEAT_DELAY,
+        repeat_interval=REPEAT_INTERVAL
+    ):
+        self._gpio = gpio
+        self._pins = tuple(pins)
+        self._repeat_pins = frozenset(repeat_pins)
+        self.debounce_time = debounce_time
+        self.repeat_delay = repeat_delay
+        self.repeat_interval = repeat_interval
+
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._pressed = defaultdict(bool)
+        self._settle_deadlines = dict()  # {pin: time to read its level}
+        self._repeat_deadlines = dict()  # {pin: time of the next repeat}
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="input-events", daemon=True)
+
+    def start(self):
+        self._gpio.setmode(self._gpio.BCM)
+        for pin in self._pins:
+            self._gpio.setup(pin, self._gpio.IN, pull_up_down=self._gpio.PUD_UP)  # Input with pull-up
+            self._pressed[pin] = self._gpio.input(pin) == 0
+            self._gpio.add_event_detect(pin, self._gpio.BOTH, callback=self._on_edge)
+
+        self._thread.start()
+        return self
+
+    def stop(self):
+        for pin in self._pins:
+            self._gpio.remove_event_detect(pin)
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def get(self, timeout=None):
+        """ Returns the next `KeyEvent`, None if none came within `timeout` secs """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        """ Drops the pending events, e.g. presses received during a long action """
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _on_edge(self, pin):
+        # Called from the GPIO library thread: must return quickly
+        with self._cond:
+            self._settle_deadlines[pin] = time.monotonic() + self.debounce_time
+            self._cond.notify()
+
+    def _sample(self, pin, now):
+        pressed = self._gpio.input(pin) == 0
+        if pressed == self._pressed[pin]:
+            return  # Bounced back to its previous level
+
+        self._pressed[pin] = pressed
+        if pressed:
+            self._queue.put(KeyEvent(key=pin, kind=EVENT_PRESS, timestamp=now))
+            if pin in self._repeat_pins:
+                self._repeat_deadlines[pin] = now + self.repeat_delay
+        else:
+            self._repeat_deadlines.pop(pin, None)
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                now = time.monotonic()
+
+                for pin, deadline in list(self._settle_deadlines.items()):
+                    if deadline <= now:
+                        del self._settle_deadlines[pin]
+                        self._sample(pin, now)
+
+                for pin, deadline in list(self._repeat_deadlines.items()):
+                    if deadline <= now:
+                        self._repeat_deadlines[pin] = now + self.repeat_interval
+                        self._queue.put(KeyEvent(key=pin, kind=EVENT_REPEAT, timestamp=now))
+
+                deadlines = [*self._settle_deadlines.values(), *self._repeat_deadlines.values()]
+                self._cond.wait(timeout=max(0, min(deadlines) - now) if deadlines else None)
+
+
+class SimulatedGPIO(object):
+    """ Subset of the `RPi.GPIO` API used by `InputEvents`, driven by `press`/`release` """
+
+    BCM = "BCM"
+    IN = "IN"
+    PUD_UP = "PUD_UP"
+    BOTH = "BOTH"
+
+    def __init__(self):
+        self._levels = dict()
+        self._callbacks = dict()
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None):
+        self._levels[pin] = 1  # Released: pulled up
+
+    def input(self, pin):
+        return self._levels[pin]
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self._levels.clear()
+        self._callbacks.clear()
+
+    def _set_level(self, pin, level):
+        if self._levels[pin] == level:
+            return
+
+        self._levels[pin] = level
+        if (callback := self._callbacks.get(pin)) is not None:
+            callback(pin)
+
+    def press(self, pin, bounces=0):
+        """ Pulls `pin` low, after `bounces` spurious low/high transitions """
+        for _ in range(bounces):
+            self._set_level(pin, 0)
+            self._set_level(pin, 1)
+        self._set_level(pin, 0)
+
+    def release(self, pin, bounces=0):
+        for _ in range(bounces):
+            self._set_level(pin, 1)
+            self._set_level(pin, 0)
+        self._set_level(pin, 1)
@@ -0,0 +1,174 @@
+""" Physical devices behind the mounted filesystems, from the udev ancestry """
+
+import pyudev
+
+import os
+import re
+import threading
+
+from collections import namedtuple
+
+from hash_index import find_mountpoint
+from hash_index import mount_source
+
+
+MEDIA_SD_CARD = "sd_card"  # e.g. the card of a USB SD reader
+MEDIA_SSD = "ssd"
+MEDIA_HDD = "hdd"
+MEDIA_UNKNOWN = "unknown"  # Not a block device known by udev, e.g. tmpfs
+
+DEFAULT_SD_CARD_WORKERS = 1  # Parallel reads from a card seek back and forth
+DEFAULT_SSD_WORKERS = 2
+DEFAULT_HDD_WORKERS = 1
+DEFAULT_PORT_WORKERS = 2  # Copies sharing a USB bridge, e.g. a multi-slot reader
+
+# Set by the udev rules for the slots of card readers
+_SD_CARD_PROPERTIES = ("ID_DRIVE_FLASH_SD", "ID_DRIVE_MEDIA_FLASH_SD", "ID_DRIVE_FLASH_MS")
+
+# Words of the `ID_MODEL` of readers without such rules, e.g. `SD_MMC_Reader`
+_SD_READER_MODEL_WORDS = {"SD", "SDHC", "SDXC", "MICROSD", "MMC", "CARD", "READER", "CRW"}
+
+# `disk`: sysfs path of the whole disk, the mountpoint if unknown.
+# `port`: USB port of the bridge the disk sits behind (e.g. `1-1.2`), or None.
+IODevice = namedtuple("IODevice", ["disk", "port", "media"])
+
+
+def _attribute(device, name):
+    try:
+        return device.attributes.asstring(name)
+    except (KeyError, UnicodeDecodeError):
+        return None
+
+
+def _media_of(disk):
+    # Not from the `removable` attribute: every device managed has it set
+    properties = disk.properties
+    if any(properties.get(name) == "1" for name in _SD_CARD_PROPERTIES):
+        return MEDIA_SD_CARD
+
+    if properties.get("ID_BUS") == "mmc" or disk.find_parent("mmc") is not None:
+        return MEDIA_SD_CARD  # Slot wired to the SoC
+
+    model_words = set(re.split(r"[^A-Z0-9]+", properties.get("ID_MODEL", "").upper()))
+    if model_words & _SD_READER_MODEL_WORDS:
+        return MEDIA_SD_CARD
+
+    # USB-SATA bridges may report SSDs as rotational: these get the HDD limit
+    rotational = _attribute(disk, "queue/rotational")
+    if rotational == "0":
+        return MEDIA_SSD
+    if rotational == "1":
+        return MEDIA_HDD
+    return MEDIA_UNKNOWN
+
+
+class IOTopology(object):
+    """ Groups the mounted filesystems by physical disk and USB port.
+
+    Each disk gets its own concurrency limit, depending on its media: one
+    sequential reader per SD card, `ssd_workers` per SSD. The disks behind a
+    same USB bridge share `port_workers` more. Paths whose disk is unknown
+    get the limit given by the caller.
+    """
+
+    def __init__(
+        self,
+        sd_card_workers=DEFAULT_SD_CARD_WORKERS,
+        ssd_workers=DEFAULT_SSD_WORKERS,
+        hdd_workers=DEFAULT_HDD_WORKERS,
+        port_workers=DEFAULT_PORT_WORKERS
+    ):
+        if min(sd_card_workers, ssd_workers, hdd_workers, port_workers) < 1:
+            raise ValueError("The number of workers per device must be >= 1")
+
+        self.limits = {
+            MEDIA_SD_CARD: sd_card_workers,
+            MEDIA_SSD: ssd_workers,
+            MEDIA_HDD: hdd_workers,
+        }
+        self.port_workers = port_workers
+
+        self._context = None
+        self._lock = threading.Lock()
+        self._devices = dict()  # {mountpoint: IODevice}
+
+    def device_of(self, path):
+        """ Returns the `IODevice` storing `path` """
+        mountpoint = find_mountpoint(path)
+        with self._lock:
+            if mountpoint not in self._devices:
+                try:
+                    self._devices[mountpoint] = self._lookup(mountpoint)
+                except Exception as e:
+                    print(f"[WARNING] Unknown device for `{mountpoint}`: {e}")
+                    self._devices[mountpoint] = IODevice(mountpoint, None, MEDIA_UNKNOWN)
+            return self._devices[mountpoint]
+
+    def limit(self, device, default):
+        """ Returns the concurrent copies allowed on `device` """
+        return self.limits.get(device.media, default)
+
+    def slots(self, path, default):
+        """ Returns the [(slot key, limit)] a copy from / to `path` holds,
+        `default` is the limit of an unknown disk.
+        """
+        device = self.device_of(path)
+        slots = [(("disk", device.disk), self.limit(device, default))]
+        if device.port is not None:
+            slots.append((("port", device.port), self.port_workers))
+        return slots
+
+    def forget(self):
+        """ Drops the cached devices, e.g. once a card was swapped """
+        with self._lock:
+            self._devices.clear()
+
+    def _lookup(self, mountpoint):
+        if self._context is None:
+            self._context = pyudev.Context()
+
+        block = self._block_device(mountpoint)
+        disk = block if block.device_type == "disk" else block.find_parent("block", "disk")
+        if disk is None:
+            return IODevice(mountpoint, None, MEDIA_UNKNOWN)
+
+        # The closest USB device is the reader / bridge, not the hub above it
+        usb = disk.find_parent("usb", "usb_device")
+        return IODevice(disk.sys_path, usb.sys_name if usb is not None else None, _media_of(disk))
+
+    def _block_device(self, mountpoint):
+        # The `st_dev` of fuseblk mounts (exFAT, NTFS) is an anonymous FUSE
+        # device: the block device is only known from the mount source
+        source = mount_source(mountpoint)
+        if source is not None and source.startswith("/dev/"):
+            try:
+                return pyudev.Devices.from_device_file(self._context, source)
+            except (LookupError, OSError, ValueError):
+                pass
+
+        return pyudev.Devices.from_device_number(self._context, "block", os.stat(mountpoint).st_dev)
+
+
+class FakeIOTopology(IOTopology):
+    """ `IOTopology` with the devices given as {root directory: IODevice},
+    e.g. folders of a same filesystem standing for several devices.
+    """
+
+    def __init__(self, devices, **kwargs):
+        super().__init__(**kwargs)
+        self._fake_devices = {
+            os.path.realpath(root): device for root, device in devices.items()
+        }
+
+    def device_of(self, path):
+        path = os.path.realpath(path)
+        roots = [
+            root for root in self._fake_devices 
+            if os.path.commonpath([path, root]) == root
+        ]
+        if not roots:
+            return super().device_of(path)
+        return self._fake_devices[max(roots, key=len)]
+
+    def _lookup(self, mountpoint):
+        return IODevice(mountpoint, None, MEDIA_UNKNOWN)
@@ -0,0 +1,147 @@
+""" Preallocated RGB565 framebuffer for the ST7735S LCD, with damage tracking """
+
+import numpy as np
+
+
+MAX_DAMAGE_RECTS = 4  # Above that, a single bounding box is cheaper to send
+
+
+def _merge_rects(rects):
+    """ Merges overlapping (x0, y0, x1, y1) rects, ends are exclusive """
+    merged = list()
+    for rect in sorted(rects):
+        for idx, other in enumerate(merged):
+            if rect[0] < other[2] and other[0] < rect[2] and rect[1] < other[3] and other[1] < rect[3]:
+                merged[idx] = (
+                    min(rect[0], other[0]), min(rect[1], other[1]),
+                    max(rect[2], other[2]), max(rect[3], other[3])
+                )
+                break
+        else:
+            merged.append(rect)
+
+    if len(merged) < len(rects):
+        return _merge_rects(merged)  # A merged rect may now overlap another one
+
+    if len(merged) > MAX_DAMAGE_RECTS:
+        return [(
+            min(r[0] for r in merged), min(r[1] for r in merged),
+            max(r[2] for r in merged), max(r[3] for r in merged)
+        )]
+
+    return merged
+
+
+class TrackedDraw(object):
+    """ `ImageDraw` proxy recording the rectangles changed by each call.
+
+    `rectangle`, `text` and `bitmap` record their bounding box, any other
+    drawing call damages the whole frame.
+    """
+
+    def __init__(self, draw, width, height):
+        self._draw = draw
+        self._width = width
+        self._height = height
+        self._damage = list()
+
+    def _add_damage(self, x0, y0, x1, y1):
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(self._width, int(x1)), min(self._height, int(y1))
+        if x0 < x1 and y0 < y1:
+            self._damage.append((x0, y0, x1, y1))
+
+    def rectangle(self, xy, *args, **kwargs):
+        self._draw.rectangle(xy, *args, **kwargs)
+        x0, y0, x1, y1 = np.ravel(xy)
+        self._add_damage(min(x0, x1), min(y0, y1), max(x0, x1) + 1, max(y0, y1) + 1)
+
+    def text(self, xy, text, *args, **kwargs):
+        self._draw.text(xy, text, *args, **kwargs)
+        bbox_kwargs = {
+            key: value for key, value in kwargs.items() 
+            if key in ("font", "anchor", "spacing", "align")
+        }
+        self._add_damage(*self._draw.textbbox(xy, text, **bbox_kwargs))
+
+    def bitmap(self, xy, bitmap, fill=None):
+        self._draw.bitmap(xy, bitmap, fill=fill)
+        x0, y0 = xy
+        self._add_damage(x0, y0, x0 + bitmap.width, y0 + bitmap.height)
+
+    def damage_all(self):
+        self._add_damage(0, 0, self._width, self._height)
+
+    def __getattr__(self, name):
+        attr = getattr(self._draw, name)
+        if not callable(attr):
+            return attr
+
+        def damage_all(*args, **kwargs):
+            self.damage_all()
+            return attr(*args, **kwargs)
+
+        return damage_all
+
+    def pop_damage(self):
+        """ Returns the damaged rects since the last call, [] if nothing changed """
+        damage, self._damage = _merge_rects(self._damage), list()
+        return damage
+
+
+class FrameBuffer(object):
+    """ Big-endian RGB565 copy of the last frame, ready to be sent over SPI.
+
+    Every buffer is allocated once: converting a frame doesn't allocate and
+    runs as a handful of vectorized numpy operations.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+        self.pixels = np.zeros((height, width), dtype=">u2")  # Wire format
+        self._rgb565 = np.empty((height, width), dtype=np.uint16)
+        self._channel = np.empty((height, width), dtype=np.uint16)
+
+    def update(self, image, rects=None):
+        """ Converts a RGB888 PIL image to RGB565, only within `rects` if provided """
+        rgb = np.asarray(image)
+        if rgb.shape != (self.height, self.width, 3):
+            raise ValueError(
+                f"Image must be a {self.width}x{self.height} RGB image, "
+                f"received shape: {rgb.shape}"
+            )
+
+        for rect in rects if rects is not None else [(0, 0, self.width, self.height)]:
+            self._convert(rgb, *rect)
+
+    def _convert(self, rgb, x0, y0, x1, y1):
+        rgb = rgb[y0:y1, x0:x1]
+        rgb565 = self._rgb565[y0:y1, x0:x1]
+        channel = self._channel[y0:y1, x0:x1]
+
+        # RRRRRGGG GGGBBBBB
+        np.copyto(rgb565, rgb[..., 0])
+        rgb565 &= 0xF8
+        rgb565 <<= 8
+
+        np.copyto(channel, rgb[..., 1])
+        channel &= 0xFC
+        channel <<= 3
+        rgb565 |= channel
+
+        np.copyto(channel, rgb[..., 2])
+        channel >>= 3
+        rgb565 |= channel
+
+        # Native to big-endian, in place
+        self.pixels[y0:y1, x0:x1] = rgb565
+
+    def as_bytes(self, rect=None):
+        """ Returns the frame as uint8, a view without copy for the full frame """
+        if rect is None:
+            return self.pixels.view(np.uint8).reshape(-1)
+
+        x0, y0, x1, y1 = rect
+        return np.ascontiguousarray(self.pixels[y0:y1, x0:x1]).view(np.uint8).reshape(-1)
@@ -0,0 +1,90 @@
+""" On-disk snapshot of the stats of the videos of a device """
+
+import json
+import os
+import threading
+
+from collections import namedtuple
+
+from hash_index import METADATA_DIRNAME
+
+
+SNAPSHOT_FILENAME = "listing_snapshot.json"
+SNAPSHOT_VERSION = 2
+
+# Subset of `os.stat_result` needed by `VideoFile` and `HashIndex`
+FileStat = namedtuple(
+    "FileStat", ["st_size", "st_mtime", "st_ctime", "st_ino", "st_mtime_ns"]
+)
+
+
+class ListingSnapshot(object):
+    """ {folder relative path: {filename: FileStat}}
+
+    Folders are still listed, but the files already in the snapshot don't
+    need to be stat'ed again. The folder mtime can't tell whether a file was
+    added: FAT stores it with a 2 secs granularity and the cameras don't
+    always update it.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.path = os.path.join(self.root, METADATA_DIRNAME, SNAPSHOT_FILENAME)
+        self._lock = threading.Lock()
+        self._folders = None
+        self._dirty = False
+
+    def _load(self):
+        if self._folders is not None:
+            return
+
+        self._folders = dict()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") != SNAPSHOT_VERSION:
+            return
+
+        for relpath, files in data["folders"].items():
+            self._folders[relpath] = {name: FileStat(*st) for name, st in files.items()}
+
+    def get(self, folder):
+        """ Returns {filename: FileStat} of `folder`, empty if unknown """
+        relpath = os.path.relpath(folder, self.root)
+        with self._lock:
+            self._load()
+            return dict(self._folders.get(relpath, {}))
+
+    def put(self, folder, files):
+        relpath = os.path.relpath(folder, self.root)
+        with self._lock:
+            self._load()
+            if self._folders.get(relpath) != files:
+                self._folders[relpath] = dict(files)
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            data = {
+                "version": SNAPSHOT_VERSION,
+                "folders": {
+                    relpath: {name: list(st) for name, st in files.items()}
+                    for relpath, files in self._folders.items()
+                }
+            }
+
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"[WARNING] Impossible to save the listing snapshot of `{self.root}`: {e}")
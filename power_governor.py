@@ -0,0 +1,85 @@
+""" Copy and display settings following the UPS HAT battery level """
+
+import threading
+
+from collections import namedtuple
+
+from copy_utils import DEFAULT_BUFFER_SIZE
+
+
+LOW_BATTERY_PERCENT = 30
+CRITICAL_BATTERY_PERCENT = 10
+RESUME_BATTERY_PERCENT = 15  # Hysteresis: a paused copy resumes above this level
+
+HIGH_POWER_W = 5.0  # Above that, starting another copy may sag the voltage below brownout
+
+LOW_POWER_BUFFER_SIZE = 4 * DEFAULT_BUFFER_SIZE  # Fewer syscalls and wake-ups per MB
+LOW_POWER_MAX_FPS = 1
+
+# `max_workers` / `buffer_size` / `max_fps`: None keeps the settings unchanged.
+# `paused`: no new file is started, running files are completed.
+PowerPolicy = namedtuple("PowerPolicy", ["max_workers", "buffer_size", "max_fps", "paused"])
+
+FULL_POWER_POLICY = PowerPolicy(max_workers=None, buffer_size=None, max_fps=None, paused=False)
+
+
+class PowerGovernor(object):
+    """ Turns `power_monitor.PowerSampler` readings into a `PowerPolicy`.
+
+    - external power (charging) or no reading: full speed.
+    - below `low_percent`: a single copy at a time with larger buffers, the
+      LCD refreshes once per sec. Under a load above `high_power_W`, the
+      thresholds are reached `critical_percent` earlier.
+    - below `critical_percent`: paused at the next file boundary until the
+      level gets back above `resume_percent` or the HAT is plugged in, so that
+      the Pi never browns out in the middle of a file.
+    """
+
+    def __init__(
+        self,
+        power_sampler,
+        low_percent=LOW_BATTERY_PERCENT,
+        critical_percent=CRITICAL_BATTERY_PERCENT,
+        resume_percent=RESUME_BATTERY_PERCENT,
+        high_power_W=HIGH_POWER_W
+    ):
+        if not critical_percent <= resume_percent <= low_percent:
+            raise ValueError("Expected `critical_percent` <= `resume_percent` <= `low_percent`")
+
+        self.power_sampler = power_sampler
+        self.low_percent = low_percent
+        self.critical_percent = critical_percent
+        self.resume_percent = resume_percent
+        self.high_power_W = high_power_W
+
+        self._lock = threading.Lock()
+        self._paused = False
+
+    def policy(self):
+        battery_percent = self.power_sampler.battery_percent
+        current_mA = self.power_sampler.current_mA
+        power_W = self.power_sampler.power_W
+
+        with self._lock:
+            if battery_percent is None or current_mA > 0:  # Charging
+                self._paused = False
+                return FULL_POWER_POLICY
+
+            # Under a heavy load, the next voltage sag is deeper: keep some margin
+            if power_W is not None and power_W > self.high_power_W:
+                battery_percent -= self.critical_percent
+
+            if self._paused:
+                self._paused = battery_percent < self.resume_percent
+            else:
+                self._paused = battery_percent < self.critical_percent
+
+            if battery_percent >= self.low_percent and not self._paused:
+                return FULL_POWER_POLICY
+
+            return PowerPolicy(
+                max_workers=1,
+                buffer_size=LOW_POWER_BUFFER_SIZE,
+                max_fps=LOW_POWER_MAX_FPS,
+                paused=self._paused
+            )
@@ -0,0 +1,159 @@
+""" Background INA219 sampler (Waveshare UPS HAT), the UI never waits on I2C """
+
+import threading
+import time
+
+import numpy as np
+
+from INA219 import _REG_BUSVOLTAGE
+from INA219 import _REG_CALIBRATION
+from INA219 import _REG_CURRENT
+from INA219 import _REG_POWER
+from INA219 import _REG_SHUNTVOLTAGE
+
+
+UPS_HAT_ADDR = 0x43
+
+SAMPLE_RATE_HZ = 2.0
+RING_SIZE = 256                   # ~2 min of history at 2 Hz
+SMOOTHING_WINDOW = 10.0           # secs
+CALIBRATION_CHECK_INTERVAL = 10.0 # secs
+
+# 1S Li-ion: 3V is empty, 4.2V is full
+BATTERY_EMPTY_V = 3.0
+BATTERY_FULL_V = 4.2
+
+# Ring buffer columns
+_COL_TIMESTAMP = 0
+_COL_BUS_VOLTAGE = 1
+_COL_SHUNT_VOLTAGE = 2
+_COL_CURRENT = 3
+_COL_POWER = 4
+
+
+def battery_percent(bus_voltage_V):
+    perc = (bus_voltage_V - BATTERY_EMPTY_V) / (BATTERY_FULL_V - BATTERY_EMPTY_V) * 100
+    return float(np.clip(perc, 0, 100))
+
+
+class PowerSampler(object):
+    """ Reads all the INA219 registers at `rate_hz` on its own thread.
+
+    Samples are (timestamp, bus V, shunt mV, current mA, power W) rows of a
+    fixed-size ring buffer. Readers only average the recent rows: no I2C
+    traffic happens on the caller's thread.
+    """
+
+    def __init__(
+        self,
+        ina219,
+        rate_hz=SAMPLE_RATE_HZ,
+        capacity=RING_SIZE,
+        window=SMOOTHING_WINDOW,
+        calibration_check_interval=CALIBRATION_CHECK_INTERVAL
+    ):
+        self.ina219 = ina219
+        self.rate_hz = rate_hz
+        self.window = window
+        self.calibration_check_interval = calibration_check_interval
+
+        self._lock = threading.Lock()
+        self._samples = np.full((capacity, 5), np.nan)
+        self._count = 0  # Total number of samples, the next row is `_count % capacity`
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="power-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last_check_t = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - last_check_t >= self.calibration_check_interval:
+                    last_check_t = time.monotonic()
+                    if self.ina219.check_calibration():
+                        print("[WARNING] INA219 calibration was lost, rewritten.")
+
+                self.record(time.time(), self.ina219.read_all())
+            except OSError as e:
+                print(f"[WARNING] Impossible to read the INA219: {e}")
+
+            self._stop.wait(1 / self.rate_hz)
+
+    def record(self, timestamp, reading):
+        with self._lock:
+            self._samples[self._count % len(self._samples)] = (timestamp, *reading)
+            self._count += 1
+
+    def samples(self):
+        """ Returns a copy of the samples, oldest first """
+        with self._lock:
+            capacity = len(self._samples)
+            if self._count <= capacity:
+                return self._samples[:self._count].copy()
+            start = self._count % capacity
+            return np.concatenate((self._samples[start:], self._samples[:start]))
+
+    def _recent_mean(self, column):
+        with self._lock:
+            if self._count == 0:
+                return None
+
+            rows = self._samples[:min(self._count, len(self._samples))]
+            latest_t = rows[(self._count - 1) % len(self._samples), _COL_TIMESTAMP]
+            recent = rows[rows[:, _COL_TIMESTAMP] >= latest_t - self.window, column]
+            return float(recent.mean())
+
+    @property
+    def battery_percent(self):
+        """ Smoothed battery charge 0..100, None before the first sample """
+        bus_voltage = self._recent_mean(_COL_BUS_VOLTAGE)
+        return None if bus_voltage is None else battery_percent(bus_voltage)
+
+    @property
+    def power_W(self):
+        """ Smoothed power draw, None before the first sample """
+        return self._recent_mean(_COL_POWER)
+
+    @property
+    def current_mA(self):
+        """ Smoothed current, positive when charging """
+        return self._recent_mean(_COL_CURRENT)
+
+
+class FakeSMBus(object):
+    """ `smbus.SMBus` stand-in holding the INA219 registers, counts the I2C transfers """
+
+    def __init__(self):
+        self.registers = {
+            _REG_SHUNTVOLTAGE: 0, _REG_BUSVOLTAGE: 0, _REG_POWER: 0,
+            _REG_CURRENT: 0, _REG_CALIBRATION: 0
+        }
+        self.reads = 0
+        self.writes = 0
+
+    def read_i2c_block_data(self, addr, register, length):
+        self.reads += 1
+        value = self.registers.get(register, 0)
+        return [(value >> 8) & 0xFF, value & 0xFF][:length]
+
+    def write_i2c_block_data(self, addr, register, data):
+        self.writes += 1
+        self.registers[register] = (data[0] << 8) | data[1]
+
+    def set_measurements(self, ina219, bus_voltage_V, shunt_voltage_mV=0.0, current_mA=0.0, power_W=0.0):
+        """ Sets the raw registers `ina219` converts back to these values """
+        def raw(value):
+            return int(round(value)) & 0xFFFF
+
+        self.registers[_REG_BUSVOLTAGE] = (raw(bus_voltage_V / 0.004) << 3) & 0xFFFF
+        self.registers[_REG_SHUNTVOLTAGE] = raw(shunt_voltage_mV / 0.01)
+        self.registers[_REG_CURRENT] = raw(current_mA / ina219._current_lsb)
+        self.registers[_REG_POWER] = raw(power_W / ina219._power_lsb)
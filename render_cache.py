@@ -0,0 +1,63 @@
+""" Pre-rendered screen layers and text lines, frames are composed by blitting """
+
+import threading
+
+from functools import lru_cache
+
+from PIL import Image
+from PIL import ImageDraw
+
+from lcd_framebuffer import TrackedDraw
+
+
+TEXT_CACHE_SIZE = 256  # Screens show less than 20 lines, days and counters included
+
+
+class RenderCache(object):
+    """ Static layers are drawn once per name, text is rasterized once per string.
+
+    A frame starts as a copy of its layer (a memcpy) and text is pasted as a
+    cached grayscale mask with `ImageDraw.bitmap`. The result is identical to
+    drawing from scratch with `ImageDraw.text`.
+    """
+
+    def __init__(self, width, height, text_cache_size=TEXT_CACHE_SIZE):
+        self.width = width
+        self.height = height
+
+        self._lock = threading.Lock()
+        self._layers = dict()
+        self._text_mask = lru_cache(maxsize=text_cache_size)(self._rasterize_text)
+
+    def layer(self, name, draw_fn=None):
+        """ Returns the layer `name`, drawn by `draw_fn(draw)` on a black image
+        the first time it is requested.
+        """
+        with self._lock:
+            if name not in self._layers:
+                image = Image.new("RGB", (self.width, self.height))
+                if draw_fn is not None:
+                    draw_fn(ImageDraw.Draw(image))
+                self._layers[name] = image
+            return self._layers[name]
+
+    def new_frame(self, name=None, draw_fn=None):
+        """ Returns (TrackedDraw, image): a copy of the layer, fully damaged """
+        image = self.layer(name, draw_fn).copy()
+        draw = TrackedDraw(ImageDraw.Draw(image), self.width, self.height)
+        draw.damage_all()
+
+        return draw, image
+
+    @staticmethod
+    def _rasterize_text(text):
+        # Same origin as `ImageDraw.text`: the mask is pasted at the text position
+        _, _, x1, y1 = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text)
+        mask = Image.new("L", (max(1, x1), max(1, y1)))
+        ImageDraw.Draw(mask).text((0, 0), text, fill=255)
+
+        return mask
+
+    def text(self, draw, xy, text, fill="WHITE"):
+        """ Draws `text` at `xy` on `draw`, an `ImageDraw` or a `TrackedDraw` """
+        draw.bitmap(xy, self._text_mask(text), fill=fill)
@@ -0,0 +1,151 @@
+""" Display thread owning the LCD: copies and inputs never wait on SPI transfers """
+
+import os
+import threading
+import time
+
+from collections import namedtuple
+
+
+DEFAULT_MAX_FPS = 4
+
+
+# `render_fn(state)` returns (image, rects) and runs on the display thread.
+# Prebuilt images are posted with `render_fn=None` and `state=image`.
+_Frame = namedtuple("_Frame", ["render_fn", "state", "rects"])
+
+
+def _merge_frames(pending, frame):
+    """ Latest frame wins, the damage of a dropped prebuilt image is kept """
+    if pending.render_fn is None and frame.render_fn is None:
+        if pending.rects is None or frame.rects is None:
+            return frame._replace(rects=None)
+        return frame._replace(rects=pending.rects + frame.rects)
+    return frame
+
+
+class Mailbox(object):
+    """ Single slot queue: posting replaces the pending item (stale frames are dropped) """
+
+    def __init__(self, merge_fn=None):
+        self._cond = threading.Condition()
+        self._merge_fn = merge_fn
+        self._pending = None
+        self._closed = False
+
+    def post(self, item):
+        with self._cond:
+            if self._pending is not None and self._merge_fn is not None:
+                item = self._merge_fn(self._pending, item)
+            self._pending = item
+            self._cond.notify()
+
+    def get(self):
+        """ Blocks until an item is posted, returns None once closed """
+        with self._cond:
+            while self._pending is None and not self._closed:
+                self._cond.wait()
+            item, self._pending = self._pending, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+
+class LCDBackend(object):
+    """ Waveshare 1.44in LCD HAT """
+
+    def open(self):
+        import LCD_1in44  # Hardware dependencies, only imported when used
+
+        self._disp = LCD_1in44.LCD()
+        Lcd_ScanDir = LCD_1in44.SCAN_DIR_DFT  #SCAN_DIR_DFT = D2U_L2R
+        self._disp.LCD_Init(Lcd_ScanDir)
+        self._disp.LCD_Clear()
+
+    def show(self, image, rects=None):
+        self._disp.LCD_ShowImage(image, 0, 0, rects=rects)
+
+    def close(self):
+        pass
+
+
+class HeadlessBackend(object):
+    """ Saves every frame as a PNG file, for tests without SPI hardware """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.frames = list()  # (path, rects)
+
+    def open(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def show(self, image, rects=None):
+        path = os.path.join(self.output_dir, f"frame_{len(self.frames):06d}.png")
+        image.save(path)
+        self.frames.append((path, rects))
+
+    def close(self):
+        pass
+
+
+class Renderer(object):
+    """ Shows the latest posted frame on `backend`, at most `max_fps` per sec.
+
+    Every call to the backend happens on the display thread.
+    """
+
+    def __init__(self, backend, max_fps=DEFAULT_MAX_FPS):
+        self.backend = backend
+        self.max_fps = max_fps
+
+        self._mailbox = Mailbox(merge_fn=_merge_frames)
+        self._last_source = None
+        self._thread = threading.Thread(target=self._run, name="renderer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Shows the pending frame, if any, then stops the display thread """
+        self._mailbox.close()
+        self._thread.join(timeout)
+
+    def post_image(self, image, rects=None):
+        """ Posts a prebuilt image, `rects=None` means the full frame changed """
+        self._mailbox.post(_Frame(render_fn=None, state=image.copy(), rects=rects))
+
+    def post_state(self, render_fn, state):
+        """ Posts UI state, drawn by `render_fn(state) -> (image, rects)` on the
+        display thread. Only the latest state is drawn.
+        """
+        self._mailbox.post(_Frame(render_fn=render_fn, state=state, rects=None))
+
+    def _run(self):
+        self.backend.open()
+        try:
+            while (frame := self._mailbox.get()) is not None:
+                start_t = time.perf_counter()
+
+                if frame.render_fn is None:
+                    image, rects = frame.state, frame.rects
+                else:
+                    image, rects = frame.render_fn(frame.state)
+
+                # The screen shows another image: damage rects don't apply
+                if frame.render_fn != self._last_source:
+                    rects = None
+                self._last_source = frame.render_fn
+
+                try:
+                    self.backend.show(image, rects=rects)
+                except Exception as e:
+                    print(f"[ERROR] Impossible to refresh the display: {e}")
+
+                # Frame rate cap: frames posted meanwhile are coalesced
+                time.sleep(max(0, 1 / self.max_fps - (time.perf_counter() - start_t)))
+        finally:
+            self.backend.close()
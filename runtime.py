@@ -7,6 +7,7 @@ import hashlib
 import os
 import re
 import shutil
+import struct
 import time
 
 from collections import defaultdict 
@@ -17,16 +18,34 @@ from pathlib import Path
 from pathlib import PosixPath
 
 from copy_utils import DEFAULT_BUFFER_SIZE
+from copy_utils import DIGEST_MD5
 from copy_utils import copy_with_callback
 
+from hash_index import HashIndex
+
+from listing_snapshot import FileStat
+from listing_snapshot import ListingSnapshot
+
+from verify import VERIFY_FINGERPRINT
+from verify import hash_file
+from verify import verify
+
+
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024  # 1 MB hashed at the start, middle and end
+DIGEST_FINGERPRINT = "fingerprint"
+
 
 def _list_files_and_dirs(dir_path):
+    """ Returns the `os.DirEntry` of files and dirs in `dir_path`.
+    `DirEntry.is_file()` / `is_dir()` don't need any extra syscall and 
+    `DirEntry.stat()` is cached.
+    """
     res = []
     try:
-        for file_path in os.listdir(dir_path):
-            fullpath = os.path.join(dir_path, file_path)
-            if os.path.isfile(fullpath) or os.path.isdir(fullpath):
-                res.append(file_path)
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.is_file() or entry.is_dir():
+                    res.append(entry)
     except FileNotFoundError:
         print(f"The directory {dir_path} does not exist")
     except PermissionError:
@@ -38,25 +57,121 @@ def _list_files_and_dirs(dir_path):
 
 class VideoFile(PosixPath):
 
+    @classmethod
+    def from_stat(cls, path, st):
+        """ Builds a VideoFile whose metadata comes from an existing stat result """
+        video_f = cls(path)
+        video_f._cached_stat = st
+        return video_f
+
+    def _stat(self):
+        # Cached per instance: another card may hold a file at the same path
+        if getattr(self, "_cached_stat", None) is None:
+            self._cached_stat = os.stat(self)
+        return self._cached_stat
+
     @property
     def device_id(self):
         return str(self).split("/")[-4].replace("-", "_")
+
+    @property
+    def device_root(self):
+        """ Root of the card storing the clip: `<root>/DCIM/1xxGOPRO/<clip>` """
+        return self.parents[2]
     
     @property
-    @lru_cache
+    def hash_index(self):
+        return HashIndex.for_path(self)
+
+    @property
     def md5sum(self):
-        md5_hash = hashlib.md5()
-        with open(self,"rb") as f:
-            # Read and update hash in chunks of 4K
-            for byte_block in iter(lambda: f.read(4096),b""):
-                md5_hash.update(byte_block)
-            return md5_hash.hexdigest()
+        st = os.stat(self)
+        
+        # Persisted across runs, invalidated if the file changes.
+        digest = self.hash_index.lookup(self, DIGEST_MD5, st=st)
+        if digest is not None:
+            return digest
+
+        digest = hash_file(self, DIGEST_MD5)
+        self.hash_index.store(self, DIGEST_MD5, digest, st=st)
+        return digest
+
+    @property
+    def fingerprint(self):
+        """ Cheap digest of the size, the first / middle / last 
+        `FINGERPRINT_CHUNK_SIZE` bytes and the MP4 `moov` atom.
+
+        Two files with different fingerprints are different, two files with 
+        identical fingerprints are identical unless edited in place.
+        """
+        st = os.stat(self)
+        
+        digest = self.hash_index.lookup(self, DIGEST_FINGERPRINT, st=st)
+        if digest is not None:
+            return digest
+
+        fp_hash = hashlib.md5(str(st.st_size).encode())
+        with open(self, "rb") as f:
+            offsets = {
+                0, 
+                max(0, st.st_size // 2 - FINGERPRINT_CHUNK_SIZE // 2), 
+                max(0, st.st_size - FINGERPRINT_CHUNK_SIZE)
+            }
+            for offset in sorted(offsets):
+                f.seek(offset)
+                fp_hash.update(f.read(FINGERPRINT_CHUNK_SIZE))
+
+            moov_offset, moov_size = VideoFile._find_mp4_atom(f, st.st_size, b"moov")
+            if moov_offset is not None:
+                f.seek(moov_offset)
+                while moov_size > 0 and (data := f.read(min(moov_size, FINGERPRINT_CHUNK_SIZE))):
+                    fp_hash.update(data)
+                    moov_size -= len(data)
+        
+        digest = fp_hash.hexdigest()
+        self.hash_index.store(self, DIGEST_FINGERPRINT, digest, st=st)
+        return digest
+
+    @staticmethod
+    def _find_mp4_atom(f, filesize, atom_type):
+        """ Returns (offset, size) of a top-level MP4 atom, (None, 0) if not found """
+        offset = 0
+        while offset + 8 <= filesize:
+            f.seek(offset)
+            # Shorter than its header: truncated, e.g. a clip still being written
+            if len(header := f.read(8)) < 8:
+                break
+            atom_size, current_type = struct.unpack(">I4s", header)
+            header_size = 8
+
+            if atom_size == 1:  # 64 bits size
+                if len(header := f.read(8)) < 8:
+                    break
+                atom_size, = struct.unpack(">Q", header)
+                header_size = 16
+            elif atom_size == 0:  # atom extends to the end of the file
+                atom_size = filesize - offset
+
+            if atom_size < header_size:  # Not an MP4 file or corrupted
+                break
+
+            if current_type == atom_type:
+                return offset, atom_size
+            
+            offset += atom_size
+        
+        return None, 0
+
+    def record_digests(self, digests):
+        """ Saves digests computed elsewhere, e.g. while copying the file """
+        st = os.stat(self)
+        for algo, digest in digests.items():
+            self.hash_index.store(self, algo, digest, st=st)
 
     @property
-    @lru_cache
     def date_created(self):
         return VideoFile._date_to_str(
-            VideoFile._timestamp_to_date(os.path.getctime(self))
+            VideoFile._timestamp_to_date(self._stat().st_ctime)
         )
     
     @staticmethod
@@ -64,10 +179,9 @@ class VideoFile(PosixPath):
         return date.strftime("%Y_%m_%d")
     
     @property
-    @lru_cache
     def date_last_modified(self):
         return VideoFile._date_to_str(
-            VideoFile._timestamp_to_date(os.path.getmtime(self))
+            VideoFile._timestamp_to_date(self._stat().st_mtime)
         )
     
     @staticmethod
@@ -76,9 +190,8 @@ class VideoFile(PosixPath):
         return datetime.fromtimestamp(tmstp).date()
     
     @property
-    @lru_cache
     def size(self):
-        return os.stat(self).st_size
+        return self._stat().st_size
 
 
 class USBDevice(PosixPath):
@@ -87,6 +200,16 @@ class USBDevice(PosixPath):
     def device_id(self):
         return str(self).split("/")[-1].replace("-", "_")
 
+    @classmethod
+    def clear_caches(cls):
+        """ Forgets the content cached per mountpoint, e.g. before another card
+        is mounted at the same place.
+        """
+        cls.is_gopro.cache_clear()
+        cls.is_source.cache_clear()
+        cls.list_all_videos.cache_clear()
+        cls.listing_snapshot.fget.cache_clear()
+
     @lru_cache
     def is_gopro(self):
         return os.path.isfile(self / "Get_started_with_GoPro.url")
@@ -95,22 +218,32 @@ class USBDevice(PosixPath):
     def is_source(self):
         return self.is_gopro()
     
+    @property
     @lru_cache
-    def list_all_videos(self):
+    def listing_snapshot(self):
+        return ListingSnapshot(self)
+
+    def list_video_dirs(self):
+        """ Returns the `DCIM/1xxGOPRO` folders, newest first """
         dir_pattern = re.compile(r'^[0-9]{3}GOPRO$')
         video_dir = Path(self / "DCIM")
 
         video_dirs = list()
-        for dir_name in _list_files_and_dirs(video_dir):
-            obj_path = video_dir / dir_name
-            if os.path.isdir(obj_path) and dir_pattern.match(dir_name):
-                video_dirs.append(obj_path)
+        for entry in _list_files_and_dirs(video_dir):
+            if entry.is_dir() and dir_pattern.match(entry.name):
+                video_dirs.append(video_dir / entry.name)
         
+        return sorted(video_dirs, reverse=True)
+
+    @lru_cache
+    def list_all_videos(self):
         videos = defaultdict(list) 
-        for dir_name in video_dirs:
-            for video_f in USBDevice.scan_dir_for_videos(dir_name):
+        for dir_name in self.list_video_dirs():
+            for video_f in USBDevice.scan_dir_for_videos(dir_name, self.listing_snapshot):
                 videos[video_f.date_created].append(video_f)
 
+        self.listing_snapshot.save()
+
         for date in videos.keys():
             videos[date] = sorted(
                 videos[date], 
@@ -121,22 +254,40 @@ class USBDevice(PosixPath):
         return videos
     
     @staticmethod
-    @lru_cache
-    def scan_dir_for_videos(dir):
-        videos = list()
+    def scan_dir_for_videos(dir, snapshot=None):
+        """ Lists the videos of `dir`, only the files missing from `snapshot`
+        are stat'ed.
+        """
+        known = snapshot.get(dir) if snapshot is not None else dict()
 
-        for filename in _list_files_and_dirs(dir):
-            filepath = dir / filename
+        files = dict()
+        for entry in _list_files_and_dirs(dir):
 
-            if not os.path.isfile(filepath):
+            if not entry.is_file() or not entry.name.lower().endswith(".mp4"):
                 continue
 
-            if str(filepath).lower().endswith(".mp4"):
-                videos.append(VideoFile(filepath))
+            if entry.name in known:
+                files[entry.name] = known[entry.name]
+                continue
 
-        return videos
+            st = entry.stat()
+            files[entry.name] = FileStat(
+                st.st_size, st.st_mtime, st.st_ctime, st.st_ino, st.st_mtime_ns
+            )
+
+        # The files gone since the last scan are dropped
+        if snapshot is not None:
+            snapshot.put(dir, files)
+
+        return [
+            VideoFile.from_stat(dir / filename, st) 
+            for filename, st in files.items()
+        ]
     
     def umount(self):
+        # The hash index keeps a file opened on the device.
+        HashIndex.close_root(self)
+
         print(f"[INFO] Unmounting Device `{self}` ... ", end="", flush=True)
         if os.system(f'sudo umount {self}') == 0:
             print("SUCCESS !")
@@ -148,6 +299,7 @@ class USBDevice(PosixPath):
     
 
 def get_usb_devices():
+    """ Returns (sources, targets): lists of the mounted removable `USBDevice` """
     context = pyudev.Context()
 
     removable_devices = [
@@ -171,25 +323,13 @@ def get_usb_devices():
 
             device_list.append(USBDevice(p.mountpoint))
 
-    
-    if len(device_list) > 2:
-        raise RuntimeError(
-            "Incorrect number of USB devices detected. "
-            f"2 or less expected, received: {len(device_list)}")
-    
-    source_device = None
-    target_device = None
+    sources = sorted(device for device in device_list if device.is_source())
+    targets = sorted(device for device in device_list if not device.is_source())
 
-    for device in device_list:
-        if device.is_source():
-            source_device = device
-        else:
-            target_device = device
-    
-    return source_device, target_device
+    return sources, targets
 
 
-def copy_file(source_f, target_device, dry_run=False):
+def copy_file(source_f, target_device, dry_run=False, verify_mode=VERIFY_FINGERPRINT):
     target_dir = Path(
         f"{target_device / source_f.date_created}____{source_f.device_id}"
     )
@@ -202,6 +342,15 @@ def copy_file(source_f, target_device, dry_run=False):
     target_f = VideoFile(target_dir / source_f.name)
     filesize_in_MB = round(source_f.size / (1<<17)) / 8 # bytes to MB
 
+    if target_f.is_file():
+        if verify(source_f, target_f, mode=verify_mode):
+            print(f"[INFO] SKIP: `{target_f}` is identical to `{source_f}`")
+            return
+        
+        print(f"[INFO] `{target_f}` differs from `{source_f}` => Overwriting.")
+        if not dry_run:
+            target_f.unlink()
+
     print(f"[INFO] Copying: {source_f.name} => {target_f} - Size: {filesize_in_MB} MB ... ", flush=True)
 
     if not dry_run:
@@ -210,13 +359,17 @@ def copy_file(source_f, target_device, dry_run=False):
             from tqdm import tqdm
             bar_format = "{percentage:3.0f}% |{bar}| Elapsed: {elapsed} - Remaining:{remaining}"
             with tqdm(total=source_f.size, bar_format=bar_format) as bar:
-                copy_with_callback(
+                _, digests = copy_with_callback(
                     source_f,
                     target_f,
                     follow_symlinks=True,
                     callback=lambda copied, total_copied, total: bar.update(copied),
                     buffer_size=DEFAULT_BUFFER_SIZE,
+                    digests=[DIGEST_MD5],
+                    resumable=True,
                 )
+            source_f.record_digests(digests)
+            target_f.record_digests(digests)
             elapsed_t = round(time.perf_counter() - start_t)
             print(f"SUCCESS! Total: {elapsed_t:d} secs - Transfer: {float(filesize_in_MB)/elapsed_t:.1f} MB/s.")
         
@@ -233,11 +386,18 @@ def copy_file(source_f, target_device, dry_run=False):
             print(f"ERROR: {e}")
 
 
-def get_or_create_target_dir(date, source_d, target_d):
-    target_dir = Path(
+def get_target_dir(date, source_d, target_d):
+    """ `source_d`: the source `USBDevice` or one of its `VideoFile`, both
+    have the same `device_id`: every card gets its own folders.
+    """
+    return Path(
         f"{target_d / date}____{source_d.device_id}"
     )
 
+
+def get_or_create_target_dir(date, source_d, target_d):
+    target_dir = get_target_dir(date, source_d, target_d)
+
     try:
         os.makedirs(target_dir)
     except FileExistsError:
@@ -247,13 +407,22 @@ def get_or_create_target_dir(date, source_d, target_d):
 
 
 if __name__ == "__main__":
-    source_device, target_device = get_usb_devices()
+    from tqdm import tqdm
 
-    videos = source_device.list_all_videos()
-    
-    for id, video in enumerate(videos["2023_06_12"]):
+    from copy_scheduler import CopyScheduler
+
+    sources, targets = get_usb_devices()
+    source_device, target_device = sources[0], targets[0]
+
+    date = "2023_06_12"
+    videos = source_device.list_all_videos()[date][:5]
+    target_dir = get_or_create_target_dir(date, source_device, target_device)
 
-        if id >= 5:
-            break
+    bar_format = "{percentage:3.0f}% |{bar}| Elapsed: {elapsed} - Remaining:{remaining}"
+    with tqdm(total=sum(video.size for video in videos), bar_format=bar_format) as bar:
+        results = CopyScheduler(
+            on_event=lambda event: bar.update(event.copied)
+        ).run([(video, VideoFile(target_dir / video.name)) for video in videos])
 
-        copy_file(video, target_device)
\ No newline at end of file
+    for result in results:
+        print(f"[INFO] {result.job.source_f.name}: {result.error or 'SUCCESS!'}")
\ No newline at end of file
@@ -0,0 +1,211 @@
+""" Whole-card sync: the delta between source and target is computed up front """
+
+import itertools
+import json
+import os
+import shutil
+
+from collections import namedtuple
+
+from copy_scheduler import CopyJob
+
+from hash_index import METADATA_DIRNAME
+
+from runtime import VideoFile
+from runtime import get_target_dir
+
+from verify import VERIFY_FINGERPRINT
+from verify import verify
+
+
+STATUS_NEW = "new"
+STATUS_CHANGED = "changed"      # Target exists but differs: overwritten
+STATUS_IDENTICAL = "identical"  # Skipped
+
+ORDER_LARGEST_FIRST = "largest_first"  # Long sequential transfers first
+ORDER_BY_DIRECTORY = "by_directory"    # Target folder by folder, in name order
+
+THROUGHPUT_FILENAME = "throughput.json"
+DEFAULT_THROUGHPUT = 20 * 1024 * 1024  # bytes / sec, USB 2.0 card reader
+MIN_THROUGHPUT_SAMPLE = 64 * 1024 * 1024  # Smaller runs are dominated by latencies
+THROUGHPUT_SMOOTHING = 0.5
+
+
+PlannedFile = namedtuple("PlannedFile", ["source_f", "target_d", "target_f", "status", "target_size"])
+
+
+def format_duration(secs):
+    secs = int(round(secs))
+    if secs >= 3600:
+        return f"{secs // 3600}h{secs % 3600 // 60:02d}m"
+    return f"{secs // 60}m{secs % 60:02d}s"
+
+
+class ThroughputHistory(object):
+    """ Smoothed copy throughput measured on previous runs, stored on the target """
+
+    def __init__(self, target_root):
+        self.path = os.path.join(str(target_root), METADATA_DIRNAME, THROUGHPUT_FILENAME)
+
+    @property
+    def bytes_per_sec(self):
+        try:
+            with open(self.path) as f:
+                return float(json.load(f)["bytes_per_sec"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return DEFAULT_THROUGHPUT
+
+    def record(self, copied_bytes, elapsed_secs):
+        if copied_bytes < MIN_THROUGHPUT_SAMPLE or elapsed_secs <= 0:
+            return
+
+        measured = copied_bytes / elapsed_secs
+        smoothed = (
+            THROUGHPUT_SMOOTHING * measured +
+            (1 - THROUGHPUT_SMOOTHING) * self.bytes_per_sec
+        )
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"bytes_per_sec": smoothed}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[WARNING] Impossible to save the copy throughput: {e}")
+
+
+class SyncPlan(object):
+    """ Status of every (source file, target) and the resources needed to copy
+    them. The throughput of a run, all targets together, is stored on the
+    first target.
+    """
+
+    def __init__(self, files, targets):
+        self.files = files
+        self.targets = list(targets)
+        self.throughput = ThroughputHistory(self.targets[0])
+
+    def _with_status(self, *statuses):
+        return [f for f in self.files if f.status in statuses]
+
+    @property
+    def new(self):
+        return self._with_status(STATUS_NEW)
+
+    @property
+    def changed(self):
+        return self._with_status(STATUS_CHANGED)
+
+    @property
+    def identical(self):
+        return self._with_status(STATUS_IDENTICAL)
+
+    @property
+    def to_copy(self):
+        return self._with_status(STATUS_NEW, STATUS_CHANGED)
+
+    @property
+    def bytes_to_copy(self):
+        return sum(f.source_f.size for f in self.to_copy)
+
+    def bytes_needed(self, target_d):
+        # Changed targets are deleted before being copied again
+        return sum(
+            f.source_f.size - f.target_size for f in self.to_copy if f.target_d == target_d
+        )
+
+    @staticmethod
+    def _free_space(target_d):
+        """ Free bytes on `target_d`, None if it was removed meanwhile """
+        try:
+            return shutil.disk_usage(target_d).free
+        except OSError:
+            return None
+
+    @property
+    def bytes_free(self):
+        """ Free space of the fullest target, 0 if one was removed """
+        return min(self._free_space(target_d) or 0 for target_d in self.targets)
+
+    @property
+    def fits(self):
+        for target_d in self.targets:
+            free = self._free_space(target_d)
+            if free is None or self.bytes_needed(target_d) > free:
+                return False
+        return True
+
+    @property
+    def eta_secs(self):
+        return self.bytes_to_copy / self.throughput.bytes_per_sec
+
+    def jobs(self, order=ORDER_LARGEST_FIRST):
+        if order == ORDER_LARGEST_FIRST:
+            files = sorted(self.to_copy, key=lambda f: f.source_f.size, reverse=True)
+        elif order == ORDER_BY_DIRECTORY:
+            files = sorted(self.to_copy, key=lambda f: (str(f.target_f.parent), f.target_f.name))
+        else:
+            raise ValueError(f"Unknown order: `{order}`")
+
+        return [CopyJob(source_f=f.source_f, target_f=f.target_f) for f in files]
+
+    def prepare(self):
+        """ Creates the target folders and deletes the changed targets """
+        for f in self.to_copy:
+            os.makedirs(f.target_f.parent, exist_ok=True)
+            if f.status == STATUS_CHANGED:
+                f.target_f.unlink()
+
+
+class SyncPlanner(object):
+    """ Compares the videos of the sources with the target trees, without
+    writing anything. Every video is copied to every target.
+    """
+
+    def __init__(self, sources, targets, verify_mode=VERIFY_FINGERPRINT):
+        if not targets:
+            raise ValueError("At least one target is required")
+
+        self.sources = list(sources)
+        self.targets = list(targets)
+        self.verify_mode = verify_mode
+
+    def plan(self, videos=None, on_progress=None):
+        """ Returns a `SyncPlan` for `videos` (default: every video of the sources).
+
+        `on_progress(idx, total, source_f)` is called before each file is checked.
+        """
+        if videos is None:
+            videos = [
+                video_f for source_d in self.sources
+                for day_videos in source_d.list_all_videos().values()
+                for video_f in day_videos
+            ]
+
+        total = len(videos) * len(self.targets)
+
+        files = list()
+        for idx, (source_f, target_d) in enumerate(itertools.product(videos, self.targets)):
+            if on_progress is not None:
+                on_progress(idx, total, source_f)
+
+            target_dir = get_target_dir(source_f.date_created, source_f, target_d)
+            target_f = VideoFile(target_dir / source_f.name)
+
+            if not target_f.is_file():
+                status, target_size = STATUS_NEW, 0
+
+            else:
+                print(f"[LOG] Checking Hash for `{source_f}` ... ", end="", flush=True)
+                target_size = target_f.stat().st_size
+                if verify(source_f, target_f, mode=self.verify_mode):
+                    print("[LOG] Identical files => Skipped.")
+                    status = STATUS_IDENTICAL
+                else:
+                    print("[LOG] Different files => Overwriting.")
+                    status = STATUS_CHANGED
+
+            files.append(PlannedFile(source_f, target_d, target_f, status, target_size))
+
+        return SyncPlan(files, self.targets)
@@ -0,0 +1,109 @@
+import errno
+import os
+
+from collections import defaultdict
+
+import pytest
+
+import copy_utils
+
+from copy_utils import ENGINE_COPY_FILE_RANGE
+from copy_utils import ENGINE_SENDFILE
+from copy_utils import copy_with_callback
+
+SIZE = 3 * 1024 * 1024 + 123
+BUFFER_SIZE = 256 * 1024
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "GX010001.MP4"
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def engines(monkeypatch):
+    """ Fresh cache of unsupported engines, progress reported at every buffer """
+    unsupported = defaultdict(set)
+    monkeypatch.setattr(copy_utils, "_UNSUPPORTED_ENGINES", unsupported)
+    monkeypatch.setattr(copy_utils, "CALLBACK_INTERVAL", -1)
+    return unsupported
+
+
+def failing(real_fn, calls, errno_, after=0):
+    """ `real_fn` raising `errno_` once called `after` times """
+    def fn(*args):
+        calls.append(args)
+        if len(calls) > after:
+            raise OSError(errno_, os.strerror(errno_))
+        return real_fn(*args)
+    return fn
+
+
+def copy(source, dest):
+    reported = list()
+    copy_with_callback(
+        source, dest, buffer_size=BUFFER_SIZE,
+        callback=lambda copied, total_copied, total: reported.append((copied, total_copied))
+    )
+    assert dest.read_bytes() == source.read_bytes()
+    return reported
+
+
+def assert_totals(reported):
+    assert sum(copied for copied, _ in reported) == SIZE
+    assert reported[-1][1] == SIZE
+    totals = [total_copied for _, total_copied in reported]
+    assert totals == sorted(totals)
+
+
+def test_unsupported_engine_is_remembered_per_device_pair(tmp_path, source, engines, monkeypatch):
+    calls = list()
+    monkeypatch.setattr(
+        copy_utils.os, "copy_file_range", failing(os.copy_file_range, calls, errno.EXDEV), raising=False
+    )
+
+    assert_totals(copy(source, tmp_path / "dest0.MP4"))
+    assert len(calls) == 1
+    assert engines[(source.stat().st_dev, tmp_path.stat().st_dev)] == {ENGINE_COPY_FILE_RANGE}
+
+    # Not tried again for this pair of devices
+    assert_totals(copy(source, tmp_path / "dest1.MP4"))
+    assert len(calls) == 1
+
+
+def test_engine_switched_mid_copy(tmp_path, source, monkeypatch):
+    calls = list()
+    monkeypatch.setattr(
+        copy_utils.os, "copy_file_range",
+        failing(os.copy_file_range, calls, errno.ENOSYS, after=3), raising=False
+    )
+
+    # The next engine carries on from the offset reached
+    assert_totals(copy(source, tmp_path / "dest.MP4"))
+    assert len(calls) == 4
+
+
+def test_userspace_engine_as_last_resort(tmp_path, source, engines, monkeypatch):
+    monkeypatch.setattr(
+        copy_utils.os, "copy_file_range", failing(None, list(), errno.EXDEV), raising=False
+    )
+    monkeypatch.setattr(
+        copy_utils.os, "sendfile", failing(os.sendfile, list(), errno.EINVAL, after=2)
+    )
+
+    assert_totals(copy(source, tmp_path / "dest.MP4"))
+    assert engines[(source.stat().st_dev, tmp_path.stat().st_dev)] == {
+        ENGINE_COPY_FILE_RANGE, ENGINE_SENDFILE
+    }
+
+
+def test_io_error_is_not_a_fallback(tmp_path, source, monkeypatch):
+    monkeypatch.setattr(
+        copy_utils.os, "copy_file_range", failing(None, list(), errno.EIO), raising=False
+    )
+
+    with pytest.raises(OSError) as e:
+        copy(source, tmp_path / "dest.MP4")
+    assert e.value.errno == errno.EIO
@@ -0,0 +1,128 @@
+import errno
+import os
+
+import pytest
+
+import dedup
+import hash_index
+
+from copy_scheduler import CopyJob
+from copy_scheduler import CopyScheduler
+
+from dedup import DEDUP_HARDLINK
+from dedup import DEDUP_REFLINK
+from dedup import DEDUP_SKIP
+from dedup import TargetDedup
+
+from hash_index import HashIndex
+
+from runtime import DIGEST_FINGERPRINT
+from runtime import VideoFile
+
+from verify import VERIFY_FULL
+
+SIZE = 512 * 1024
+
+
+@pytest.fixture
+def device(tmp_path, monkeypatch):
+    """ `tmp_path` stands for the filesystem of both the card and the target """
+    monkeypatch.setattr(HashIndex, "_instances", dict())
+    for module in (hash_index, dedup):
+        monkeypatch.setattr(module, "find_mountpoint", lambda path: str(tmp_path))
+    return tmp_path
+
+
+def video(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return VideoFile(path)
+
+
+@pytest.fixture
+def source(device):
+    return video(device / "sd" / "DCIM" / "100GOPRO" / "GX010001.MP4", os.urandom(SIZE))
+
+
+@pytest.fixture
+def target(device, source):
+    return VideoFile(device / "ssd" / "2024_05_02" / source.name)
+
+
+def stored(device, source, data=None):
+    """ A clip stored by a previous trip, indexed by the target """
+    existing = video(device / "ssd" / "2024_05_01" / source.name, data or source.read_bytes())
+    existing.fingerprint
+    return existing
+
+
+def run(dedup, source, target):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    result, = CopyScheduler(dedup=dedup).run([CopyJob(source, target)])
+    assert result.error is None
+    return result
+
+
+def test_identical_clip_is_hardlinked(device, source, target):
+    existing = stored(device, source)
+    result = run(TargetDedup(DEDUP_HARDLINK), source, target)
+
+    assert result.dedup == DEDUP_HARDLINK
+    assert os.path.samefile(existing, target)
+    assert target.hash_index.lookup(target, DIGEST_FINGERPRINT) == existing.fingerprint
+
+
+def test_same_size_but_different_clip_is_copied(device, source, target):
+    existing = stored(device, source, data=os.urandom(SIZE))
+
+    # e.g. a stale entry: the candidate must still be confirmed
+    existing.record_digests({DIGEST_FINGERPRINT: source.fingerprint})
+    assert TargetDedup(verify_mode=VERIFY_FULL).find_duplicate(source, target) is None
+
+    result = run(TargetDedup(DEDUP_HARDLINK, verify_mode=VERIFY_FULL), source, target)
+    assert result.dedup is None
+    assert not os.path.samefile(existing, target)
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_clips_of_the_source_card_are_never_candidates(device, source, target):
+    source.fingerprint  # Indexed, on the same filesystem as the target
+    assert TargetDedup().find_duplicate(source, target) is None
+
+
+def test_skip_writes_nothing(device, source, target):
+    stored(device, source)
+    result = run(TargetDedup(DEDUP_SKIP), source, target)
+
+    assert result.dedup == DEDUP_SKIP
+    assert not target.exists()
+
+
+def test_reflink_falls_back_to_a_hardlink(device, source, target, monkeypatch):
+    def ioctl(fd, request, arg):
+        raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+    monkeypatch.setattr(dedup.fcntl, "ioctl", ioctl)
+    existing = stored(device, source)
+    target.parent.mkdir(parents=True)
+
+    assert TargetDedup(DEDUP_REFLINK).link(existing, target) == DEDUP_HARDLINK
+    assert os.path.samefile(existing, target)
+
+
+def test_filesystem_without_links_gets_a_copy(device, source, target, monkeypatch):
+    calls = list()
+
+    def link(src, dest):
+        calls.append(dest)
+        raise OSError(errno.EPERM, "Operation not permitted")  # e.g. exFAT
+
+    monkeypatch.setattr(dedup.os, "link", link)
+    existing = stored(device, source)
+    target.parent.mkdir(parents=True)
+
+    target_dedup = TargetDedup(DEDUP_HARDLINK)
+    assert target_dedup.link(existing, target) is None
+    assert target_dedup.link(existing, target) is None
+    assert len(calls) == 1  # Not tried again on that device
+    assert not target.exists()
@@ -0,0 +1,111 @@
+import pytest
+
+from device_manager import DeviceManager
+from device_manager import EVENT_SOURCE_ADDED
+from device_manager import EVENT_SOURCE_REMOVED
+from device_manager import EVENT_TARGET_ADDED
+from device_manager import EVENT_TARGET_REMOVED
+from device_manager import FakeUdevSource
+
+from hash_index import HashIndex
+
+from runtime import USBDevice
+
+EVENT_TIMEOUT = 5.0  # secs
+
+
+def make_card(path):
+    """ Turns `path` into the root of a GoPro card """
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "Get_started_with_GoPro.url").write_text("")
+    return path
+
+
+@pytest.fixture
+def udev():
+    USBDevice.clear_caches()
+    return FakeUdevSource()
+
+
+@pytest.fixture
+def manager(udev):
+    manager = DeviceManager(udev_source=udev, mount_table=udev.mount_table)
+    yield manager
+    manager.stop()
+
+
+def next_event(manager):
+    event = manager.get(timeout=EVENT_TIMEOUT)
+    assert event is not None, "no device event received"
+    return event
+
+
+def test_devices_plugged_before_start_are_reported(tmp_path, udev, manager):
+    udev.plug("/dev/sda1", make_card(tmp_path / "usb0"))
+    (tmp_path / "usb1").mkdir()
+    udev.plug("/dev/sdb1", tmp_path / "usb1")
+
+    manager.start()
+
+    kinds = {next_event(manager).kind, next_event(manager).kind}
+    assert kinds == {EVENT_SOURCE_ADDED, EVENT_TARGET_ADDED}
+    assert manager.sources == [USBDevice(tmp_path / "usb0")]
+    assert manager.targets == [USBDevice(tmp_path / "usb1")]
+
+
+def test_partition_only_added_once_mounted(tmp_path, udev, manager):
+    manager.start()
+
+    udev.plug("/dev/sda1")
+    assert manager.get(timeout=0.2) is None
+    assert manager.sources == []
+
+    udev.mount_table.mount("/dev/sda1", make_card(tmp_path / "usb0"))
+    event = next_event(manager)
+    assert event.kind == EVENT_SOURCE_ADDED
+    assert event.device == USBDevice(tmp_path / "usb0")
+
+
+def test_card_pulled_out_is_removed(tmp_path, udev, manager):
+    udev.plug("/dev/sda1", make_card(tmp_path / "usb0"))
+    manager.start()
+    assert next_event(manager).kind == EVENT_SOURCE_ADDED
+
+    udev.unplug("/dev/sda1")  # Still in the mount table, as a card pulled out
+    event = next_event(manager)
+    assert event.kind == EVENT_SOURCE_REMOVED
+    assert manager.sources == []
+
+
+def test_card_swapped_at_the_same_mountpoint(tmp_path, udev, manager):
+    mountpoint = make_card(tmp_path / "usb0")
+    udev.plug("/dev/sda1", mountpoint)
+    manager.start()
+    first = next_event(manager).device
+
+    index = HashIndex.for_root(first)
+    udev.unplug("/dev/sda1")
+    udev.mount_table.unmount("/dev/sda1")
+    assert next_event(manager).kind == EVENT_SOURCE_REMOVED
+
+    # The index of the removed card is never reused for the next one
+    assert HashIndex.for_root(first) is not index
+
+    # Same mountpoint, but not a GoPro card anymore
+    (mountpoint / "Get_started_with_GoPro.url").unlink()
+    udev.plug("/dev/sdb1", mountpoint)
+    event = next_event(manager)
+    assert event.kind == EVENT_TARGET_ADDED
+    assert event.device is not first
+    assert manager.targets == [USBDevice(mountpoint)]
+
+
+def test_target_removed_on_unmount(tmp_path, udev, manager):
+    (tmp_path / "usb1").mkdir()
+    udev.plug("/dev/sdb1", tmp_path / "usb1")
+    manager.start()
+    assert next_event(manager).kind == EVENT_TARGET_ADDED
+
+    udev.mount_table.unmount("/dev/sdb1")
+    assert next_event(manager).kind == EVENT_TARGET_REMOVED
+    assert manager.targets == []
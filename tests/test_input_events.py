@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from input_events import EVENT_PRESS
+from input_events import EVENT_REPEAT
+from input_events import InputEvents
+from input_events import KEY1_PIN
+from input_events import KEY_DOWN_PIN
+from input_events import SimulatedGPIO
+
+EVENT_TIMEOUT = 2.0  # secs
+
+
+@pytest.fixture
+def gpio():
+    return SimulatedGPIO()
+
+
+@pytest.fixture
+def inputs(gpio):
+    inputs = InputEvents(
+        gpio, debounce_time=0.01, repeat_delay=0.1, repeat_interval=0.05
+    ).start()
+    yield inputs
+    inputs.stop()
+
+
+def test_press_is_queued_once(gpio, inputs):
+    gpio.press(KEY1_PIN)
+    event = inputs.get(timeout=EVENT_TIMEOUT)
+    assert (event.key, event.kind) == (KEY1_PIN, EVENT_PRESS)
+
+    gpio.release(KEY1_PIN)
+    assert inputs.get(timeout=0.1) is None
+
+
+def test_contact_bounces_are_ignored(gpio, inputs):
+    gpio.press(KEY1_PIN, bounces=5)
+    assert inputs.get(timeout=EVENT_TIMEOUT).kind == EVENT_PRESS
+
+    gpio.release(KEY1_PIN, bounces=5)
+    assert inputs.get(timeout=0.1) is None
+
+
+def test_bounce_back_to_released_is_not_a_press(gpio, inputs):
+    gpio.press(KEY1_PIN)
+    gpio.release(KEY1_PIN)  # Within the debounce time
+    assert inputs.get(timeout=0.1) is None
+
+
+def test_held_key_repeats_until_released(gpio, inputs):
+    gpio.press(KEY_DOWN_PIN)
+    assert inputs.get(timeout=EVENT_TIMEOUT).kind == EVENT_PRESS
+    assert inputs.get(timeout=EVENT_TIMEOUT).kind == EVENT_REPEAT
+    assert inputs.get(timeout=EVENT_TIMEOUT).kind == EVENT_REPEAT
+
+    gpio.release(KEY_DOWN_PIN)
+    time.sleep(0.05)  # Settles
+    inputs.clear()
+    assert inputs.get(timeout=0.2) is None
+
+
+def test_keys_without_repeat(gpio, inputs):
+    gpio.press(KEY1_PIN)
+    assert inputs.get(timeout=EVENT_TIMEOUT).kind == EVENT_PRESS
+    assert inputs.get(timeout=0.3) is None
+
+
+def test_stop_removes_the_edge_callbacks(gpio):
+    inputs = InputEvents(gpio).start()
+    inputs.stop()
+
+    gpio.press(KEY1_PIN)
+    assert inputs.get(timeout=0.1) is None
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+import pytest
+
+import copy_scheduler
+import io_topology
+
+from copy_scheduler import CopyJob
+from copy_scheduler import CopyScheduler
+
+from io_topology import FakeIOTopology
+from io_topology import IODevice
+from io_topology import IOTopology
+from io_topology import MEDIA_HDD
+from io_topology import MEDIA_SD_CARD
+from io_topology import MEDIA_SSD
+from io_topology import MEDIA_UNKNOWN
+from io_topology import _media_of
+
+
+class FakeUdevDisk(object):
+    """ What `_media_of` reads from a `pyudev.Device` """
+
+    class Attributes(dict):
+        def asstring(self, name):
+            return self[name]
+
+    class Parent(object):
+        def __init__(self, sys_name):
+            self.sys_name = sys_name
+
+    device_type = "disk"
+    sys_path = "/sys/block/sda"
+
+    def __init__(self, properties=None, rotational=None, mmc=False, usb_port=None):
+        self.properties = dict(properties or {})
+        self.attributes = FakeUdevDisk.Attributes(removable="1")
+        if rotational is not None:
+            self.attributes["queue/rotational"] = rotational
+        self._mmc = mmc
+        self._usb_port = usb_port
+
+    def find_parent(self, subsystem, device_type=None):
+        if subsystem == "mmc" and self._mmc:
+            return FakeUdevDisk.Parent("mmc0")
+        if subsystem == "usb" and self._usb_port is not None:
+            return FakeUdevDisk.Parent(self._usb_port)
+        return None
+
+
+@pytest.mark.parametrize("disk, media", [
+    (FakeUdevDisk({"ID_DRIVE_FLASH_SD": "1"}, rotational="1"), MEDIA_SD_CARD),
+    (FakeUdevDisk({"ID_MODEL": "SD_MMC_Reader"}, rotational="1"), MEDIA_SD_CARD),
+    (FakeUdevDisk({"ID_MODEL": "USB3.0_CRW_-SD"}, rotational="1"), MEDIA_SD_CARD),
+    (FakeUdevDisk(rotational="0", mmc=True), MEDIA_SD_CARD),
+    (FakeUdevDisk({"ID_MODEL": "Samsung_SSD_T7"}, rotational="0"), MEDIA_SSD),
+    (FakeUdevDisk({"ID_MODEL": "Elements_25A2"}, rotational="1"), MEDIA_HDD),
+    (FakeUdevDisk({"ID_MODEL": "Unknown"}), MEDIA_UNKNOWN),
+])
+def test_media_ignores_the_removable_flag(disk, media):
+    assert _media_of(disk) == media
+
+
+class FakeUdevPartition(object):
+    device_type = "partition"
+
+    def __init__(self, disk):
+        self._disk = disk
+
+    def find_parent(self, subsystem, device_type=None):
+        return self._disk if (subsystem, device_type) == ("block", "disk") else None
+
+
+class FakeDevices(object):
+    """ `pyudev.Devices` knowing a single block device, `/dev/sda1` """
+
+    def __init__(self, partition, st_dev=None):
+        self._partition = partition
+        self._st_dev = st_dev
+
+    def from_device_file(self, context, filename):
+        if filename != "/dev/sda1":
+            raise LookupError(filename)
+        return self._partition
+
+    def from_device_number(self, context, typ, number):
+        if number != self._st_dev:
+            raise LookupError(number)  # e.g. the anonymous device of a FUSE mount
+        return self._partition
+
+
+@pytest.fixture
+def card_reader(monkeypatch):
+    disk = FakeUdevDisk({"ID_MODEL": "SD_MMC_Reader"}, rotational="1", usb_port="1-1.3")
+    monkeypatch.setattr(io_topology.pyudev, "Context", lambda: None)
+    return FakeUdevPartition(disk)
+
+
+def test_fuseblk_card_found_from_its_mount_source(tmp_path, card_reader, monkeypatch):
+    monkeypatch.setattr(io_topology.pyudev, "Devices", FakeDevices(card_reader), raising=False)
+    monkeypatch.setattr(io_topology, "mount_source", lambda mountpoint: "/dev/sda1")
+
+    device = IOTopology().device_of(tmp_path)
+    assert device == IODevice("/sys/block/sda", "1-1.3", MEDIA_SD_CARD)
+
+
+def test_device_number_used_without_block_device_source(tmp_path, card_reader, monkeypatch):
+    devices = FakeDevices(card_reader, st_dev=os.stat(io_topology.find_mountpoint(tmp_path)).st_dev)
+    monkeypatch.setattr(io_topology.pyudev, "Devices", devices, raising=False)
+    monkeypatch.setattr(io_topology, "mount_source", lambda mountpoint: "overlay")
+
+    assert IOTopology().device_of(tmp_path).media == MEDIA_SD_CARD
+
+
+@pytest.fixture
+def devices(tmp_path):
+    """ Two cards behind the same reader, an SSD on another port """
+    roots = {
+        "sd0": IODevice("/sys/block/sda", "1-1.1", MEDIA_SD_CARD),
+        "sd1": IODevice("/sys/block/sdb", "1-1.1", MEDIA_SD_CARD),
+        "ssd": IODevice("/sys/block/sdc", "1-1.2", MEDIA_SSD),
+    }
+    for name in roots:
+        (tmp_path / name).mkdir()
+    return {tmp_path / name: device for name, device in roots.items()}
+
+
+def test_slots_per_disk_and_port(tmp_path, devices):
+    topology = FakeIOTopology(devices, ssd_workers=3, port_workers=2)
+
+    assert topology.slots(tmp_path / "sd0" / "DCIM" / "GX010001.MP4", default=5) == [
+        (("disk", "/sys/block/sda"), 1), (("port", "1-1.1"), 2)
+    ]
+    assert topology.slots(tmp_path / "ssd" / "2024_05_01", default=5) == [
+        (("disk", "/sys/block/sdc"), 3), (("port", "1-1.2"), 2)
+    ]
+
+
+def test_unknown_disk_gets_the_default_limit(tmp_path, devices):
+    topology = FakeIOTopology(devices)
+
+    (slot, limit), = topology.slots(tmp_path / "elsewhere", default=5)
+    assert slot[0] == "disk" and limit == 5
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        FakeIOTopology({}, ssd_workers=0)
+
+
+def test_scheduler_keeps_one_reader_per_card(tmp_path, devices, monkeypatch):
+    jobs = list()
+    for card in ("sd0", "sd1"):
+        for idx in range(4):
+            source = tmp_path / card / f"GX01000{idx}.MP4"
+            source.write_bytes(os.urandom(64 * 1024))
+            jobs.append(CopyJob(source, tmp_path / "ssd" / f"{card}_{source.name}"))
+
+    lock = threading.Lock()
+    running = {"sd0": 0, "sd1": 0, "all": 0}
+    peak = dict(running)
+    copy_with_callback = copy_scheduler.copy_with_callback
+
+    def slow_copy(src, dest, **kwargs):
+        card = src.parent.name
+        with lock:
+            for key in (card, "all"):
+                running[key] += 1
+                peak[key] = max(peak[key], running[key])
+        time.sleep(0.05)
+        try:
+            return copy_with_callback(src, dest, **kwargs)
+        finally:
+            with lock:
+                running[card] -= 1
+                running["all"] -= 1
+
+    monkeypatch.setattr(copy_scheduler, "copy_with_callback", slow_copy)
+
+    topology = FakeIOTopology(devices, ssd_workers=4, port_workers=2)
+    results = CopyScheduler(topology=topology, max_workers=8).run(jobs)
+
+    assert all(result.error is None for result in results)
+    assert peak["sd0"] == 1 and peak["sd1"] == 1
+    assert peak["all"] == 2  # Both cards read at once through their reader
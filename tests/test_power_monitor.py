@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from INA219 import INA219
+from INA219 import _REG_CALIBRATION
+
+from power_governor import FULL_POWER_POLICY
+from power_governor import PowerGovernor
+
+from power_monitor import FakeSMBus
+from power_monitor import PowerSampler
+from power_monitor import battery_percent
+
+
+@pytest.fixture
+def bus():
+    return FakeSMBus()
+
+
+@pytest.fixture
+def ina219(bus):
+    return INA219(bus=bus)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+def test_fake_bus_round_trips_the_measurements(bus, ina219):
+    bus.set_measurements(ina219, bus_voltage_V=3.9, current_mA=-500.0, power_W=2.0)
+    reading = ina219.read_all()
+
+    assert reading.bus_voltage_V == pytest.approx(3.9, abs=0.004)
+    assert reading.current_mA == pytest.approx(-500.0, abs=ina219._current_lsb)
+    assert reading.power_W == pytest.approx(2.0, abs=ina219._power_lsb)
+
+
+def test_battery_percent_is_clipped():
+    assert battery_percent(2.5) == 0
+    assert battery_percent(3.6) == pytest.approx(50)
+    assert battery_percent(4.5) == 100
+
+
+def test_properties_are_none_before_the_first_sample(ina219):
+    sampler = PowerSampler(ina219)
+    assert sampler.battery_percent is None
+    assert sampler.power_W is None
+    assert sampler.current_mA is None
+
+
+def test_readers_never_touch_the_bus(bus, ina219):
+    bus.set_measurements(ina219, bus_voltage_V=3.6, current_mA=-200.0)
+    sampler = PowerSampler(ina219, rate_hz=100).start()
+    try:
+        wait_for(lambda: sampler.battery_percent is not None)
+    finally:
+        sampler.stop()
+
+    reads = bus.reads
+    assert sampler.battery_percent == pytest.approx(50, abs=1)
+    assert sampler.current_mA == pytest.approx(-200.0, abs=1)
+    assert bus.reads == reads
+
+
+def test_ring_buffer_keeps_the_latest_samples(ina219):
+    sampler = PowerSampler(ina219, capacity=4)
+    for t in range(6):
+        sampler.record(t, (3.6, 0.0, 0.0, float(t)))
+
+    assert list(sampler.samples()[:, 0]) == [2, 3, 4, 5]
+
+
+def test_readings_are_smoothed_over_the_window(ina219):
+    sampler = PowerSampler(ina219, window=10.0)
+    sampler.record(0, (4.2, 0.0, 0.0, 9.0))  # Out of the window
+    sampler.record(20, (3.6, 0.0, 0.0, 1.0))
+    sampler.record(25, (3.6, 0.0, 0.0, 3.0))
+
+    assert sampler.power_W == pytest.approx(2.0)
+
+
+def test_lost_calibration_is_rewritten(bus, ina219):
+    bus.registers[_REG_CALIBRATION] = 0  # e.g. after a brownout
+    sampler = PowerSampler(ina219, rate_hz=100, calibration_check_interval=0).start()
+    try:
+        wait_for(lambda: bus.registers[_REG_CALIBRATION] == ina219._cal_value)
+    finally:
+        sampler.stop()
+
+
+def test_governor_follows_the_battery_level(ina219):
+    sampler = PowerSampler(ina219)
+    governor = PowerGovernor(sampler)
+
+    sampler.record(0, (4.1, 0.0, -300.0, 1.0))
+    assert governor.policy() == FULL_POWER_POLICY
+
+    sampler.record(100, (3.2, 0.0, -300.0, 1.0))  # ~17%
+    policy = governor.policy()
+    assert policy.max_workers == 1 and not policy.paused
+
+    sampler.record(200, (3.05, 0.0, -300.0, 1.0))  # ~4%
+    assert governor.policy().paused
+
+    sampler.record(300, (3.0, 0.0, 300.0, 1.0))  # Plugged in
+    assert governor.policy() == FULL_POWER_POLICY
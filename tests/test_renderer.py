@@ -0,0 +1,101 @@
+import threading
+
+from PIL import Image
+
+from renderer import HeadlessBackend
+from renderer import Mailbox
+from renderer import Renderer
+
+
+def solid(color):
+    return Image.new("RGB", (128, 128), color)
+
+
+def test_mailbox_keeps_the_latest_item():
+    mailbox = Mailbox()
+    mailbox.post(1)
+    mailbox.post(2)
+    assert mailbox.get() == 2
+
+    mailbox.close()
+    assert mailbox.get() is None
+
+
+def test_frames_are_saved_by_the_headless_backend(tmp_path):
+    backend = HeadlessBackend(tmp_path)
+    renderer = Renderer(backend, max_fps=1000).start()
+
+    renderer.post_image(solid("RED"))
+    renderer.stop()
+
+    (path, rects), = backend.frames
+    assert Image.open(path).getpixel((0, 0)) == (255, 0, 0)
+    assert rects is None
+
+
+def test_states_posted_while_drawing_are_coalesced(tmp_path):
+    backend = HeadlessBackend(tmp_path)
+    renderer = Renderer(backend, max_fps=1000)
+
+    drawing = threading.Event()
+    resume = threading.Event()
+    drawn = list()
+
+    def render(state):
+        drawn.append(state)
+        if state == 0:
+            drawing.set()
+            resume.wait()
+        return solid((state, 0, 0)), None
+
+    renderer.start()
+    renderer.post_state(render, 0)
+    drawing.wait()
+    for state in range(1, 10):
+        renderer.post_state(render, state)
+    resume.set()
+    renderer.stop()
+
+    # Only the latest state posted meanwhile is drawn
+    assert drawn == [0, 9]
+    assert Image.open(backend.frames[-1][0]).getpixel((0, 0)) == (9, 0, 0)
+
+
+class BlockingBackend(HeadlessBackend):
+    """ Blocks on its first frame until `resume` is set """
+
+    def __init__(self, output_dir):
+        super().__init__(output_dir)
+        self.showing = threading.Event()
+        self.resume = threading.Event()
+
+    def show(self, image, rects=None):
+        super().show(image, rects)
+        self.showing.set()
+        self.resume.wait()
+
+
+def test_damage_of_dropped_images_is_merged(tmp_path):
+    backend = BlockingBackend(tmp_path)
+    renderer = Renderer(backend, max_fps=1000).start()
+
+    renderer.post_image(solid("RED"))
+    backend.showing.wait()
+    renderer.post_image(solid("GREEN"), rects=[(0, 0, 10, 10)])
+    renderer.post_image(solid("BLUE"), rects=[(20, 20, 30, 30)])
+    backend.resume.set()
+    renderer.stop()
+
+    # The first frame is sent in full, GREEN is dropped but its damage is kept
+    assert [rects for _, rects in backend.frames] == [None, [(0, 0, 10, 10), (20, 20, 30, 30)]]
+    assert Image.open(backend.frames[-1][0]).getpixel((0, 0)) == (0, 0, 255)
+
+
+def test_damage_is_ignored_when_the_screen_changes(tmp_path):
+    backend = HeadlessBackend(tmp_path)
+    renderer = Renderer(backend, max_fps=1000).start()
+
+    renderer.post_state(lambda state: (solid("RED"), [(0, 0, 10, 10)]), None)
+    renderer.stop()
+
+    assert backend.frames[-1][1] is None
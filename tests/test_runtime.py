@@ -0,0 +1,55 @@
+import io
+import struct
+
+import pytest
+
+import hash_index
+
+from hash_index import HashIndex
+
+from runtime import VideoFile
+
+
+def atom(atom_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), atom_type) + payload
+
+
+def large_atom(atom_type, payload):
+    return struct.pack(">I4sQ", 1, atom_type, 16 + len(payload)) + payload
+
+
+MP4 = atom(b"ftyp", b"mp41" * 4) + large_atom(b"mdat", b"\0" * 64) + atom(b"moov", b"\1" * 32)
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    monkeypatch.setattr(HashIndex, "_instances", dict())
+    monkeypatch.setattr(hash_index, "find_mountpoint", lambda path: str(tmp_path))
+
+    def make(data):
+        path = tmp_path / "GX010001.MP4"
+        path.write_bytes(data)
+        return VideoFile(path)
+    return make
+
+
+def test_moov_atom_found_after_a_64_bits_atom():
+    f = io.BytesIO(MP4)
+    assert VideoFile._find_mp4_atom(f, len(MP4), b"moov") == (len(MP4) - 40, 40)
+
+
+@pytest.mark.parametrize("size", [
+    len(MP4) - 40 + 4,  # In the header of `moov`
+    len(atom(b"ftyp", b"mp41" * 4)) + 12,  # In the 64 bits size of `mdat`
+])
+def test_truncated_atom_header(video, size):
+    f = io.BytesIO(MP4[:size])
+    assert VideoFile._find_mp4_atom(f, size, b"moov") == (None, 0)
+
+    # e.g. a clip still being written
+    assert video(MP4[:size]).fingerprint is not None
+
+
+def test_file_shorter_than_its_stat():
+    f = io.BytesIO(MP4[:20])
+    assert VideoFile._find_mp4_atom(f, len(MP4), b"moov") == (None, 0)
@@ -0,0 +1,97 @@
+import os
+import shutil
+
+from collections import namedtuple
+
+import pytest
+
+import hash_index
+import sync_planner
+
+from hash_index import HashIndex
+
+from runtime import VideoFile
+from runtime import get_target_dir
+
+from sync_planner import STATUS_CHANGED
+from sync_planner import STATUS_IDENTICAL
+from sync_planner import STATUS_NEW
+from sync_planner import SyncPlanner
+
+SIZE = 256 * 1024
+
+DiskUsage = namedtuple("DiskUsage", ["total", "used", "free"])
+
+
+@pytest.fixture
+def videos(tmp_path, monkeypatch):
+    """ Three clips of a card: new, already copied, copied then modified """
+    monkeypatch.setattr(HashIndex, "_instances", dict())
+    monkeypatch.setattr(hash_index, "find_mountpoint", lambda path: str(tmp_path))
+
+    videos = list()
+    for name in ("GX010001.MP4", "GX010002.MP4", "GX010003.MP4"):
+        path = tmp_path / "sd" / "DCIM" / "100GOPRO" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(SIZE))
+        videos.append(VideoFile(path))
+    return videos
+
+
+@pytest.fixture
+def target(tmp_path, videos):
+    target = tmp_path / "ssd"
+    for video_f, data in ((videos[1], videos[1].read_bytes()), (videos[2], os.urandom(SIZE // 2))):
+        target_dir = get_target_dir(video_f.date_created, video_f, target)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        (target_dir / video_f.name).write_bytes(data)
+    return target
+
+
+def test_status_of_each_clip(videos, target):
+    plan = SyncPlanner([], [target]).plan(videos)
+
+    assert [f.status for f in plan.files] == [STATUS_NEW, STATUS_IDENTICAL, STATUS_CHANGED]
+    assert [f.source_f for f in plan.to_copy] == [videos[0], videos[2]]
+    assert plan.bytes_to_copy == 2 * SIZE
+
+    # The changed target is deleted before its copy
+    assert plan.bytes_needed(target) == SIZE + (SIZE - SIZE // 2)
+    assert plan.fits
+
+
+def test_every_target_is_planned(tmp_path, videos, target):
+    other = tmp_path / "hdd"
+    other.mkdir()
+    plan = SyncPlanner([], [target, other]).plan(videos)
+
+    assert len(plan.files) == 2 * len(videos)
+    assert all(f.status == STATUS_NEW for f in plan.files if f.target_d == other)
+
+
+def test_plan_doesnt_fit(videos, target, monkeypatch):
+    plan = SyncPlanner([], [target]).plan(videos)
+
+    monkeypatch.setattr(
+        sync_planner.shutil, "disk_usage", lambda path: DiskUsage(SIZE * 10, SIZE * 10, SIZE)
+    )
+    assert not plan.fits
+    assert plan.bytes_free == SIZE
+
+
+def test_removed_target_doesnt_fit(videos, target):
+    plan = SyncPlanner([], [target]).plan(videos)
+    shutil.rmtree(target)
+
+    assert not plan.fits
+    assert plan.bytes_free == 0
+
+
+def test_prepare_deletes_the_changed_targets(videos, target):
+    plan = SyncPlanner([], [target]).plan(videos)
+    plan.prepare()
+
+    changed, = plan.changed
+    assert not changed.target_f.exists()
+    assert plan.identical[0].target_f.exists()
+    assert all(f.target_f.parent.is_dir() for f in plan.to_copy)
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+
+import pytest
+
+import copy_utils
+
+from copy_scheduler import CopyJob
+from copy_scheduler import CopyScheduler
+from copy_scheduler import EVENT_DONE
+from copy_scheduler import EVENT_FAILED
+
+from copy_utils import DIGEST_MD5
+from copy_utils import DIGEST_SHA1
+from copy_utils import WritePolicy
+from copy_utils import tee_copy
+
+from transfer_journal import TransferJournal
+
+SIZE = 3 * 1024 * 1024 + 123
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "GX010001.MP4"
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+@pytest.fixture
+def targets(tmp_path):
+    targets = [tmp_path / "ssd0", tmp_path / "ssd1", tmp_path / "ssd2"]
+    for target in targets:
+        target.mkdir()
+    return targets
+
+
+def test_every_destination_gets_the_source(source, targets):
+    reported = list()
+    digests, errors = tee_copy(
+        source, targets, buffer_size=256 * 1024, buffer_count=4,
+        callback=lambda copied, total_copied, total: reported.append(total_copied),
+        digests=[DIGEST_MD5, DIGEST_SHA1]
+    )
+
+    assert errors == [None] * len(targets)
+    for target in targets:
+        assert (target / source.name).read_bytes() == source.read_bytes()
+
+    data = source.read_bytes()
+    assert digests == {
+        DIGEST_MD5: hashlib.md5(data).hexdigest(),
+        DIGEST_SHA1: hashlib.sha1(data).hexdigest(),
+    }
+    assert reported[-1] == SIZE
+
+
+def test_failing_destination_doesnt_stop_the_others(tmp_path, source, targets):
+    missing = tmp_path / "unplugged" / source.name
+    _, errors = tee_copy(source, [targets[0], missing, targets[1]], buffer_size=256 * 1024)
+
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], OSError)
+    assert (targets[0] / source.name).read_bytes() == source.read_bytes()
+    assert (targets[1] / source.name).read_bytes() == source.read_bytes()
+
+
+def test_source_as_destination_is_an_error(source, targets):
+    _, errors = tee_copy(source, [source, targets[0]])
+    assert errors[0] is not None and errors[1] is None
+    assert (targets[0] / source.name).read_bytes() == source.read_bytes()
+
+
+def test_missing_source_raises(tmp_path, targets):
+    with pytest.raises(FileNotFoundError):
+        tee_copy(tmp_path / "missing.MP4", targets)
+
+
+class CorruptingPolicy(WritePolicy):
+    """ Flips a byte of the files once written, as a faulty drive """
+
+    def committed(self, destfile):
+        super().committed(destfile)
+        if destfile.parent.name == "ssd1":
+            with open(destfile, "r+b") as f:
+                f.seek(1000)
+                byte = f.read(1)
+                f.seek(1000)
+                f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def test_destination_read_back_differs(source, targets):
+    _, errors = tee_copy(source, targets, write_policy=CorruptingPolicy())
+
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], OSError)
+
+    # Not left for the next run to take as an identical copy
+    assert not (targets[1] / source.name).exists()
+    assert (targets[0] / source.name).read_bytes() == source.read_bytes()
+
+
+def test_resumes_from_the_smallest_checkpoint(source, targets, capsys):
+    data = source.read_bytes()
+    for target, offset in ((targets[0], 2 * 1024 * 1024), (targets[1], 1024 * 1024)):
+        journal = TransferJournal(target / source.name)
+        with open(journal.partial_path, "wb") as f:
+            f.write(data[:offset])
+            journal.checkpoint(f, source, offset)
+
+    digests, errors = tee_copy(source, targets[:2], digests=[DIGEST_MD5], resumable=True)
+
+    assert errors == [None, None]
+    assert "at 1.0 MB" in capsys.readouterr().out
+    assert digests[DIGEST_MD5] == hashlib.md5(data).hexdigest()
+    for target in targets[:2]:
+        assert (target / source.name).read_bytes() == data
+        assert not os.path.exists(TransferJournal(target / source.name).partial_path)
+
+
+def interrupt(copied, total_copied, total):
+    raise KeyboardInterrupt
+
+
+@pytest.mark.parametrize("resumable", [False, True])
+def test_interrupted_copy_leaves_no_writer_nor_partial_file(source, targets, monkeypatch, resumable):
+    monkeypatch.setattr(copy_utils, "CALLBACK_INTERVAL", -1)  # Called at every buffer
+
+    with pytest.raises(KeyboardInterrupt):
+        tee_copy(source, targets, callback=interrupt, buffer_size=64 * 1024, resumable=resumable)
+
+    assert not any(thread.name == "tee-writer" for thread in threading.enumerate())
+    for target in targets:
+        assert not (target / source.name).exists()
+        assert os.path.exists(TransferJournal(target / source.name).partial_path) == resumable
+
+
+def test_scheduler_mirrors_each_source_once(tmp_path, targets):
+    sources = list()
+    for idx in range(4):
+        source = tmp_path / f"GX01000{idx}.MP4"
+        source.write_bytes(os.urandom(512 * 1024 + idx))
+        sources.append(source)
+
+    # The last target was unplugged
+    dests = [*targets[:2], tmp_path / "unplugged"]
+    jobs = [CopyJob(source, dest / source.name) for source in sources for dest in dests]
+
+    events = list()
+    results = CopyScheduler(mirror=True, on_event=events.append).run(jobs)
+
+    assert [result.job for result in results] == jobs
+    for result in results:
+        if result.job.target_f.parent.name == "unplugged":
+            assert result.error is not None
+        else:
+            assert result.error is None
+            assert result.job.target_f.read_bytes() == result.job.source_f.read_bytes()
+
+    finished = [event for event in events if event.kind in (EVENT_DONE, EVENT_FAILED)]
+    assert len(finished) == len(jobs)
+    assert finished[-1].files_done == len(jobs)
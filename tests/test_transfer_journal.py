@@ -0,0 +1,106 @@
+import hashlib
+import os
+
+import pytest
+
+import copy_utils
+
+from copy_utils import DIGEST_MD5
+from copy_utils import copy_with_callback
+
+from transfer_journal import TransferJournal
+
+SIZE = 3 * 1024 * 1024
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "GX010001.MP4"
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+
+def interrupted_copy(source, dest, offset):
+    """ Leaves `dest` as a copy interrupted right after a checkpoint at `offset` """
+    journal = TransferJournal(dest)
+    with open(journal.partial_path, "wb") as f:
+        f.write(source.read_bytes()[:offset])
+        journal.checkpoint(f, source, offset)
+    return journal
+
+
+def test_resume_offset_of_a_checkpointed_copy(tmp_path, source):
+    journal = interrupted_copy(source, tmp_path / "dest.MP4", 2 * 1024 * 1024)
+    assert journal.resume_offset(source) == 2 * 1024 * 1024
+
+
+def test_nothing_to_resume_without_journal(tmp_path, source):
+    assert TransferJournal(tmp_path / "dest.MP4").resume_offset(source) == 0
+
+
+def test_source_changed_since_the_checkpoint(tmp_path, source):
+    journal = interrupted_copy(source, tmp_path / "dest.MP4", 1024 * 1024)
+    source.write_bytes(os.urandom(SIZE + 1))
+    assert journal.resume_offset(source) == 0
+
+
+def test_partial_data_lost_after_the_checkpoint(tmp_path, source):
+    journal = interrupted_copy(source, tmp_path / "dest.MP4", 2 * 1024 * 1024)
+
+    # e.g. power loss: the journal reached the disk, not the data before it
+    with open(journal.partial_path, "r+b") as f:
+        f.seek(2 * 1024 * 1024 - 10)
+        f.write(b"\0" * 10)
+    assert journal.resume_offset(source) == 0
+
+    with open(journal.partial_path, "r+b") as f:
+        f.truncate(1024)
+    assert journal.resume_offset(source) == 0
+
+
+def test_copy_resumes_from_the_checkpoint(tmp_path, source, capsys):
+    dest = tmp_path / "dest.MP4"
+    journal = interrupted_copy(source, dest, 2 * 1024 * 1024)
+
+    reported = list()
+    _, digests = copy_with_callback(
+        source, dest, callback=lambda copied, total_copied, total: reported.append(total_copied),
+        digests=[DIGEST_MD5], resumable=True
+    )
+
+    assert "Resuming" in capsys.readouterr().out
+    assert dest.read_bytes() == source.read_bytes()
+    assert digests[DIGEST_MD5] == hashlib.md5(source.read_bytes()).hexdigest()
+    assert reported[-1] == SIZE
+
+    # Renamed once complete, the journal is gone
+    assert not os.path.exists(journal.partial_path)
+    assert not os.path.exists(journal.path)
+
+
+def test_mismatching_partial_is_copied_again(tmp_path, source):
+    dest = tmp_path / "dest.MP4"
+    journal = interrupted_copy(source, dest, 2 * 1024 * 1024)
+    with open(journal.partial_path, "r+b") as f:
+        f.seek(2 * 1024 * 1024 - 100)
+        f.write(b"garbage")
+
+    copy_with_callback(source, dest, resumable=True)
+    assert dest.read_bytes() == source.read_bytes()
+
+
+def test_destination_only_appears_once_complete(tmp_path, source, monkeypatch):
+    dest = tmp_path / "dest.MP4"
+    monkeypatch.setattr(copy_utils, "CALLBACK_INTERVAL", -1)  # Called at every buffer
+
+    def interrupt(copied, total_copied, total):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        copy_with_callback(source, dest, callback=interrupt, buffer_size=64 * 1024, resumable=True)
+
+    assert not dest.exists()
+    assert os.path.exists(TransferJournal(dest).partial_path)
+
+    copy_with_callback(source, dest, resumable=True)
+    assert dest.read_bytes() == source.read_bytes()
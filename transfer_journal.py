@@ -0,0 +1,96 @@
+""" Crash-safe journal of a file copy, allowing to resume an interrupted transfer """
+
+import json
+import os
+
+
+PARTIAL_SUFFIX = ".partial"
+JOURNAL_SUFFIX = ".partial.json"
+JOURNAL_VERSION = 1
+
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024  # fdatasync + journal update every 64 MB
+VERIFY_SIZE = 1024 * 1024  # Bytes before the journaled offset compared on resume
+
+
+class TransferJournal(object):
+    """ Data is copied to `<dest>.partial`, `<dest>.partial.json` holds the
+    offset up to which the partial file is known to be on disk.
+
+    An offset is only journaled once the data before it was flushed with
+    `fdatasync`, so a power loss can only lose the data written after the
+    last checkpoint. The destination only appears under its final name
+    once complete.
+    """
+
+    def __init__(self, destfile):
+        self.destfile = str(destfile)
+        self.partial_path = self.destfile + PARTIAL_SUFFIX
+        self.path = self.destfile + JOURNAL_SUFFIX
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        return data if data.get("version") == JOURNAL_VERSION else None
+
+    def resume_offset(self, srcfile):
+        """ Returns the offset the copy of `srcfile` can resume from, 0 if the
+        partial file doesn't match the journal or the source changed since.
+        """
+        if (data := self._load()) is None:
+            return 0
+
+        src_st = os.stat(srcfile)
+        if (data["source_size"], data["source_mtime_ns"]) != (src_st.st_size, src_st.st_mtime_ns):
+            return 0
+
+        offset = data["offset"]
+        try:
+            if os.stat(self.partial_path).st_size < offset:
+                return 0
+
+            # The last journaled chunk must have reached the disk intact
+            start = max(0, offset - VERIFY_SIZE)
+            with open(srcfile, "rb") as fsrc, open(self.partial_path, "rb") as fpartial:
+                fsrc.seek(start)
+                fpartial.seek(start)
+                if fsrc.read(offset - start) != fpartial.read(offset - start):
+                    return 0
+        except OSError:
+            return 0
+
+        return offset
+
+    def checkpoint(self, fdest, srcfile, offset):
+        """ Flushes `fdest` up to `offset` and journals it """
+        os.fdatasync(fdest.fileno())
+
+        src_st = os.stat(srcfile)
+        data = {
+            "version": JOURNAL_VERSION,
+            "source": os.fspath(srcfile),
+            "source_size": src_st.st_size,
+            "source_mtime_ns": src_st.st_mtime_ns,
+            "offset": offset,
+        }
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def commit(self):
+        """ Renames the complete partial file to its final name """
+        os.replace(self.partial_path, self.destfile)
+        self.discard_journal()
+
+    def discard_journal(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
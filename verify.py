@@ -0,0 +1,72 @@
+""" Check whether a target file is an identical copy of a source file """
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from copy_utils import DIGEST_MD5
+from copy_utils import new_digest
+
+
+HASH_BUFFER_SIZE = 8 * 1024 * 1024  # 8 MB
+
+VERIFY_SIZE = "size"                # Sizes only
+VERIFY_FINGERPRINT = "fingerprint"  # Sizes then partial-content fingerprints
+VERIFY_FULL = "full"                # Sizes, fingerprints then full md5
+
+
+def hash_file(path, algo=DIGEST_MD5, buffer_size=HASH_BUFFER_SIZE):
+    """ Returns the hexdigest of `path`, read through a single reused buffer """
+    hasher = new_digest(algo)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+
+    with open(path, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            hasher.update(view[:size])
+
+    return hasher.hexdigest()
+
+
+def _in_parallel(source_fn, target_fn):
+    """ Source and target are separate devices: both are read at the same time """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        source_future = executor.submit(source_fn)
+        target_future = executor.submit(target_fn)
+        return source_future.result(), target_future.result()
+
+
+def verify(source, target, mode=VERIFY_FINGERPRINT):
+    """ Returns True if `target` is identical to `source`.
+
+    Args:
+        source, target: `runtime.VideoFile`, their digests are looked up in
+            and saved to the hash index of their device.
+        mode: one of `VERIFY_*`, each mode runs the checks of the previous
+            one first and stops at the first difference.
+    """
+    if mode not in (VERIFY_SIZE, VERIFY_FINGERPRINT, VERIFY_FULL):
+        raise ValueError(f"Unknown verification mode: `{mode}`")
+
+    if not target.is_file():
+        return False
+
+    if os.stat(source).st_size != os.stat(target).st_size:
+        return False
+
+    if mode == VERIFY_SIZE:
+        return True
+
+    source_fp, target_fp = _in_parallel(
+        lambda: source.fingerprint, lambda: target.fingerprint
+    )
+    if source_fp != target_fp:
+        return False
+
+    if mode == VERIFY_FINGERPRINT:
+        return True
+
+    source_md5, target_md5 = _in_parallel(
+        lambda: source.md5sum, lambda: target.md5sum
+    )
+    return source_md5 == target_md5